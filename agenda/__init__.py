@@ -0,0 +1,60 @@
+# __init__.py
+
+"""Core of the agenda app: contacts, database, search, photos and files.
+
+Nothing in this package imports Qt, so scripts, batch jobs and headless
+servers can read and write the agenda without a display. The desktop UI
+(main_window) is built on top of it.
+
+Submodules are only imported when one of their names is first used, so
+``import agenda`` costs nothing:
+
+    import agenda
+
+    repository = agenda.ContactRepository("contacts.db")
+    print(repository.get(1))
+
+From a shell, see agenda.cli:
+
+    python -m agenda list
+"""
+
+import importlib
+
+# Public names and the submodule defining them.
+_EXPORTS = {
+    "Contact": "agenda.contact",
+    "DEFAULT_IMAGE": "agenda.contact",
+    "sort_key": "agenda.contact",
+    "ConnectionPool": "agenda.repository",
+    "ContactRepository": "agenda.repository",
+    "DATABASE": "agenda.repository",
+    "PHOTO_SIZES": "agenda.photo_store",
+    "PhotoStore": "agenda.photo_store",
+    "build_match_query": "agenda.search",
+    "export_contacts": "agenda.contact_io",
+    "import_contacts": "agenda.contact_io",
+    "store_imported_photos": "agenda.contact_io",
+    "sync_databases": "agenda.sync",
+}
+
+__all__ = sorted(_EXPORTS)
+
+
+def __getattr__(name):
+    """Import the submodule defining a public name on first use."""
+
+    module = _EXPORTS.get(name)
+
+    if module is None:
+        raise AttributeError(
+            "module 'agenda' has no attribute '{}'".format(name))
+
+    value = getattr(importlib.import_module(module), name)
+    globals()[name] = value
+
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_EXPORTS))
@@ -0,0 +1,9 @@
+# __main__.py
+
+"""Entry point of ``python -m agenda``, see agenda.cli."""
+
+import sys
+
+from agenda.cli import main
+
+sys.exit(main())
@@ -0,0 +1,431 @@
+# cli.py
+
+"""Command line interface of the agenda app.
+
+Works without Qt or a display, Pillow is only imported by the commands
+writing photos.
+
+Usage:
+    python -m agenda list --letter S --limit 20
+    python -m agenda show 42
+    python -m agenda search jo sm
+    python -m agenda add John Smith 555-0100 --photo john.jpg
+    python -m agenda import contacts.csv
+    python -m agenda export contacts.vcf --vcard-version 4.0
+    python -m agenda stats
+    python -m agenda duplicates
+    python -m agenda generate 100000 --photos 200 --seed 1
+    python -m agenda serve --port 8080
+    python -m agenda sync other.db
+    python -m agenda backup
+    python -m agenda check --reset-missing
+    python -m agenda photos --workers 8 --reset-missing
+"""
+
+import argparse
+import sqlite3
+import sys
+
+from agenda.contact_io import (VCARD_VERSIONS, export_contacts,
+                               import_contacts, store_imported_photos)
+from agenda.instrumentation import instrumentation
+from agenda.repository import DATABASE, ContactRepository
+
+# Number of rows read from the database at a time by list.
+PAGE_SIZE = 256
+
+# Photos between two progress lines of photos.
+PROGRESS_STEP = 1000
+
+
+def print_rows(rows):
+    """Print contact list rows, one tab separated line per contact."""
+
+    for row in rows:
+        print("{}\t{}\t{}".format(row[0], row[1], row[2]))
+
+
+########################################################################
+# Commands
+########################################################################
+def command_list(repository, arguments):
+    """List contacts in alphabetical order, surname first."""
+
+    from agenda.contact import letter_key
+
+    after = letter_key(arguments.letter)
+    remaining = arguments.limit
+
+    while remaining > 0:
+        limit = min(remaining, PAGE_SIZE)
+        rows = repository.list_page(after, limit)
+        print_rows(rows)
+
+        if len(rows) < limit:
+            break
+
+        remaining -= len(rows)
+        after = (rows[-1][3], rows[-1][0])
+
+    return 0
+
+
+def command_show(repository, arguments):
+    """Print every field of a contact."""
+
+    contact = repository.get(arguments.id)
+
+    if contact is None:
+        print("Contact {} not found".format(arguments.id), file=sys.stderr)
+
+        return 1
+
+    for field in ("id", "name", "surname", "phone", "email", "image",
+                  "address"):
+        print("{}: {}".format(field, getattr(contact, field)))
+
+    return 0
+
+
+def command_search(repository, arguments):
+    """Print the contacts matching a search, best ranked first."""
+
+    from agenda.search import build_match_query
+
+    match_query = build_match_query(" ".join(arguments.text))
+
+    if match_query is None:
+        return 0
+
+    print_rows(repository.search_page(match_query, arguments.limit))
+
+    return 0
+
+
+def command_add(repository, arguments):
+    """Add a contact and print its id."""
+
+    from agenda.contact import DEFAULT_IMAGE, Contact
+    from agenda.photo_store import PhotoStore
+
+    image = DEFAULT_IMAGE
+
+    if arguments.photo:
+        image = PhotoStore().put(arguments.photo)
+
+    print(repository.insert(Contact(None,
+                                    arguments.name,
+                                    arguments.surname,
+                                    arguments.phone,
+                                    arguments.email,
+                                    image,
+                                    arguments.address)))
+
+    return 0
+
+
+def command_import(repository, arguments):
+    """Import a CSV or vCard file, then store the pictures it references."""
+
+    from agenda.photo_store import PhotoStore
+
+    count = import_contacts(repository, arguments.path)
+    print("{} contacts imported".format(count))
+
+    if not arguments.skip_photos:
+        stored, failed = store_imported_photos(repository, PhotoStore())
+        print("{} photos stored, {} failed".format(stored, failed))
+
+    return 0
+
+
+def command_export(repository, arguments):
+    """Export every contact to a CSV or vCard file."""
+
+    count = export_contacts(repository,
+                            arguments.path,
+                            arguments.vcard_version)
+    print("{} contacts exported".format(count))
+
+    return 0
+
+
+def command_stats(repository, arguments):
+    """Print figures about the database and contacts per initial."""
+
+    for name, value in repository.stats().items():
+        print("{}: {}".format(name, value))
+
+    for letter, count in repository.letter_counts():
+        print("{}: {}".format(letter, count))
+
+    return 0
+
+
+def command_duplicates(repository, arguments):
+    """Print groups of likely duplicate contacts, one group per line."""
+
+    groups = repository.duplicate_groups()
+
+    for group in groups:
+        print("\t".join("{} {} {}".format(contact.id, contact.name,
+                                           contact.surname)
+                         for contact in map(repository.get, group)))
+
+    print("{} groups found".format(len(groups)), file=sys.stderr)
+
+    return 0
+
+
+def command_generate(repository, arguments):
+    """Add seeded synthetic contacts, see agenda.synthetic."""
+
+    from agenda.photo_store import PhotoStore
+    from agenda.synthetic import generate_pictures, populate
+
+    pictures = []
+
+    if arguments.photos:
+        pictures = generate_pictures(arguments.pictures_directory,
+                                     arguments.photos,
+                                     arguments.seed)
+
+    count = populate(repository,
+                     arguments.count,
+                     arguments.seed,
+                     pictures,
+                     PhotoStore(),
+                     arguments.duplicates)
+    print("{} contacts generated".format(count))
+
+    return 0
+
+
+def command_serve(repository, arguments):
+    """Serve the agenda as an HTTP/JSON API, see agenda.server."""
+
+    from agenda.server import serve
+
+    serve(repository, arguments.host, arguments.port)
+
+    return 0
+
+
+def command_sync(repository, arguments):
+    """Exchange changes with another database file or API server."""
+
+    from agenda.sync import new_site, sync_databases, sync_url
+
+    if arguments.new_site:
+        print("Site id {}".format(new_site(repository.connection())))
+
+    if arguments.peer.startswith(("http://", "https://")):
+        result = sync_url(repository, arguments.peer)
+    else:
+        result = sync_databases(repository,
+                                ContactRepository(arguments.peer))
+
+    print("{pulled} changes pulled, {pushed} pushed, "
+          "{kept} kept on the newer side".format(**result))
+
+    return 0
+
+
+def command_backup(repository, arguments):
+    """Copy the database while it is in use, see agenda.maintenance."""
+
+    print("Backup written to {}".format(
+        repository.backup(arguments.directory)))
+
+    return 0
+
+
+def command_check(repository, arguments):
+    """Check the database and the pictures of the contacts, then compact."""
+
+    problems = repository.quick_check()
+
+    for problem in problems:
+        print(problem)
+
+    missing = repository.missing_images()
+
+    for path, count in missing:
+        print("{}: missing, used by {} contacts".format(path, count))
+
+    if missing and arguments.reset_missing:
+        print("{} contacts given the default picture".format(
+            repository.reset_images([path for path, _ in missing])))
+        missing = []
+
+    if not problems:
+        print("{} free pages reclaimed".format(repository.reclaim_space()))
+
+    return 1 if problems or missing else 0
+
+
+def command_photos(repository, arguments):
+    """Store, check and repair every photo, using all the cores."""
+
+    from agenda.photo_maintenance import OUTCOMES, maintain_photos
+    from agenda.photo_store import PhotoStore
+
+    def progress(done, total):
+        if done % PROGRESS_STEP == 0 or done == total:
+            print("{}/{} photos".format(done, total), file=sys.stderr)
+
+    result = maintain_photos(repository, PhotoStore(), arguments.workers,
+                             progress, arguments.reset_missing)
+
+    for path, error in result["errors"]:
+        print("{}: {}".format(path, error))
+
+    print(", ".join("{} {}".format(result[outcome], outcome)
+                    for outcome in OUTCOMES))
+
+    if result["errors"] and arguments.reset_missing:
+        print("Contacts of {} pictures given the default picture".format(
+            len(result["errors"])))
+
+    return 1 if result["errors"] and not arguments.reset_missing else 0
+
+
+def create_parser():
+    """Create the parser of the command line arguments."""
+
+    parser = argparse.ArgumentParser(
+        prog="agenda",
+        description="Read and write the contacts of the agenda.")
+    parser.add_argument("--database",
+                        default=DATABASE,
+                        help="database file, default %(default)s")
+    parser.add_argument("--profile",
+                        metavar="PATH",
+                        help="write timings of the command to a JSON file")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    command = commands.add_parser("list", help=command_list.__doc__)
+    command.add_argument("--letter", help="start at an initial, A to Z")
+    command.add_argument("--limit", type=int, default=50)
+    command.set_defaults(handler=command_list)
+
+    command = commands.add_parser("show", help=command_show.__doc__)
+    command.add_argument("id", type=int)
+    command.set_defaults(handler=command_show)
+
+    command = commands.add_parser("search", help=command_search.__doc__)
+    command.add_argument("text", nargs="+")
+    command.add_argument("--limit", type=int, default=50)
+    command.set_defaults(handler=command_search)
+
+    command = commands.add_parser("add", help=command_add.__doc__)
+    command.add_argument("name")
+    command.add_argument("surname")
+    command.add_argument("phone")
+    command.add_argument("--email", default="")
+    command.add_argument("--address", default="")
+    command.add_argument("--photo", help="picture added to the photo store")
+    command.set_defaults(handler=command_add)
+
+    command = commands.add_parser("import", help=command_import.__doc__)
+    command.add_argument("path", help="CSV (.csv) or vCard (.vcf) file")
+    command.add_argument("--skip-photos",
+                         action="store_true",
+                         help="do not add imported pictures to the store")
+    command.set_defaults(handler=command_import)
+
+    command = commands.add_parser("export", help=command_export.__doc__)
+    command.add_argument("path", help="CSV (.csv) or vCard (.vcf) file")
+    command.add_argument("--vcard-version",
+                         choices=VCARD_VERSIONS,
+                         default="3.0")
+    command.set_defaults(handler=command_export)
+
+    command = commands.add_parser("stats", help=command_stats.__doc__)
+    command.set_defaults(handler=command_stats)
+
+    command = commands.add_parser("duplicates",
+                                  help=command_duplicates.__doc__)
+    command.set_defaults(handler=command_duplicates)
+
+    command = commands.add_parser("generate", help=command_generate.__doc__)
+    command.add_argument("count", type=int)
+    command.add_argument("--seed", type=int, default=0)
+    command.add_argument("--photos",
+                         type=int,
+                         default=0,
+                         help="distinct pictures shared by the contacts")
+    command.add_argument("--duplicates",
+                         type=float,
+                         default=0.0,
+                         help="share of contacts duplicating another one")
+    command.add_argument("--pictures-directory",
+                         default="synthetic",
+                         help="where generated pictures are written")
+    command.set_defaults(handler=command_generate)
+
+    command = commands.add_parser("serve", help=command_serve.__doc__)
+    command.add_argument("--host", default="127.0.0.1")
+    command.add_argument("--port", type=int, default=8080)
+    command.set_defaults(handler=command_serve)
+
+    command = commands.add_parser("sync", help=command_sync.__doc__)
+    command.add_argument("peer",
+                         help="database file or server URL, like "
+                              "http://127.0.0.1:8080")
+    command.add_argument("--new-site",
+                         action="store_true",
+                         help="give a copied database its own site id first")
+    command.set_defaults(handler=command_sync)
+
+    command = commands.add_parser("backup", help=command_backup.__doc__)
+    command.add_argument("--directory",
+                         help="where backups are written, default backups "
+                              "next to the database")
+    command.set_defaults(handler=command_backup)
+
+    command = commands.add_parser("check", help=command_check.__doc__)
+    command.add_argument("--reset-missing",
+                         action="store_true",
+                         help="give contacts whose picture is missing the "
+                              "default picture")
+    command.set_defaults(handler=command_check)
+
+    command = commands.add_parser("photos", help=command_photos.__doc__)
+    command.add_argument("--workers",
+                         type=int,
+                         help="worker processes, default one per core")
+    command.add_argument("--reset-missing",
+                         action="store_true",
+                         help="give contacts whose picture is missing or "
+                              "corrupt the default picture")
+    command.set_defaults(handler=command_photos)
+
+    return parser
+
+
+def main(argv=None):
+    """Run a command of the command line.
+
+    Return:
+        The exit status, 0 on success.
+    """
+
+    arguments = create_parser().parse_args(argv)
+
+    if arguments.profile:
+        instrumentation.enable()
+
+    try:
+        repository = ContactRepository(arguments.database)
+
+        return arguments.handler(repository, arguments)
+
+    except (OSError, ValueError, sqlite3.Error) as error:
+        print("agenda: {}".format(error), file=sys.stderr)
+
+        return 1
+
+    finally:
+        if arguments.profile:
+            instrumentation.dump(arguments.profile)
@@ -0,0 +1,100 @@
+# contact.py
+
+"""Contact record of the agenda app."""
+
+import unicodedata
+from dataclasses import dataclass
+
+# Image of the contacts without a photo.
+DEFAULT_IMAGE = "icons/person.png"
+
+# Columns of the Contacts table read into a Contact, in order.
+CONTACT_COLUMNS = "id, name, surname, phone, email, image, address"
+
+# Separates surname and name in sort keys, it sorts before any letter.
+SORT_KEY_SEPARATOR = "\x1f"
+
+
+def sort_key(surname, name):
+    """Get the key contacts are sorted by in the list.
+
+    Case and accents are ignored, so "Álvarez" sorts with "alvarez", and
+    surnames sort before names. The key does not depend on the locale of
+    the machine, it is stored in the database and indexed.
+
+    Return:
+        The sort key, a string.
+    """
+
+    parts = []
+
+    for part in (surname or "", name or ""):
+        decomposed = unicodedata.normalize("NFKD", part.strip().casefold())
+        parts.append("".join(character for character in decomposed
+                             if not unicodedata.combining(character)))
+
+    return SORT_KEY_SEPARATOR.join(parts)
+
+
+def letter_key(letter):
+    """Get the list key sorted right before the contacts of an initial.
+
+    Args:
+        letter: Letter "A" to "Z", None or "#" give the start of the list.
+
+    Return:
+        A tuple (sort_key, id) to read the list after, see
+        ContactRepository.list_page().
+    """
+
+    if letter and letter.isalpha():
+        return (letter.lower(), -1)
+
+    return ("", 0)
+
+
+@dataclass(frozen=True)
+class Contact:
+    """One row of the Contacts table.
+
+    Slots keep every instance small, which matters for the contacts kept in
+    the repository cache. Instances are shared through that cache, so they
+    are frozen.
+    """
+
+    __slots__ = ("id", "name", "surname", "phone", "email", "image", "address")
+
+    id: int
+    name: str
+    surname: str
+    phone: str
+    email: str
+    image: str
+    address: str
+
+    @classmethod
+    def from_row(cls, row):
+        """Create a contact from a row of the CONTACT_COLUMNS.
+
+        Return:
+            A Contact or None if row is None.
+        """
+
+        if row is None:
+            return None
+
+        return cls(*row)
+
+    def values(self):
+        """Get the column values written on insert, without the id.
+
+        Return:
+            A tuple (name, surname, phone, email, image, address).
+        """
+
+        return (self.name,
+                self.surname,
+                self.phone,
+                self.email,
+                self.image,
+                self.address)
@@ -0,0 +1,414 @@
+# contact_io.py
+
+"""Import and export of contacts as CSV and vCard files.
+
+Files are read and written as streams: readers are generators feeding a
+single executemany() transaction and exports iterate over a database
+cursor, so memory stays flat whatever the number of contacts.
+
+Pictures referenced by imported contacts are added to the photo store in a
+second pass, see store_imported_photos().
+
+Usage:
+    python -m agenda import contacts.csv
+    python -m agenda export contacts.vcf --vcard-version 4.0
+"""
+
+import csv
+import os
+import sqlite3
+from urllib.parse import unquote, urlparse
+
+from agenda.contact import DEFAULT_IMAGE, Contact
+from agenda.photo_store import PICTURE_ERRORS
+
+# Columns of the CSV files, in order.
+CSV_FIELDS = ("name", "surname", "phone", "email", "image", "address")
+
+# Supported vCard versions.
+VCARD_VERSIONS = ("3.0", "4.0")
+
+# Maximum line length of a vCard file, longer lines are folded.
+VCARD_LINE_LENGTH = 75
+
+
+def file_format(path):
+    """Guess the format of a contacts file from its extension.
+
+    Return:
+        "csv" or "vcard".
+    """
+
+    extension = os.path.splitext(path)[1].lower()
+
+    if extension == ".csv":
+        return "csv"
+
+    if extension in (".vcf", ".vcard"):
+        return "vcard"
+
+    raise ValueError("Unknown contacts file format: {}".format(path))
+
+
+def resolve_picture(value, base):
+    """Turn a picture reference of an imported file into a local path.
+
+    Args:
+        value: Path or file URI of the picture, may be empty.
+        base: Directory relative paths are resolved against.
+
+    Return:
+        The picture path or DEFAULT_IMAGE if there is no picture.
+    """
+
+    if not value:
+        return DEFAULT_IMAGE
+
+    if value.startswith("file:"):
+        value = unquote(urlparse(value).path)
+
+    return os.path.normpath(os.path.join(base, value))
+
+
+def picture_uri(path):
+    """Get the file URI exported for a contact picture."""
+
+    # urllib.request pulls in the http and email packages, only exports
+    # need it.
+    from urllib.request import pathname2url
+
+    return "file:" + pathname2url(os.path.abspath(path))
+
+
+########################################################################
+# CSV
+########################################################################
+def read_csv(stream, base="."):
+    """Read contacts from a CSV file with a header row.
+
+    Args:
+        stream: Text stream opened with newline="".
+        base: Directory relative picture paths are resolved against.
+
+    Yields:
+        Contact instances without id.
+    """
+
+    for row in csv.DictReader(stream):
+        values = [(row.get(field) or "").strip() for field in CSV_FIELDS]
+        values[4] = resolve_picture(values[4], base)
+
+        yield Contact(None, *values)
+
+
+def write_csv(contacts, stream):
+    """Write contacts to a CSV file with a header row.
+
+    Return:
+        The number of written contacts.
+    """
+
+    writer = csv.writer(stream)
+    writer.writerow(CSV_FIELDS)
+    count = 0
+
+    for contact in contacts:
+        values = list(contact.values())
+
+        if values[4] and values[4] != DEFAULT_IMAGE:
+            values[4] = os.path.abspath(values[4])
+        else:
+            values[4] = ""
+
+        writer.writerow(values)
+        count += 1
+
+    return count
+
+
+########################################################################
+# vCard
+########################################################################
+def unfold(stream):
+    """Yield the logical lines of a vCard stream, joining folded lines."""
+
+    line = None
+
+    for raw in stream:
+        raw = raw.rstrip("\r\n")
+
+        if raw[:1] in (" ", "\t") and line is not None:
+            line += raw[1:]
+            continue
+
+        if line:
+            yield line
+
+        line = raw
+
+    if line:
+        yield line
+
+
+def unescape(value):
+    """Remove vCard escapes from a property value."""
+
+    result = []
+    characters = iter(value)
+
+    for character in characters:
+        if character == "\\":
+            character = next(characters, "")
+            character = "\n" if character in ("n", "N") else character
+
+        result.append(character)
+
+    return "".join(result)
+
+
+def split_components(value):
+    """Split a structured vCard value on unescaped semicolons."""
+
+    components = [""]
+    escaped = False
+
+    for character in value:
+        if escaped:
+            components[-1] += "\\" + character
+            escaped = False
+        elif character == "\\":
+            escaped = True
+        elif character == ";":
+            components.append("")
+        else:
+            components[-1] += character
+
+    return [unescape(component) for component in components]
+
+
+def parse_property(line):
+    """Split a vCard line in its name, parameters and value.
+
+    Return:
+        A tuple (name, parameters, value), the name in upper case and the
+        parameters as a dict of upper case names.
+    """
+
+    head, _, value = line.partition(":")
+    name, *parameters = head.split(";")
+    name = name.rsplit(".", 1)[-1].upper()
+    parsed = {}
+
+    for parameter in parameters:
+        key, _, parameter_value = parameter.partition("=")
+        parsed[key.upper()] = parameter_value.strip('"')
+
+    return name, parsed, value
+
+
+def read_vcard(stream, base="."):
+    """Read contacts from a vCard 3.0 or 4.0 file.
+
+    Only the first phone, email and address of a card are kept. Photos
+    given as a path or file URI are imported, embedded photos are skipped.
+
+    Args:
+        stream: Text stream of the vCard file.
+        base: Directory relative picture paths are resolved against.
+
+    Yields:
+        Contact instances without id.
+    """
+
+    card = None
+
+    for line in unfold(stream):
+        name, parameters, value = parse_property(line)
+
+        if name == "BEGIN" and value.upper() == "VCARD":
+            card = {}
+
+        elif name == "END" and value.upper() == "VCARD" and card is not None:
+            yield Contact(None,
+                          card.get("name", ""),
+                          card.get("surname", ""),
+                          card.get("phone", ""),
+                          card.get("email", ""),
+                          resolve_picture(card.get("image", ""), base),
+                          card.get("address", ""))
+            card = None
+
+        elif card is None:
+            continue
+
+        elif name == "N":
+            components = split_components(value) + ["", ""]
+            card["surname"] = components[0]
+            card["name"] = components[1]
+
+        elif name == "FN" and "name" not in card:
+            card["name"], _, card["surname"] = unescape(value).partition(" ")
+
+        elif name == "TEL":
+            card.setdefault("phone", unescape(value))
+
+        elif name == "EMAIL":
+            card.setdefault("email", unescape(value))
+
+        elif name == "ADR":
+            parts = [part for part in split_components(value) if part]
+            card.setdefault("address", ", ".join(parts))
+
+        elif name == "PHOTO":
+            embedded = ("ENCODING" in parameters or
+                        value.startswith("data:"))
+
+            if not embedded:
+                card.setdefault("image", value)
+
+
+def escape(value):
+    """Escape a property value for a vCard file."""
+
+    return (value.replace("\\", "\\\\")
+                 .replace(",", "\\,")
+                 .replace(";", "\\;")
+                 .replace("\r\n", "\\n")
+                 .replace("\n", "\\n"))
+
+
+def fold(line):
+    """Fold a vCard line longer than VCARD_LINE_LENGTH characters."""
+
+    if len(line) <= VCARD_LINE_LENGTH:
+        return line + "\r\n"
+
+    parts = [line[:VCARD_LINE_LENGTH]]
+
+    for start in range(VCARD_LINE_LENGTH, len(line), VCARD_LINE_LENGTH - 1):
+        parts.append(" " + line[start:start + VCARD_LINE_LENGTH - 1])
+
+    return "\r\n".join(parts) + "\r\n"
+
+
+def write_vcard(contacts, stream, version="3.0"):
+    """Write contacts to a vCard file.
+
+    Return:
+        The number of written contacts.
+    """
+
+    if version not in VCARD_VERSIONS:
+        raise ValueError("Unsupported vCard version: {}".format(version))
+
+    count = 0
+
+    for contact in contacts:
+        lines = ["BEGIN:VCARD",
+                 "VERSION:" + version,
+                 "N:{};{};;;".format(escape(contact.surname),
+                                     escape(contact.name)),
+                 "FN:" + escape("{} {}".format(contact.name,
+                                               contact.surname).strip())]
+
+        if contact.phone:
+            lines.append("TEL:" + escape(contact.phone))
+
+        if contact.email:
+            lines.append("EMAIL:" + escape(contact.email))
+
+        if contact.address:
+            lines.append("ADR:;;{};;;;".format(escape(contact.address)))
+
+        if contact.image and contact.image != DEFAULT_IMAGE:
+            if version == "3.0":
+                lines.append("PHOTO;VALUE=uri:" + picture_uri(contact.image))
+            else:
+                lines.append("PHOTO:" + picture_uri(contact.image))
+
+        lines.append("END:VCARD")
+        stream.write("".join(fold(line) for line in lines))
+        count += 1
+
+    return count
+
+
+########################################################################
+# Files
+########################################################################
+def import_contacts(repository, path):
+    """Import every contact of a CSV or vCard file in one transaction.
+
+    Return:
+        The number of imported contacts.
+    """
+
+    base = os.path.dirname(os.path.abspath(path))
+    reader = read_csv if file_format(path) == "csv" else read_vcard
+
+    with open(path, newline="", encoding="utf-8-sig") as stream:
+        return repository.bulk_insert(reader(stream, base))
+
+
+def export_contacts(repository, path, vcard_version="3.0", contact_ids=None):
+    """Export contacts to a CSV or vCard file.
+
+    Args:
+        contact_ids: Ids of the contacts to export, None for all of them.
+
+    Return:
+        The number of exported contacts.
+    """
+
+    if contact_ids is None:
+        contacts = repository.iter_all()
+    else:
+        contacts = repository.iter_some(contact_ids)
+
+    with open(path, "w", newline="", encoding="utf-8") as stream:
+        if file_format(path) == "csv":
+            return write_csv(contacts, stream)
+
+        return write_vcard(contacts, stream, vcard_version)
+
+
+def store_imported_photos(repository, store):
+    """Add the pictures referenced by imported contacts to the photo store.
+
+    Contacts whose picture can not be read get the default image. The
+    contacts of a page of pending_photos() are updated in one transaction.
+
+    Return:
+        A tuple (stored, failed) with the number of processed contacts.
+    """
+
+    stored = failed = 0
+    last_id = 0
+
+    while True:
+        pending = repository.pending_photos(last_id)
+
+        if not pending:
+            return stored, failed
+
+        changes = []
+
+        for contact_id, picture in pending:
+            try:
+                path = store.put(picture)
+            except PICTURE_ERRORS:
+                path = DEFAULT_IMAGE
+
+            changes.append((path, contact_id))
+
+        page_stored = sum(path != DEFAULT_IMAGE for path, _ in changes)
+
+        try:
+            repository.set_images(changes)
+        except sqlite3.Error:
+            page_stored = 0
+
+        stored += page_stored
+        failed += len(changes) - page_stored
+        last_id = pending[-1][0]
+
@@ -0,0 +1,215 @@
+# duplicates.py
+
+"""Detection of duplicate contacts.
+
+Every contact gets normalized phone and email keys, stored in indexed
+columns and kept up to date by triggers:
+
+    "+34 600-11-22-33", "0034 600112233" and "600 11 22 33"
+        -> phone_key "600112233"
+    " Ana.Lopez@Mail.COM " -> email_key "ana.lopez@mail.com"
+
+Contacts sharing a key form a block. Names are only compared inside a
+block, so a scan costs two index ordered passes over Contacts instead of
+comparing every pair of contacts. A new contact is checked with a single
+lookup on both indexes, see similar_contacts().
+"""
+
+import re
+from difflib import SequenceMatcher
+
+# Trailing digits of a number kept in its key. International and national
+# forms of a number share their last digits, country codes and trunk
+# prefixes do not.
+PHONE_KEY_DIGITS = 9
+
+# Shorter numbers, like extensions, get no key.
+PHONE_MIN_DIGITS = 6
+
+# Name similarity, 0 to 1, from which contacts sharing a key are
+# duplicates.
+NAME_THRESHOLD = 0.8
+
+# Blocks bigger than this, like a switchboard number shared by a whole
+# company, are not compared.
+MAX_BLOCK_SIZE = 50
+
+NON_DIGITS = re.compile(r"\D")
+
+
+def phone_key(phone):
+    """Get the duplicate detection key of a phone number.
+
+    Return:
+        The last PHONE_KEY_DIGITS digits or None if the number is too
+        short.
+    """
+
+    digits = NON_DIGITS.sub("", phone or "")
+
+    if len(digits) < PHONE_MIN_DIGITS:
+        return None
+
+    return digits[-PHONE_KEY_DIGITS:]
+
+
+def email_key(email):
+    """Get the duplicate detection key of an email address.
+
+    Return:
+        The address trimmed and case folded, None if it is not one.
+    """
+
+    email = (email or "").strip().casefold()
+
+    if "@" not in email:
+        return None
+
+    return email
+
+
+def duplicate_keys_sql():
+    """Get the script adding the phone_key and email_key columns.
+
+    Keys are computed by agenda_phone_key() and agenda_email_key(), which
+    every pooled connection registers.
+
+    Return:
+        The SQL script, applied by the migrations module.
+    """
+
+    return '''
+        ALTER TABLE Contacts ADD COLUMN phone_key TEXT;
+        ALTER TABLE Contacts ADD COLUMN email_key TEXT;
+
+        UPDATE Contacts SET phone_key = agenda_phone_key(phone),
+                            email_key = agenda_email_key(email);
+
+        CREATE INDEX IF NOT EXISTS Contacts_phone_key
+            ON Contacts (phone_key) WHERE phone_key IS NOT NULL;
+        CREATE INDEX IF NOT EXISTS Contacts_email_key
+            ON Contacts (email_key) WHERE email_key IS NOT NULL;
+
+        CREATE TRIGGER IF NOT EXISTS Contacts_keys_insert
+        AFTER INSERT ON Contacts BEGIN
+            UPDATE Contacts SET phone_key = agenda_phone_key(new.phone),
+                                email_key = agenda_email_key(new.email)
+            WHERE id = new.id;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS Contacts_keys_update
+        AFTER UPDATE OF phone, email ON Contacts BEGIN
+            UPDATE Contacts SET phone_key = agenda_phone_key(new.phone),
+                                email_key = agenda_email_key(new.email)
+            WHERE id = new.id;
+        END;
+        '''
+
+
+def name_similarity(first, second):
+    """Compare two sort keys, see agenda.contact.sort_key().
+
+    Return:
+        A ratio from 0, nothing in common, to 1, same name.
+    """
+
+    if first == second:
+        return 1.0
+
+    return SequenceMatcher(None, first or "", second or "").ratio()
+
+
+def find_duplicates(connection, threshold=NAME_THRESHOLD,
+                    max_block_size=MAX_BLOCK_SIZE):
+    """Find groups of contacts that are likely the same person.
+
+    Contacts are read block after block in the order of the key indexes,
+    only contacts sharing a key have their names compared. Pairs are
+    joined into groups, so A ~ B and B ~ C give one group [A, B, C].
+
+    Args:
+        connection: Open sqlite3 connection to the agenda database.
+        threshold: Minimum name similarity of duplicates.
+        max_block_size: Bigger blocks are skipped.
+
+    Return:
+        A list of groups, each a sorted list of contact ids, biggest
+        groups first.
+    """
+
+    parent = {}
+
+    def root(contact_id):
+        while parent[contact_id] != contact_id:
+            parent[contact_id] = parent[parent[contact_id]]
+            contact_id = parent[contact_id]
+
+        return contact_id
+
+    for column in ("phone_key", "email_key"):
+        # Only keys shared by several contacts are read.
+        rows = connection.execute(
+            '''SELECT {0}, id, sort_key FROM Contacts
+               WHERE {0} IN (SELECT {0} FROM Contacts
+                             WHERE {0} IS NOT NULL
+                             GROUP BY {0} HAVING COUNT(*) > 1)
+               ORDER BY {0}'''.format(column))
+
+        block = []
+        block_key = None
+
+        for key, contact_id, name in rows:
+            if key != block_key:
+                compare_block(block, threshold, max_block_size, parent, root)
+                block = []
+                block_key = key
+
+            block.append((contact_id, name))
+
+        compare_block(block, threshold, max_block_size, parent, root)
+
+    groups = {}
+
+    for contact_id in parent:
+        groups.setdefault(root(contact_id), []).append(contact_id)
+
+    return sorted((sorted(group) for group in groups.values()),
+                  key=lambda group: (-len(group), group[0]))
+
+
+def compare_block(block, threshold, max_block_size, parent, root):
+    """Join the contacts of a block whose names are similar.
+
+    Args:
+        block: List of tuples (id, sort_key) sharing a key.
+        parent: Union-find forest of find_duplicates(), updated in place.
+        root: Function giving the root of an id in parent.
+    """
+
+    if len(block) < 2 or len(block) > max_block_size:
+        return
+
+    for position, (first_id, first_name) in enumerate(block):
+        for second_id, second_name in block[position + 1:]:
+            if name_similarity(first_name, second_name) < threshold:
+                continue
+
+            parent.setdefault(first_id, first_id)
+            parent.setdefault(second_id, second_id)
+            parent[root(second_id)] = root(first_id)
+
+
+def similar_contacts(connection, phone, email, limit=5):
+    """Find contacts sharing the phone or email of a contact being added.
+
+    Both key indexes are searched by a single statement.
+
+    Return:
+        A list of tuples [(id, name, surname, phone, email),..]
+    """
+
+    return connection.execute(
+        '''SELECT id, name, surname, phone, email FROM Contacts
+           WHERE phone_key = ? OR email_key = ?
+           ORDER BY id LIMIT ?''',
+        (phone_key(phone), email_key(email), limit)).fetchall()
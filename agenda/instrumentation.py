@@ -0,0 +1,257 @@
+# instrumentation.py
+
+"""Opt-in latency instrumentation of the agenda app.
+
+Repository queries, photo work and UI refreshes are wrapped in named
+spans. While instrumentation is enabled every span records its duration,
+and percentiles are computed from the latest SAMPLES durations of each
+operation. SQL statements slower than SLOW_QUERY_MS are logged with
+their query plan.
+
+Instrumentation is off unless the AGENDA_PROFILE environment variable is
+set to 1 or enable() is called. While it is off a span costs a single
+attribute check.
+
+Usage:
+    from agenda.instrumentation import instrumentation
+
+    @instrumentation.timed("repository.get")
+    def get(self, contact_id):
+        ...
+
+    with instrumentation.span("ui.update_contact_list"):
+        ...
+"""
+
+import collections
+import functools
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# Durations kept per operation for the percentiles.
+SAMPLES = 2048
+
+# Statements slower than this are logged with their plan.
+SLOW_QUERY_MS = 20.0
+
+# Number of slow statements kept in the log.
+SLOW_QUERIES = 100
+
+# Statements EXPLAIN QUERY PLAN can describe.
+PLANNED_STATEMENTS = ("SELECT", "WITH", "INSERT", "UPDATE", "DELETE")
+
+
+def percentile(ordered, fraction):
+    """Get a percentile of sorted values by the nearest rank method."""
+
+    if not ordered:
+        return 0.0
+
+    rank = max(1, round(fraction * len(ordered)))
+
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+class Span:
+    """Context manager recording the duration of its block."""
+
+    __slots__ = ("instrumentation", "name", "start")
+
+    def __init__(self, instrumentation, name):
+        self.instrumentation = instrumentation
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+        return self
+
+    def __exit__(self, *exc_info):
+        self.instrumentation.record(self.name,
+                                    time.perf_counter() - self.start)
+
+        return False
+
+
+class NoSpan:
+    """Context manager doing nothing, used while instrumentation is off."""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+# Shared instance, it has no state.
+NO_SPAN = NoSpan()
+
+
+class Instrumentation:
+    """Collects span durations and slow statements from every thread."""
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._samples = {}
+        self._totals = {}
+        self._slow_queries = collections.deque(maxlen=SLOW_QUERIES)
+
+    def enable(self):
+        """Start recording spans."""
+
+        self.enabled = True
+
+    def disable(self):
+        """Stop recording spans, recorded data is kept."""
+
+        self.enabled = False
+
+    def reset(self):
+        """Forget every recorded duration and slow statement."""
+
+        with self._lock:
+            self._samples.clear()
+            self._totals.clear()
+            self._slow_queries.clear()
+
+    def span(self, name):
+        """Get a context manager timing its block as operation name."""
+
+        if not self.enabled:
+            return NO_SPAN
+
+        return Span(self, name)
+
+    def timed(self, name):
+        """Decorate a function to time every call as operation name."""
+
+        def decorator(function):
+
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return function(*args, **kwargs)
+
+                start = time.perf_counter()
+
+                try:
+                    return function(*args, **kwargs)
+                finally:
+                    self.record(name, time.perf_counter() - start)
+
+            return wrapper
+
+        return decorator
+
+    def record(self, name, seconds):
+        """Record one duration of an operation."""
+
+        with self._lock:
+            samples = self._samples.get(name)
+
+            if samples is None:
+                samples = self._samples[name] = collections.deque(
+                    maxlen=SAMPLES)
+                self._totals[name] = [0, 0.0, 0.0]
+
+            samples.append(seconds)
+            totals = self._totals[name]
+            totals[0] += 1
+            totals[1] += seconds
+            totals[2] = max(totals[2], seconds)
+
+    def record_query(self, connection, sql, parameters, seconds):
+        """Log a statement with its plan if it was slow.
+
+        Args:
+            connection: sqlite3 connection the statement ran on.
+            sql: The statement.
+            parameters: Its parameters, None for executemany().
+            seconds: Time it took.
+        """
+
+        milliseconds = seconds * 1000
+
+        if milliseconds < SLOW_QUERY_MS:
+            return
+
+        plan = []
+        statement = sql.lstrip().split(None, 1)[0].upper() if sql else ""
+
+        if parameters is not None and statement in PLANNED_STATEMENTS:
+            try:
+                # Not logged itself, whatever the connection class.
+                rows = sqlite3.Connection.execute(
+                    connection, "EXPLAIN QUERY PLAN " + sql, parameters)
+                plan = [row[-1] for row in rows]
+            except Exception as error:
+                plan = ["plan unavailable: {}".format(error)]
+
+        with self._lock:
+            self._slow_queries.append({
+                "time": time.time(),
+                "milliseconds": round(milliseconds, 3),
+                "sql": " ".join(sql.split()),
+                "plan": plan,
+            })
+
+    def statistics(self):
+        """Get the latency figures of every operation, slowest total first.
+
+        Return:
+            A list of dicts with name, count, total, mean, p50, p95, p99
+            and max, times in milliseconds. Percentiles cover the latest
+            SAMPLES calls, the other figures every call.
+        """
+
+        with self._lock:
+            recorded = [(name, sorted(samples), tuple(self._totals[name]))
+                        for name, samples in self._samples.items()]
+
+        operations = []
+
+        for name, ordered, (count, total, longest) in recorded:
+            operations.append({
+                "name": name,
+                "count": count,
+                "total_ms": round(total * 1000, 3),
+                "mean_ms": round(total * 1000 / count, 3),
+                "p50_ms": round(percentile(ordered, 0.50) * 1000, 3),
+                "p95_ms": round(percentile(ordered, 0.95) * 1000, 3),
+                "p99_ms": round(percentile(ordered, 0.99) * 1000, 3),
+                "max_ms": round(longest * 1000, 3),
+            })
+
+        operations.sort(key=lambda operation: -operation["total_ms"])
+
+        return operations
+
+    def slow_queries(self):
+        """Get the logged slow statements, oldest first."""
+
+        with self._lock:
+            return list(self._slow_queries)
+
+    def snapshot(self):
+        """Get everything recorded, ready to be written as JSON."""
+
+        return {"enabled": self.enabled,
+                "slow_query_ms": SLOW_QUERY_MS,
+                "operations": self.statistics(),
+                "slow_queries": self.slow_queries()}
+
+    def dump(self, path):
+        """Write snapshot() to a JSON file."""
+
+        with open(path, "w", encoding="utf-8") as stream:
+            json.dump(self.snapshot(), stream, indent=2, ensure_ascii=False)
+
+
+# Shared instance, used by every module of the app.
+instrumentation = Instrumentation(os.environ.get("AGENDA_PROFILE") == "1")
@@ -0,0 +1,58 @@
+# lru_cache.py
+
+"""Small thread safe least recently used cache."""
+
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+    """Mapping that keeps at most max_size entries.
+
+    Reading an entry marks it as recently used, inserting beyond max_size
+    drops the least recently used entry.
+    """
+
+    def __init__(self, max_size=512):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key, default=None):
+        """Get the value stored for key, or default if it is missing."""
+
+        with self._lock:
+            try:
+                self._entries.move_to_end(key)
+            except KeyError:
+                return default
+
+            return self._entries[key]
+
+    def put(self, key, value):
+        """Store value for key, evicting the oldest entry when full."""
+
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+
+            if len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def pop(self, key, default=None):
+        """Remove key from the cache and return its value."""
+
+        with self._lock:
+            return self._entries.pop(key, default)
+
+    def clear(self):
+        """Remove every entry."""
+
+        with self._lock:
+            self._entries.clear()
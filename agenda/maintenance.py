@@ -0,0 +1,230 @@
+# maintenance.py
+
+"""Backups, integrity checks and compaction of the agenda database.
+
+Everything here runs while the app keeps using the database:
+
+* backup() copies the database with SQLite's online backup API, a few
+  pages per step with a pause in between, so writers are never held up
+  for long. Copies go to a backups directory next to the database and
+  only the last BACKUP_KEEP are kept:
+
+      contacts.db -> backups/contacts-20261017-093000.db
+
+* quick_check() runs ``PRAGMA quick_check``, a check of the pages and
+  records that skips the slow index cross checks of integrity_check.
+
+* The database uses ``auto_vacuum=INCREMENTAL`` (migration 9): pages
+  freed by deletes stay in the file until reclaim_space() gives them back
+  to the file system, a few at a time.
+
+* missing_images() lists the pictures referenced by contacts whose file
+  is gone.
+
+Usage:
+    python -m agenda backup
+    python -m agenda check --reset-missing
+"""
+
+import datetime
+import glob
+import os
+import sqlite3
+import time
+
+from agenda.contact import DEFAULT_IMAGE
+
+# Pages copied per backup step, 1 MB with the default page size.
+BACKUP_PAGES = 256
+
+# Seconds between two backup steps, letting writers in.
+BACKUP_PAUSE = 0.01
+
+# Number of backups kept per database.
+BACKUP_KEEP = 7
+
+# Directory of the backups, next to the database.
+BACKUP_DIRECTORY = "backups"
+
+# Pages given back to the file system per incremental vacuum step.
+VACUUM_PAGES = 256
+
+# Seconds between two incremental vacuum steps.
+VACUUM_PAUSE = 0.01
+
+# Problems reported at most by quick_check().
+MAX_PROBLEMS = 100
+
+SQL_IMAGES = '''SELECT image, COUNT(*) FROM Contacts
+                WHERE image <> '' GROUP BY image'''
+
+SQL_REPLACE_IMAGE = "UPDATE Contacts SET image=? WHERE image=?"
+
+
+def enable_auto_vacuum(connection):
+    """Switch the database to incremental auto vacuum.
+
+    The setting only applies to an existing database after a VACUUM, which
+    rewrites the whole file once.
+    """
+
+    connection.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    connection.execute("VACUUM")
+
+
+def backup_pattern(database, directory=None):
+    """Get the glob pattern of the backups of a database file."""
+
+    directory = directory or os.path.join(os.path.dirname(database),
+                                          BACKUP_DIRECTORY)
+    base = os.path.splitext(os.path.basename(database))[0]
+
+    return os.path.join(directory, base + "-*.db")
+
+
+def list_backups(database, directory=None):
+    """Get the backups of a database file, oldest first."""
+
+    # Names hold the date, they sort in time order.
+    return sorted(glob.glob(backup_pattern(database, directory)))
+
+
+def backup(connection, database, directory=None, keep=BACKUP_KEEP,
+           progress=None):
+    """Copy a database while it is in use and drop the oldest copies.
+
+    The copy is written to a temporary file, checked and then renamed, so
+    an interrupted backup never replaces a good one. A write to the
+    database by another connection restarts the copy.
+
+    Args:
+        connection: Open sqlite3 connection to the database.
+        database: Path of the database file, names the backups.
+        directory: Directory of the backups, BACKUP_DIRECTORY next to
+            the database by default.
+        keep: Number of backups kept.
+        progress: Function (remaining, total) called after every step.
+
+    Return:
+        The path of the new backup.
+
+    Raise:
+        ValueError if the copy fails its quick check.
+    """
+
+    pattern = backup_pattern(database, directory)
+    os.makedirs(os.path.dirname(pattern), exist_ok=True)
+
+    stamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+    path = pattern.replace("*", stamp)
+    temporary = path + ".part"
+
+    target = sqlite3.connect(temporary)
+
+    try:
+        connection.backup(target,
+                          pages=BACKUP_PAGES,
+                          progress=progress and (
+                              lambda status, remaining, total:
+                              progress(remaining, total)),
+                          sleep=BACKUP_PAUSE)
+        problems = quick_check(target)
+    finally:
+        target.close()
+
+    if problems:
+        os.remove(temporary)
+        raise ValueError("backup failed its check: {}".format(problems[0]))
+
+    os.replace(temporary, path)
+
+    for old in list_backups(database, directory)[:-keep]:
+        os.remove(old)
+
+    return path
+
+
+def quick_check(connection, max_problems=MAX_PROBLEMS):
+    """Check the pages and records of a database.
+
+    Return:
+        A list of problems, empty if the database is sound.
+    """
+
+    rows = connection.execute(
+        "PRAGMA quick_check({})".format(int(max_problems))).fetchall()
+    problems = [row[0] for row in rows]
+
+    return [] if problems == ["ok"] else problems
+
+
+def free_pages(connection):
+    """Get the number of unused pages in the database file."""
+
+    return connection.execute("PRAGMA freelist_count").fetchone()[0]
+
+
+def reclaim_space(connection, pages=VACUUM_PAGES, pause=VACUUM_PAUSE):
+    """Give the free pages of the database back to the file system.
+
+    Pages are reclaimed by small steps, each one a short write
+    transaction, so other writers wait at most for one step.
+
+    Return:
+        The number of pages reclaimed.
+    """
+
+    before = remaining = free_pages(connection)
+
+    while remaining:
+        # The pragma reclaims one page per step of its statement.
+        connection.execute(
+            "PRAGMA incremental_vacuum({})".format(int(pages))).fetchall()
+        left = free_pages(connection)
+
+        # Not in incremental auto vacuum mode, nothing is reclaimed.
+        if left >= remaining:
+            break
+
+        remaining = left
+        time.sleep(pause)
+
+    return before - remaining
+
+
+def missing_images(connection):
+    """Find the pictures referenced by contacts whose file is missing.
+
+    Return:
+        A list of tuples (path, number of contacts).
+    """
+
+    return [(path, count)
+            for path, count in connection.execute(SQL_IMAGES)
+            if not os.path.isfile(path)]
+
+
+def replace_images(connection, changes):
+    """Change the picture of the contacts of some pictures.
+
+    Args:
+        connection: Open sqlite3 connection to the database.
+        changes: Tuples (new path, old path), written in one transaction.
+
+    Return:
+        The number of contacts changed.
+    """
+
+    with connection:
+        return connection.executemany(SQL_REPLACE_IMAGE, changes).rowcount
+
+
+def reset_images(connection, paths):
+    """Give the contacts of missing pictures the default picture.
+
+    Return:
+        The number of contacts changed.
+    """
+
+    return replace_images(connection, [(DEFAULT_IMAGE, path)
+                                       for path in paths])
@@ -0,0 +1,167 @@
+# migrations.py
+
+"""Versioned schema migrations of the agenda database.
+
+The version of a database is kept in ``PRAGMA user_version``. Every entry
+of MIGRATIONS upgrades the schema by one version: SQL scripts run in a
+single transaction together with the version bump, callables are used
+for statements that can not run inside a transaction.
+
+Migrations are only ever appended, never edited once released.
+"""
+
+from agenda.duplicates import duplicate_keys_sql
+from agenda.maintenance import enable_auto_vacuum
+from agenda.photo_store import photo_index_sql
+from agenda.search import search_index_sql
+from agenda.sync import journal_sql
+from agenda.tags import tags_sql
+
+
+def letter_sql(column):
+    """Get the SQL expression of the jump index letter of a sort key.
+
+    Keys starting with a to z give the upper case letter, any other "#".
+    """
+
+    return '''(CASE WHEN substr({0}, 1, 1) BETWEEN 'a' AND 'z'
+                  THEN upper(substr({0}, 1, 1)) ELSE '#' END)'''.format(column)
+
+
+def enable_wal(connection):
+    """Switch the database to write ahead logging.
+
+    Readers no longer block the writer and the other way round. The
+    journal mode is stored in the database file.
+    """
+
+    connection.execute("PRAGMA journal_mode=WAL")
+
+
+MIGRATIONS = (
+    # 1: Contacts table, created by the first versions of the app.
+    '''CREATE TABLE IF NOT EXISTS Contacts
+        (id INTEGER PRIMARY KEY AUTOINCREMENT,
+         name TEXT,
+         surname TEXT,
+         phone TEXT,
+         email TEXT,
+         image TEXT,
+         address TEXT );''',
+
+    # 2: Full text search index.
+    search_index_sql(),
+
+    # 3: Photo reference counts.
+    photo_index_sql(),
+
+    # 4: Lookup indexes.
+    '''CREATE INDEX IF NOT EXISTS Contacts_surname_name
+           ON Contacts (surname, name);
+       CREATE INDEX IF NOT EXISTS Contacts_phone ON Contacts (phone);
+       CREATE INDEX IF NOT EXISTS Contacts_email ON Contacts (email);''',
+
+    # 5: Write ahead logging.
+    enable_wal,
+
+    # 6: Alphabetical order. sort_key is filled by agenda_sort_key(), which
+    # every pooled connection registers, and ContactLetters counts the
+    # contacts of every initial for the jump index.
+    '''ALTER TABLE Contacts ADD COLUMN sort_key TEXT;
+
+       UPDATE Contacts SET sort_key = agenda_sort_key(surname, name);
+
+       CREATE INDEX IF NOT EXISTS Contacts_sort_key ON Contacts (sort_key);
+
+       CREATE TABLE IF NOT EXISTS ContactLetters
+           (letter TEXT PRIMARY KEY,
+            contacts INTEGER NOT NULL) WITHOUT ROWID;
+
+       INSERT INTO ContactLetters (letter, contacts)
+       SELECT {letter}, COUNT(*) FROM Contacts GROUP BY 1;
+
+       CREATE TRIGGER IF NOT EXISTS Contacts_sort_insert
+       AFTER INSERT ON Contacts BEGIN
+           UPDATE Contacts SET sort_key = agenda_sort_key(new.surname,
+                                                          new.name)
+           WHERE id = new.id;
+       END;
+
+       CREATE TRIGGER IF NOT EXISTS Contacts_sort_update
+       AFTER UPDATE OF surname, name ON Contacts BEGIN
+           UPDATE Contacts SET sort_key = agenda_sort_key(new.surname,
+                                                          new.name)
+           WHERE id = new.id;
+       END;
+
+       CREATE TRIGGER IF NOT EXISTS Contacts_letter_update
+       AFTER UPDATE OF sort_key ON Contacts BEGIN
+           UPDATE ContactLetters SET contacts = contacts - 1
+           WHERE old.sort_key IS NOT NULL AND letter = {old_letter};
+           INSERT INTO ContactLetters (letter, contacts)
+           VALUES ({new_letter}, 1)
+           ON CONFLICT (letter) DO UPDATE SET contacts = contacts + 1;
+       END;
+
+       CREATE TRIGGER IF NOT EXISTS Contacts_letter_delete
+       AFTER DELETE ON Contacts BEGIN
+           UPDATE ContactLetters SET contacts = contacts - 1
+           WHERE letter = {old_letter};
+       END;'''.format(letter=letter_sql("sort_key"),
+                       old_letter=letter_sql("old.sort_key"),
+                       new_letter=letter_sql("new.sort_key")),
+
+    # 7: Normalized phone and email keys for duplicate detection.
+    duplicate_keys_sql(),
+
+    # 8: Contact uids, versions and the change journal used by sync.
+    journal_sql(),
+
+    # 9: Incremental auto vacuum, free pages are reclaimed in idle time.
+    enable_auto_vacuum,
+
+    # 10: Contacts by picture, photos are replaced for all their contacts.
+    "CREATE INDEX IF NOT EXISTS Contacts_image ON Contacts (image);",
+
+    # 11: Tags, their contacts and the number of contacts of every tag.
+    tags_sql(),
+)
+
+
+def schema_version(connection):
+    """Get the schema version of a database."""
+
+    return connection.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(connection, migrations=MIGRATIONS):
+    """Apply the migrations a database is missing.
+
+    Args:
+        connection: Open sqlite3 connection to the agenda database.
+        migrations: Sequence of migrations, by default MIGRATIONS.
+
+    Return:
+        The schema version of the database after the migrations.
+    """
+
+    current = schema_version(connection)
+
+    for version, migration in enumerate(migrations[current:], current + 1):
+        if callable(migration):
+            migration(connection)
+            connection.execute("PRAGMA user_version = {}".format(version))
+
+            continue
+
+        try:
+            connection.executescript('''BEGIN IMMEDIATE;
+                                        {}
+                                        PRAGMA user_version = {};
+                                        COMMIT;'''.format(migration, version))
+        except BaseException:
+            if connection.in_transaction:
+                connection.rollback()
+            raise
+
+    return max(current, len(migrations))
@@ -0,0 +1,177 @@
+# photo_maintenance.py
+
+"""Batch maintenance of every photo referenced by the contacts.
+
+Each distinct picture of Contacts.image is handled by a pool of worker
+processes, one per core, so the work scales with the number of cores:
+
+* legacy pictures, like images/695_jennifer.jpg saved by older versions,
+  and pictures outside the store are added to the PhotoStore: turned
+  upright, EXIF removed, re-encoded and resized to every size;
+* stored photos are decoded to find corrupt files, and renditions that
+  are missing are made again;
+* missing and corrupt pictures are reported, their contacts only get the
+  default picture when asked to.
+
+Picture paths are relative to the directory of the database, the command
+refuses to run from another directory rather than finding every picture
+missing.
+
+Contacts are updated as results come in, UPDATE_BATCH pictures per
+transaction. Pictures already handled are stored photos, so a run that
+was interrupted only checks them when started again.
+
+Usage:
+    python -m agenda photos --workers 8
+    python -m agenda photos --reset-missing
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+from agenda.contact import DEFAULT_IMAGE
+from agenda.instrumentation import instrumentation
+from agenda.photo_store import PICTURE_ERRORS, PhotoStore
+
+# Outcomes of process_photo().
+KEPT = "kept"
+STORED = "stored"
+REPAIRED = "repaired"
+MISSING = "missing"
+CORRUPT = "corrupt"
+
+OUTCOMES = (KEPT, STORED, REPAIRED, MISSING, CORRUPT)
+
+# Pictures sent to a worker at a time.
+CHUNK_SIZE = 8
+
+# Pictures whose contacts are updated per transaction.
+UPDATE_BATCH = 256
+
+SQL_PICTURES = '''SELECT DISTINCT image FROM Contacts
+                  WHERE image <> '' AND image <> ? ORDER BY image'''
+
+
+def check_picture(path):
+    """Decode a picture fully, raising an error if it is corrupt."""
+
+    # Pillow is only loaded by the code paths reading photos.
+    from PIL import Image
+
+    try:
+        with Image.open(path) as image:
+            image.load()
+
+    except Image.DecompressionBombError as error:
+        raise ValueError(str(error)) from error
+
+
+def process_photo(path, root, sizes):
+    """Store, check or repair one picture, in a worker process.
+
+    Args:
+        path: Picture referenced by contacts.
+        root: Directory of the PhotoStore.
+        sizes: Sizes of the PhotoStore.
+
+    Return:
+        A tuple (outcome, new path, error message), see OUTCOMES.
+    """
+
+    store = PhotoStore(root, sizes)
+
+    if not os.path.isfile(path):
+        return MISSING, DEFAULT_IMAGE, "missing"
+
+    try:
+        if not store.is_stored(path):
+            return STORED, store.put(path), ""
+
+        check_picture(path)
+
+        return (REPAIRED if store.repair(path) else KEPT), path, ""
+
+    except PICTURE_ERRORS as error:
+        return CORRUPT, DEFAULT_IMAGE, str(error)
+
+
+def check_directory(repository):
+    """Make sure picture paths can be read from the current directory.
+
+    Raise:
+        ValueError if the database is not in the current directory.
+    """
+
+    directory = os.path.dirname(os.path.realpath(repository.pool.path))
+
+    if directory != os.path.realpath(os.getcwd()):
+        raise ValueError("picture paths are relative to {}, run the "
+                         "command from there".format(directory))
+
+
+@instrumentation.timed("photo.maintain")
+def maintain_photos(repository, store, workers=None, progress=None,
+                    reset=False):
+    """Store, check and repair every picture referenced by contacts.
+
+    Args:
+        repository: ContactRepository of the contacts.
+        store: PhotoStore receiving the pictures.
+        workers: Number of worker processes, one per core by default.
+        progress: Function (done, total) called after every picture.
+        reset: True to give the contacts of missing and corrupt pictures
+            the default picture, else they are only reported.
+
+    Return:
+        A dict with the number of pictures of every outcome, and the
+        "errors", tuples (path, message) of the missing and corrupt
+        pictures.
+
+    Raise:
+        ValueError if the database is not in the current directory.
+    """
+
+    check_directory(repository)
+
+    pictures = [path for (path,) in repository.connection().execute(
+        SQL_PICTURES, (DEFAULT_IMAGE,))]
+    result = dict.fromkeys(OUTCOMES, 0)
+    result["errors"] = []
+    changes = []
+
+    try:
+        with ProcessPoolExecutor(workers) as executor:
+            outcomes = executor.map(process_photo,
+                                    pictures,
+                                    repeat(store.root),
+                                    repeat(store.sizes),
+                                    chunksize=CHUNK_SIZE)
+
+            for done, (path, (outcome, new_path, error)) in enumerate(
+                    zip(pictures, outcomes), 1):
+                result[outcome] += 1
+
+                if error:
+                    result["errors"].append((path, error))
+
+                    # Contacts keep their picture unless asked not to.
+                    if not reset:
+                        new_path = path
+
+                if new_path != path:
+                    changes.append((new_path, path))
+
+                if len(changes) >= UPDATE_BATCH:
+                    repository.replace_images(changes)
+                    changes = []
+
+                if progress:
+                    progress(done, len(pictures))
+
+    finally:
+        # Keep the work done so far when interrupted.
+        if changes:
+            repository.replace_images(changes)
+
+    return result
@@ -0,0 +1,364 @@
+# photo_store.py
+
+"""Content addressed storage of contact photos.
+
+A photo is stored once under a name derived from the SHA-256 of the
+picture it was made from, sharded in two directory levels. Every photo
+is kept at several sizes, each fitting a square without changing the
+aspect ratio of the picture:
+
+    images/ab/cd/abcd....webp       256 px, the path stored in Contacts
+    images/ab/cd/abcd...-128.webp   smaller renditions
+    images/ab/cd/abcd...-64.webp
+    images/ab/cd/abcd...-32.webp
+
+Widgets ask rendition_path() for the smallest rendition that fits them,
+so a list avatar decodes a 32 px file instead of a full photo.
+
+The Photos table counts how many contacts reference each file under the
+store root. Triggers on Contacts keep the counts up to date, and files no
+longer referenced are removed by PhotoStore.collect_garbage().
+"""
+
+import glob
+import hashlib
+import os
+import tempfile
+import time
+
+from agenda.instrumentation import instrumentation
+
+# Directory holding the contact photos.
+PHOTO_ROOT = "images"
+
+# Sides of the squares the stored renditions fit in, smallest first. The
+# largest one is the file referenced by Contacts.
+PHOTO_SIZES = (32, 64, 128, 256)
+
+# Extension of the stored photos.
+PHOTO_EXTENSION = ".webp"
+
+# Errors of a damaged or unsupported picture. Pillow raises SyntaxError
+# for some damaged headers, and its DecompressionBombError is turned into
+# a ValueError, see make_renditions().
+PICTURE_ERRORS = (OSError, ValueError, SyntaxError)
+
+
+def photo_index_sql(root=PHOTO_ROOT):
+    """Get the script creating the Photos reference count table.
+
+    The script ends by counting the images already referenced by Contacts.
+
+    Args:
+        root: Store directory, only images under it are counted.
+
+    Return:
+        The SQL script, applied by the migrations module.
+    """
+
+    return '''
+        CREATE TABLE IF NOT EXISTS Photos
+            (path TEXT PRIMARY KEY,
+             refs INTEGER NOT NULL DEFAULT 0) WITHOUT ROWID;
+
+        CREATE INDEX IF NOT EXISTS Photos_orphans ON Photos (path)
+        WHERE refs <= 0;
+
+        CREATE TRIGGER IF NOT EXISTS Contacts_photo_insert
+        AFTER INSERT ON Contacts WHEN new.image LIKE '{root}/%' BEGIN
+            INSERT INTO Photos (path, refs) VALUES (new.image, 1)
+            ON CONFLICT (path) DO UPDATE SET refs = refs + 1;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS Contacts_photo_delete
+        AFTER DELETE ON Contacts WHEN old.image LIKE '{root}/%' BEGIN
+            UPDATE Photos SET refs = refs - 1 WHERE path = old.image;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS Contacts_photo_release
+        AFTER UPDATE OF image ON Contacts
+        WHEN old.image IS NOT new.image AND old.image LIKE '{root}/%' BEGIN
+            UPDATE Photos SET refs = refs - 1 WHERE path = old.image;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS Contacts_photo_acquire
+        AFTER UPDATE OF image ON Contacts
+        WHEN old.image IS NOT new.image AND new.image LIKE '{root}/%' BEGIN
+            INSERT INTO Photos (path, refs) VALUES (new.image, 1)
+            ON CONFLICT (path) DO UPDATE SET refs = refs + 1;
+        END;
+
+        INSERT OR REPLACE INTO Photos (path, refs)
+        SELECT image, COUNT(*) FROM Contacts
+        WHERE image LIKE '{root}/%' GROUP BY image;
+        '''.format(root=root)
+
+
+def rendition_path(path, side, sizes=PHOTO_SIZES):
+    """Get the path of the smallest rendition of a photo fitting a square.
+
+    Only stored photos have renditions, the file may not exist for other
+    pictures or for photos stored at a single size by older versions.
+
+    Args:
+        path: Path of a photo, as stored in Contacts.
+        side: Side in pixels of the square to fill.
+        sizes: Sizes the photo was stored at.
+
+    Return:
+        The path of the rendition, path itself if the largest one is
+        needed or if it is not a stored photo.
+    """
+
+    if not path or not path.endswith(PHOTO_EXTENSION):
+        return path
+
+    for size in sizes[:-1]:
+        if size >= side:
+            return "{}-{}{}".format(path[:-len(PHOTO_EXTENSION)], size,
+                                    PHOTO_EXTENSION)
+
+    return path
+
+
+@instrumentation.timed("photo.resize")
+def make_renditions(source, destinations):
+    """Resize a picture to several sizes and save them.
+
+    JPEG files are decoded at a reduced scale with draft(), close to the
+    largest size, so a large photo is never fully decoded. Each rendition
+    is reduced from the previous, bigger one. Pictures are turned upright
+    as their EXIF orientation says and never enlarged.
+
+    Args:
+        source: Path of the picture to resize.
+        destinations: List of tuples (side, path), largest side first.
+
+    Raise:
+        One of PICTURE_ERRORS if the picture can not be read.
+    """
+
+    # Pillow is only loaded by the code paths writing photos.
+    from PIL import Image, ImageOps
+
+    largest = destinations[0][0]
+
+    try:
+        with Image.open(source) as image:
+            image.draft(image.mode, (largest, largest))
+            resized = ImageOps.exif_transpose(image)
+
+    except Image.DecompressionBombError as error:
+        raise ValueError(str(error)) from error
+
+    if resized.mode not in ("RGB", "RGBA"):
+        resized = resized.convert("RGBA" if "A" in resized.getbands()
+                                  else "RGB")
+
+    for side, destination in destinations:
+        resized.thumbnail((side, side), reducing_gap=3.0)
+        resized.save(destination, "WEBP", quality=85, method=4)
+
+
+class PhotoStore:
+    """Stores photos by content and removes the ones nobody references."""
+
+    # Extension of the stored photos.
+    EXTENSION = PHOTO_EXTENSION
+
+    # Seconds a file is kept after put() even if it is not referenced yet.
+    GRACE_PERIOD = 60
+
+    # Mode of the stored files, temporary files are created private.
+    FILE_MODE = 0o644
+
+    # Names of the files being written, digests never start with "t".
+    TEMPORARY_PREFIX = "tmp"
+
+    def __init__(self, root=PHOTO_ROOT, sizes=PHOTO_SIZES):
+        self.root = root
+        self.sizes = sizes
+
+    def path_for(self, digest):
+        """Get the store path of a digest."""
+
+        return os.path.join(self.root,
+                            digest[:2],
+                            digest[2:4],
+                            digest + self.EXTENSION).replace(os.sep, "/")
+
+    @staticmethod
+    @instrumentation.timed("photo.digest")
+    def digest(source, sizes):
+        """Get the SHA-256 of a picture and the sizes it is stored at."""
+
+        sha = hashlib.sha256(
+            "{}:".format(",".join(map(str, sizes))).encode())
+
+        with open(source, "rb") as picture:
+            for block in iter(lambda: picture.read(1 << 20), b""):
+                sha.update(block)
+
+        return sha.hexdigest()
+
+    def renditions(self, path):
+        """Get the paths of the smaller renditions of a stored photo."""
+
+        return [rendition_path(path, size, self.sizes)
+                for size in self.sizes[:-1]]
+
+    @instrumentation.timed("photo.store")
+    def put(self, source):
+        """Store resized copies of a picture unless it is already stored.
+
+        Args:
+            source: Path of the picture selected by the user.
+
+        Return:
+            The store path of the largest rendition.
+        """
+
+        path = self.path_for(self.digest(source, self.sizes))
+
+        if os.path.exists(path):
+            # Refresh the file so the garbage collector leaves it alone
+            # until the caller references it.
+            os.utime(path)
+
+            return path
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.write_renditions(source, list(zip(self.sizes,
+                                               self.renditions(path) + [path])))
+
+        return path
+
+    def is_stored(self, path):
+        """Tell if a path names a photo of this store, not a legacy file."""
+
+        name = os.path.basename(path)
+        digest = name[:-len(self.EXTENSION)]
+
+        return (name.endswith(self.EXTENSION) and len(digest) == 64 and
+                all(char in "0123456789abcdef" for char in digest) and
+                path == self.path_for(digest))
+
+    def repair(self, path):
+        """Make the missing renditions of a stored photo from the largest.
+
+        Return:
+            The number of renditions made.
+        """
+
+        missing = [(side, rendition)
+                   for side, rendition in zip(self.sizes,
+                                              self.renditions(path))
+                   if not os.path.exists(rendition)]
+
+        if missing:
+            self.write_renditions(path, missing)
+
+        return len(missing)
+
+    def write_renditions(self, source, targets):
+        """Resize a picture into several files.
+
+        Files are written aside and renamed so readers never see a partial
+        file. The largest rendition is renamed last, once it exists the
+        others do.
+
+        Args:
+            source: Path of the picture to resize.
+            targets: List of tuples (side, path), smallest side first.
+        """
+
+        directory = os.path.dirname(targets[0][1])
+        temporaries = {}
+
+        try:
+            for side, _ in targets:
+                handle, temporaries[side] = tempfile.mkstemp(
+                    suffix=self.EXTENSION, prefix=self.TEMPORARY_PREFIX,
+                    dir=directory)
+                os.close(handle)
+                os.chmod(temporaries[side], self.FILE_MODE)
+
+            make_renditions(source, [(side, temporaries[side])
+                                     for side, _ in reversed(targets)])
+
+            for side, target in targets:
+                os.replace(temporaries.pop(side), target)
+
+        except BaseException:
+            for temporary in temporaries.values():
+                if os.path.exists(temporary):
+                    os.remove(temporary)
+
+            raise
+
+    def collect_garbage(self, connection):
+        """Remove photos no contact references anymore.
+
+        Files touched during the last GRACE_PERIOD seconds are kept, they
+        may belong to a contact that is being saved. Temporary files left
+        by interrupted writes are removed as well.
+
+        Args:
+            connection: Open sqlite3 connection to the agenda database.
+
+        Return:
+            The number of removed photos.
+        """
+
+        orphans = connection.execute(
+            "SELECT path FROM Photos WHERE refs <= 0").fetchall()
+        deadline = time.time() - self.GRACE_PERIOD
+        removed = []
+
+        for (path,) in orphans:
+            try:
+                if os.path.getmtime(path) > deadline:
+                    continue
+
+                os.remove(path)
+
+            except FileNotFoundError:
+                pass
+
+            # Photos stored at a single size have no renditions.
+            for rendition in self.renditions(path):
+                try:
+                    os.remove(rendition)
+                except FileNotFoundError:
+                    pass
+
+            removed.append((path,))
+
+        with connection:
+            connection.executemany(
+                "DELETE FROM Photos WHERE path=? AND refs <= 0", removed)
+
+        self.remove_temporaries(deadline)
+
+        return len(removed)
+
+    def remove_temporaries(self, deadline):
+        """Remove files left by writes interrupted before a deadline.
+
+        Return:
+            The number of removed files.
+        """
+
+        removed = 0
+
+        for path in glob.glob(os.path.join(
+                self.root, "*", "*", self.TEMPORARY_PREFIX + "*")):
+            try:
+                if os.path.getmtime(path) < deadline:
+                    os.remove(path)
+                    removed += 1
+
+            except FileNotFoundError:
+                pass
+
+        return removed
@@ -0,0 +1,876 @@
+# repository.py
+
+"""Data access layer for the contacts of the agenda app.
+
+Nothing in this module depends on Qt, so background workers and command
+line tools can share it with the UI.
+"""
+
+import sqlite3
+import threading
+import time
+
+from agenda.contact import CONTACT_COLUMNS, DEFAULT_IMAGE, Contact, sort_key
+from agenda.duplicates import (email_key, find_duplicates, phone_key,
+                               similar_contacts)
+from agenda.instrumentation import instrumentation
+from agenda.search import contact_matches, search_contacts
+from agenda.lru_cache import LRUCache
+from agenda.maintenance import (backup, free_pages, missing_images,
+                                quick_check, reclaim_space, replace_images,
+                                reset_images)
+from agenda.migrations import migrate, schema_version
+from agenda.photo_store import PHOTO_ROOT
+from agenda.sync import (SYNC_BATCH, apply_changes, changes_since,
+                         local_site, received)
+from agenda.tags import (SQL_ADD_TAG, SQL_CONTACT_TAGS, SQL_DELETE_TAG,
+                         SQL_MOVE_TAGS, SQL_TAG_CONTACT, SQL_TAGS,
+                         SQL_UNTAG_CONTACT, check_name, tag_page)
+
+# Database file used by the agenda app.
+DATABASE = "contacts.db"
+
+
+class TimedConnection(sqlite3.Connection):
+    """Connection timing its statements while instrumentation is enabled.
+
+    Slow statements are logged with their plan, see
+    Instrumentation.record_query().
+    """
+
+    def execute(self, sql, parameters=()):
+        if not instrumentation.enabled:
+            return super().execute(sql, parameters)
+
+        start = time.perf_counter()
+        cursor = super().execute(sql, parameters)
+        instrumentation.record_query(self, sql, parameters,
+                                     time.perf_counter() - start)
+
+        return cursor
+
+    def executemany(self, sql, parameters):
+        if not instrumentation.enabled:
+            return super().executemany(sql, parameters)
+
+        start = time.perf_counter()
+        cursor = super().executemany(sql, parameters)
+        instrumentation.record_query(self, sql, None,
+                                     time.perf_counter() - start)
+
+        return cursor
+
+
+class ConnectionPool:
+    """Hands out one sqlite3 connection per thread.
+
+    Connections released by finished threads are kept, up to max_idle, and
+    handed to the next thread asking for one.
+    """
+
+    # Number of compiled statements kept by every connection.
+    STATEMENT_CACHE_SIZE = 128
+
+    # Settings applied to every new connection. WAL makes NORMAL sync safe
+    # against corruption, the page cache and memory map are per connection.
+    PRAGMAS = ("PRAGMA synchronous=NORMAL",
+               "PRAGMA cache_size=-32768",
+               "PRAGMA mmap_size=268435456",
+               "PRAGMA temp_store=MEMORY")
+
+    def __init__(self, path, max_idle=4):
+        self.path = path
+        self.max_idle = max_idle
+        self._local = threading.local()
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def connect(self):
+        """Open a new connection to the database file."""
+
+        # Pooled connections move between threads, but only one thread
+        # uses a connection at a time.
+        connection = sqlite3.connect(
+            self.path,
+            check_same_thread=False,
+            cached_statements=self.STATEMENT_CACHE_SIZE,
+            factory=TimedConnection)
+
+        for pragma in self.PRAGMAS:
+            connection.execute(pragma)
+
+        # Used by the triggers keeping Contacts.sort_key, phone_key and
+        # email_key up to date.
+        connection.create_function("agenda_sort_key", 2, sort_key,
+                                   deterministic=True)
+        connection.create_function("agenda_phone_key", 1, phone_key,
+                                   deterministic=True)
+        connection.create_function("agenda_email_key", 1, email_key,
+                                   deterministic=True)
+
+        return connection
+
+    def connection(self):
+        """Get the connection of the calling thread."""
+
+        connection = getattr(self._local, "connection", None)
+
+        if connection is None:
+            with self._lock:
+                connection = self._idle.pop() if self._idle else None
+
+            if connection is None:
+                connection = self.connect()
+
+            self._local.connection = connection
+
+        return connection
+
+    def release(self):
+        """Give the connection of the calling thread back to the pool."""
+
+        connection = getattr(self._local, "connection", None)
+
+        if connection is None:
+            return
+
+        self._local.connection = None
+
+        with self._lock:
+            if len(self._idle) < self.max_idle:
+                self._idle.append(connection)
+                return
+
+        connection.close()
+
+    def close(self):
+        """Close the connection of the calling thread and idle connections."""
+
+        self.release()
+
+        with self._lock:
+            idle, self._idle = self._idle, []
+
+        for connection in idle:
+            connection.close()
+
+
+class ContactRepository:
+    """Reads and writes contacts of the agenda database.
+
+    SQL statements are class constants so every connection of the pool
+    reuses its compiled statements instead of parsing them again. Contacts
+    read by id are kept in an LRU cache and dropped on update and delete.
+    """
+
+    # Number of contacts kept in the id cache.
+    CACHE_SIZE = 512
+
+    # Columns batch edits can change, the first three can not be empty.
+    EDITABLE_COLUMNS = ("name", "surname", "phone", "email", "address")
+    REQUIRED_COLUMNS = ("name", "surname", "phone")
+
+    # Ids read per statement when loading a selection of contacts.
+    IDS_PER_QUERY = 500
+
+    SQL_GET = "SELECT {} FROM Contacts WHERE id=?".format(CONTACT_COLUMNS)
+
+    SQL_ALL = "SELECT {} FROM Contacts ORDER BY id".format(CONTACT_COLUMNS)
+
+    SQL_SOME = "SELECT {} FROM Contacts WHERE id IN ({{}}) ORDER BY id".format(
+        CONTACT_COLUMNS)
+
+    SQL_PENDING_PHOTOS = '''SELECT id, image FROM Contacts
+                            WHERE id > ? AND image <> '' AND image <> ?
+                            AND image NOT LIKE ? ORDER BY id LIMIT ?'''
+
+    SQL_LIST_ROW = '''SELECT id, name, surname, sort_key, phone, image
+                      FROM Contacts WHERE id=?'''
+
+    SQL_LIST_PAGE = '''SELECT id, name, surname, sort_key, phone, image
+                       FROM Contacts
+                       WHERE (sort_key, id) > (?, ?)
+                       ORDER BY sort_key, id LIMIT ?'''
+
+    # The last rows before a key, read backwards on the index and given
+    # back in list order.
+    SQL_PAGE_BEFORE = '''SELECT * FROM
+                         (SELECT id, name, surname, sort_key, phone, image
+                          FROM Contacts
+                          WHERE (sort_key, id) < (?, ?)
+                          ORDER BY sort_key DESC, id DESC LIMIT ?)
+                         ORDER BY sort_key, id'''
+
+    SQL_LETTERS = '''SELECT letter FROM ContactLetters
+                     WHERE contacts > 0 ORDER BY letter'''
+
+    SQL_LETTER_COUNTS = '''SELECT letter, contacts FROM ContactLetters
+                           WHERE contacts > 0 ORDER BY letter'''
+
+    SQL_PHOTO_COUNTS = '''SELECT COUNT(*), COALESCE(SUM(refs = 0), 0)
+                          FROM Photos'''
+
+    SQL_INSERT = '''INSERT INTO Contacts (name,
+                                          surname,
+                                          phone,
+                                          email,
+                                          image,
+                                          address)
+                                          VALUES(?, ?, ?, ?, ?, ?)'''
+
+    SQL_UPDATE = '''UPDATE Contacts set name=?,
+                                        surname=?,
+                                        phone=?,
+                                        email=?,
+                                        image=?,
+                                        address=?
+                                        WHERE id=?'''
+
+    SQL_SET_IMAGE = "UPDATE Contacts set image=? WHERE id=?"
+
+    SQL_SET_FIELD = "UPDATE Contacts set {}=? WHERE id=?"
+
+    SQL_DELETE = "DELETE FROM Contacts WHERE id=?"
+
+    def __init__(self, path=DATABASE, pool=None):
+        self.pool = pool or ConnectionPool(path)
+        self.cache = LRUCache(self.CACHE_SIZE)
+        self.create_schema()
+
+    def connection(self):
+        """Get the database connection of the calling thread."""
+
+        return self.pool.connection()
+
+    def create_schema(self):
+        """Create or upgrade the database schema, see migrations."""
+
+        migrate(self.connection())
+
+    @instrumentation.timed("repository.get")
+    def get(self, contact_id):
+        """Get contact info based on id, from the cache when possible.
+
+        Return:
+            Return a Contact or None.
+        """
+
+        contact = self.cache.get(contact_id)
+
+        if contact is None:
+            row = self.connection().execute(self.SQL_GET,
+                                            (contact_id,)).fetchone()
+            contact = Contact.from_row(row)
+
+            if contact is not None:
+                self.cache.put(contact_id, contact)
+
+        return contact
+
+    @instrumentation.timed("repository.first")
+    def iter_all(self):
+        """Iterate over every contact ordered by id.
+
+        Rows are read from the cursor as they are consumed, so the table is
+        never loaded in memory at once.
+
+        Yields:
+            Contact instances.
+        """
+
+        # A dedicated connection keeps the read open while the caller uses
+        # the thread connection for other statements.
+        connection = self.pool.connect()
+
+        try:
+            for row in connection.execute(self.SQL_ALL):
+                yield Contact.from_row(row)
+        finally:
+            connection.close()
+
+    def iter_some(self, contact_ids):
+        """Iterate over some contacts ordered by id.
+
+        Ids are read IDS_PER_QUERY at a time, ids without a contact are
+        skipped.
+
+        Yields:
+            Contact instances.
+        """
+
+        ordered = sorted(set(contact_ids))
+
+        for start in range(0, len(ordered), self.IDS_PER_QUERY):
+            chunk = ordered[start:start + self.IDS_PER_QUERY]
+            sql = self.SQL_SOME.format(", ".join("?" * len(chunk)))
+
+            for row in self.connection().execute(sql, chunk).fetchall():
+                yield Contact.from_row(row)
+
+    @instrumentation.timed("repository.pending_photos")
+    def pending_photos(self, after_id=0, limit=256):
+        """Get contacts whose image is a picture outside the photo store.
+
+        Imported contacts reference their source picture until it is added
+        to the store.
+
+        Returns:
+            A list of tuples with id and picture path [(id, image),..]
+        """
+
+        return self.connection().execute(
+            self.SQL_PENDING_PHOTOS,
+            (after_id, DEFAULT_IMAGE, PHOTO_ROOT + "/%", limit)).fetchall()
+
+    @instrumentation.timed("repository.get_list_row")
+    def get_list_row(self, contact_id):
+        """Get the columns shown in the contact list for one contact.
+
+        Return:
+            A tuple (id, name, surname, sort_key, phone, image) or None.
+        """
+
+        return self.connection().execute(self.SQL_LIST_ROW,
+                                         (contact_id,)).fetchone()
+
+    @instrumentation.timed("repository.list_page")
+    def list_page(self, after=("", 0), limit=256):
+        """Get a page of contacts in alphabetical order.
+
+        Pages are read by keyset: every page starts right after the
+        (sort_key, id) of the last row of the previous one, with a single
+        seek on the sort_key index whatever the position in the list.
+
+        Args:
+            after: Tuple (sort_key, id), only contacts sorted after it are
+                returned.
+            limit: Maximum number of rows to return.
+
+        Returns:
+            A list of tuples [(id, name, surname, sort_key, phone, image),..]
+        """
+
+        return self.connection().execute(self.SQL_LIST_PAGE,
+                                         (after[0], after[1], limit)).fetchall()
+
+    @instrumentation.timed("repository.page_before")
+    def page_before(self, before, limit=256):
+        """Get the page of contacts right before a key, see list_page().
+
+        Args:
+            before: Tuple (sort_key, id), only contacts sorted before it are
+                returned.
+            limit: Maximum number of rows to return.
+
+        Returns:
+            A list of tuples [(id, name, surname, sort_key, phone, image),..]
+            in alphabetical order, the last one right before the key.
+        """
+
+        return self.connection().execute(
+            self.SQL_PAGE_BEFORE, (before[0], before[1], limit)).fetchall()
+
+    @instrumentation.timed("repository.letters")
+    def letters(self):
+        """Get the initials having at least one contact.
+
+        Counts are kept by triggers, no contact is read.
+
+        Returns:
+            A list of letters, "A" to "Z" or "#" for any other initial.
+        """
+
+        return [letter for (letter,)
+                in self.connection().execute(self.SQL_LETTERS)]
+
+    @instrumentation.timed("repository.letter_counts")
+    def letter_counts(self):
+        """Get the number of contacts of every initial, kept by triggers.
+
+        Returns:
+            A list of tuples [(letter, contacts),..]
+        """
+
+        return self.connection().execute(self.SQL_LETTER_COUNTS).fetchall()
+
+    @instrumentation.timed("repository.stats")
+    def stats(self):
+        """Get figures about the database, none of them reads Contacts.
+
+        Returns:
+            A dict with the number of contacts, photos and unreferenced
+            photos, the schema version, the journal mode, the file size and
+            the number of free pages.
+        """
+
+        connection = self.connection()
+        photos, orphans = connection.execute(self.SQL_PHOTO_COUNTS).fetchone()
+        page_count = connection.execute("PRAGMA page_count").fetchone()[0]
+        page_size = connection.execute("PRAGMA page_size").fetchone()[0]
+
+        return {
+            "contacts": sum(count for _, count in self.letter_counts()),
+            "photos": photos,
+            "unreferenced_photos": orphans,
+            "schema_version": schema_version(connection),
+            "journal_mode": connection.execute(
+                "PRAGMA journal_mode").fetchone()[0],
+            "size": page_count * page_size,
+            "free_pages": free_pages(connection),
+        }
+
+    @instrumentation.timed("repository.tag_page")
+    def tag_page(self, tags, match_all, after=("", 0), limit=256):
+        """Get a page of the contacts of some tags in alphabetical order.
+
+        Args:
+            tags: Ids of the tags, at least one.
+            match_all: True if contacts need all the tags, else any of them.
+            after: Tuple (sort_key, id) of the last contact of the previous
+                page, see list_page().
+            limit: Maximum number of contacts.
+
+        Returns:
+            A list of tuples [(id, name, surname, sort_key, phone, image),..]
+        """
+
+        return tag_page(self.connection(), tags, match_all, after, limit)
+
+    @instrumentation.timed("repository.tag_page_before")
+    def tag_page_before(self, tags, match_all, before, limit=256):
+        """Get the page of the contacts of some tags right before a key.
+
+        Args:
+            tags: Ids of the tags, at least one.
+            match_all: True if contacts need all the tags, else any of them.
+            before: Tuple (sort_key, id), see page_before().
+            limit: Maximum number of contacts.
+
+        Returns:
+            A list of tuples [(id, name, surname, sort_key, phone, image),..]
+        """
+
+        return tag_page(self.connection(), tags, match_all, before, limit,
+                        backward=True)
+
+    def tags(self):
+        """Get every tag with its number of contacts, by name.
+
+        Returns:
+            A list of tuples [(id, name, contacts),..]
+        """
+
+        return self.connection().execute(SQL_TAGS).fetchall()
+
+    def contact_tags(self, contact_id):
+        """Get the names of the tags of a contact."""
+
+        return [name for (name,) in self.connection().execute(
+            SQL_CONTACT_TAGS, (contact_id,))]
+
+    def add_tag(self, name):
+        """Create a tag and commit.
+
+        Return:
+            The id of the new tag.
+
+        Raise:
+            ValueError if the name is not valid or already used.
+        """
+
+        name = check_name(name)
+        connection = self.connection()
+
+        try:
+            with connection:
+                return connection.execute(SQL_ADD_TAG, (name,)).lastrowid
+
+        except sqlite3.IntegrityError:
+            raise ValueError("Tag {} already exists".format(name))
+
+    def delete_tag(self, tag_id):
+        """Delete a tag, not its contacts, and commit."""
+
+        connection = self.connection()
+
+        with connection:
+            connection.execute(SQL_DELETE_TAG, (tag_id,))
+
+    @instrumentation.timed("repository.tag_contacts")
+    def tag_contacts(self, tag_id, contact_ids):
+        """Give many contacts a tag in one transaction.
+
+        Return:
+            The number of contacts that did not have the tag yet.
+        """
+
+        connection = self.connection()
+
+        with connection:
+            return connection.executemany(
+                SQL_TAG_CONTACT,
+                ((tag_id, contact_id)
+                 for contact_id in contact_ids)).rowcount
+
+    @instrumentation.timed("repository.untag_contacts")
+    def untag_contacts(self, tag_id, contact_ids):
+        """Remove a tag from many contacts in one transaction.
+
+        Return:
+            The number of contacts that had the tag.
+        """
+
+        connection = self.connection()
+
+        with connection:
+            return connection.executemany(
+                SQL_UNTAG_CONTACT,
+                ((tag_id, contact_id)
+                 for contact_id in contact_ids)).rowcount
+
+    @instrumentation.timed("repository.search_page")
+    def search_page(self, match_query, limit=256, offset=0, tags=(),
+                    match_all=False):
+        """Get a page of contacts matching a search, best ranked first.
+
+        Only contacts of the given tags are returned, if any, see
+        tag_page().
+
+        Returns:
+            A list of tuples [(id, name, surname, sort_key, phone, image),..]
+        """
+
+        return search_contacts(self.connection(), match_query, limit, offset,
+                               tags, match_all)
+
+    @instrumentation.timed("repository.matches")
+    def matches(self, match_query, contact_id):
+        """Check if a contact is part of the results of a search."""
+
+        return contact_matches(self.connection(), match_query, contact_id)
+
+    @instrumentation.timed("repository.insert")
+    def insert(self, contact):
+        """Insert a contact and commit, the id of contact is ignored.
+
+        Return:
+            The id of the new contact.
+        """
+
+        connection = self.connection()
+
+        with connection:
+            cursor = connection.execute(self.SQL_INSERT, contact.values())
+
+        return cursor.lastrowid
+
+    @instrumentation.timed("repository.bulk_insert")
+    def bulk_insert(self, contacts):
+        """Insert many contacts in a single transaction.
+
+        Args:
+            contacts: Iterable of Contact, their ids are ignored.
+
+        Return:
+            The number of inserted contacts.
+        """
+
+        connection = self.connection()
+
+        with connection:
+            cursor = connection.executemany(
+                self.SQL_INSERT, (contact.values() for contact in contacts))
+
+        return cursor.rowcount
+
+    @instrumentation.timed("repository.update")
+    def update(self, contact):
+        """Update a contact, identified by its id, and commit."""
+
+        connection = self.connection()
+
+        try:
+            with connection:
+                connection.execute(self.SQL_UPDATE,
+                                   contact.values() + (contact.id,))
+        finally:
+            self.cache.pop(contact.id)
+
+    @instrumentation.timed("repository.set_image")
+    def set_image(self, contact_id, image):
+        """Change the photo of a contact and commit."""
+
+        connection = self.connection()
+
+        try:
+            with connection:
+                connection.execute(self.SQL_SET_IMAGE, (image, contact_id))
+        finally:
+            self.cache.pop(contact_id)
+
+    @instrumentation.timed("repository.set_images")
+    def set_images(self, changes):
+        """Change the photo of many contacts in one transaction.
+
+        Args:
+            changes: Tuples (image, contact id).
+        """
+
+        connection = self.connection()
+
+        try:
+            with connection:
+                connection.executemany(self.SQL_SET_IMAGE, changes)
+        finally:
+            for _, contact_id in changes:
+                self.cache.pop(contact_id)
+
+    @instrumentation.timed("repository.delete")
+    def delete(self, contact_id):
+        """Delete a contact and commit."""
+
+        connection = self.connection()
+
+        try:
+            with connection:
+                connection.execute(self.SQL_DELETE, (contact_id,))
+        finally:
+            self.cache.pop(contact_id)
+
+    @instrumentation.timed("repository.delete_many")
+    def delete_many(self, contact_ids):
+        """Delete many contacts in a single transaction.
+
+        Return:
+            The number of deleted contacts.
+        """
+
+        contact_ids = list(contact_ids)
+        connection = self.connection()
+
+        try:
+            with connection:
+                cursor = connection.executemany(
+                    self.SQL_DELETE,
+                    ((contact_id,) for contact_id in contact_ids))
+        finally:
+            for contact_id in contact_ids:
+                self.cache.pop(contact_id)
+
+        return cursor.rowcount
+
+    @instrumentation.timed("repository.set_field")
+    def set_field(self, contact_ids, column, value):
+        """Set one column of many contacts in a single transaction.
+
+        Args:
+            contact_ids: Ids of the contacts to change.
+            column: One of EDITABLE_COLUMNS.
+            value: New value of the column.
+
+        Return:
+            The number of changed contacts.
+
+        Raise:
+            ValueError if the column can not be edited or a required column
+            would be empty.
+        """
+
+        if column not in self.EDITABLE_COLUMNS:
+            raise ValueError("Column {} can not be edited".format(column))
+
+        if column in self.REQUIRED_COLUMNS and not value.strip():
+            raise ValueError("Column {} can not be empty".format(column))
+
+        contact_ids = list(contact_ids)
+        connection = self.connection()
+
+        try:
+            with connection:
+                cursor = connection.executemany(
+                    self.SQL_SET_FIELD.format(column),
+                    ((value, contact_id) for contact_id in contact_ids))
+        finally:
+            for contact_id in contact_ids:
+                self.cache.pop(contact_id)
+
+        return cursor.rowcount
+
+    @instrumentation.timed("repository.duplicate_groups")
+    def duplicate_groups(self):
+        """Find groups of likely duplicate contacts, see find_duplicates().
+
+        Returns:
+            A list of groups, each a sorted list of contact ids.
+        """
+
+        return find_duplicates(self.connection())
+
+    @instrumentation.timed("repository.similar")
+    def similar(self, phone, email):
+        """Find contacts sharing a phone number or email address.
+
+        Returns:
+            A list of tuples [(id, name, surname, phone, email),..]
+        """
+
+        return similar_contacts(self.connection(), phone, email)
+
+    @instrumentation.timed("repository.merge")
+    def merge(self, keep_id, merged_ids):
+        """Merge contacts into one and delete them, in one transaction.
+
+        Empty fields of the kept contact, and its default image, are filled
+        from the merged contacts in the given order.
+
+        Args:
+            keep_id: Id of the contact kept.
+            merged_ids: Ids of the contacts merged into it.
+
+        Return:
+            The kept Contact or None if it does not exist.
+        """
+
+        merged_ids = [contact_id for contact_id in merged_ids
+                      if contact_id != keep_id]
+        connection = self.connection()
+
+        try:
+            with connection:
+                row = connection.execute(self.SQL_GET, (keep_id,)).fetchone()
+
+                if row is None:
+                    return None
+
+                values = list(Contact.from_row(row).values())
+
+                for contact_id in merged_ids:
+                    other = Contact.from_row(connection.execute(
+                        self.SQL_GET, (contact_id,)).fetchone())
+
+                    if other is None:
+                        continue
+
+                    for position, value in enumerate(other.values()):
+                        if (not values[position] or
+                                values[position] == DEFAULT_IMAGE):
+                            values[position] = value
+
+                connection.execute(self.SQL_UPDATE, tuple(values) + (keep_id,))
+                connection.executemany(
+                    SQL_MOVE_TAGS,
+                    ((keep_id, keep_id, contact_id)
+                     for contact_id in merged_ids))
+                connection.executemany(
+                    self.SQL_DELETE,
+                    ((contact_id,) for contact_id in merged_ids))
+        finally:
+            for contact_id in [keep_id] + merged_ids:
+                self.cache.pop(contact_id)
+
+        return self.get(keep_id)
+
+    def site(self):
+        """Get the site id of the database, see agenda.sync."""
+
+        return local_site(self.connection())
+
+    def received(self, site):
+        """Get the last change of a peer applied to the database."""
+
+        return received(self.connection(), site)
+
+    @instrumentation.timed("repository.sync_changes")
+    def sync_changes(self, since, peer, limit=SYNC_BATCH):
+        """Get a batch of changes a peer has not received yet.
+
+        Return:
+            A delta, see agenda.sync.changes_since().
+        """
+
+        return changes_since(self.connection(), since, peer, limit)
+
+    @instrumentation.timed("repository.apply_changes")
+    def apply_changes(self, delta):
+        """Apply a batch of changes of a peer in a single transaction.
+
+        Return:
+            A dict with the number of changes "applied" and "kept".
+        """
+
+        try:
+            return apply_changes(self.connection(), delta)
+        finally:
+            # Synced contacts are found by uid, not by id.
+            self.cache.clear()
+
+    @instrumentation.timed("repository.backup")
+    def backup(self, directory=None, progress=None):
+        """Copy the database while it is in use.
+
+        Return:
+            The path of the backup, see agenda.maintenance.backup().
+        """
+
+        return backup(self.connection(), self.pool.path, directory,
+                      progress=progress)
+
+    @instrumentation.timed("repository.quick_check")
+    def quick_check(self):
+        """Check the database file.
+
+        Return:
+            A list of problems, empty if the database is sound.
+        """
+
+        return quick_check(self.connection())
+
+    @instrumentation.timed("repository.reclaim_space")
+    def reclaim_space(self):
+        """Give the free pages back to the file system, a few at a time.
+
+        Return:
+            The number of pages reclaimed.
+        """
+
+        return reclaim_space(self.connection())
+
+    @instrumentation.timed("repository.missing_images")
+    def missing_images(self):
+        """Get the pictures of contacts whose file is missing.
+
+        Return:
+            A list of tuples (path, number of contacts).
+        """
+
+        return missing_images(self.connection())
+
+    @instrumentation.timed("repository.reset_images")
+    def reset_images(self, paths):
+        """Give the contacts of missing pictures the default picture.
+
+        Return:
+            The number of contacts changed.
+        """
+
+        try:
+            return reset_images(self.connection(), paths)
+        finally:
+            # Contacts are changed by picture, not by id.
+            self.cache.clear()
+
+    @instrumentation.timed("repository.replace_images")
+    def replace_images(self, changes):
+        """Change the picture of the contacts of some pictures.
+
+        Args:
+            changes: Tuples (new path, old path).
+
+        Return:
+            The number of contacts changed.
+        """
+
+        try:
+            return replace_images(self.connection(), changes)
+        finally:
+            self.cache.clear()
@@ -0,0 +1,130 @@
+# search.py
+
+"""Full text search over the contacts of the agenda app."""
+
+import re
+
+from agenda.tags import tag_filter_sql
+
+# Columns of Contacts indexed for search.
+SEARCH_COLUMNS = ("name", "surname", "phone", "email", "address")
+
+# Characters kept from user input, anything else separates terms.
+TERM_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+
+def search_index_sql():
+    """Get the script creating the ContactsSearch FTS5 table.
+
+    ContactsSearch is an external content table over Contacts, the triggers
+    keep it in sync on every insert, update and delete. The script ends by
+    filling the table from the existing contacts.
+
+    Return:
+        The SQL script, applied by the migrations module.
+    """
+
+    columns = ", ".join(SEARCH_COLUMNS)
+    new_columns = ", ".join("new." + column for column in SEARCH_COLUMNS)
+    old_columns = ", ".join("old." + column for column in SEARCH_COLUMNS)
+
+    return '''
+        CREATE VIRTUAL TABLE IF NOT EXISTS ContactsSearch USING fts5(
+            {columns},
+            content='Contacts',
+            content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2',
+            prefix='2 3');
+
+        CREATE TRIGGER IF NOT EXISTS Contacts_search_insert
+        AFTER INSERT ON Contacts BEGIN
+            INSERT INTO ContactsSearch(rowid, {columns})
+            VALUES (new.id, {new_columns});
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS Contacts_search_delete
+        AFTER DELETE ON Contacts BEGIN
+            INSERT INTO ContactsSearch(ContactsSearch, rowid, {columns})
+            VALUES ('delete', old.id, {old_columns});
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS Contacts_search_update
+        AFTER UPDATE OF {columns} ON Contacts BEGIN
+            INSERT INTO ContactsSearch(ContactsSearch, rowid, {columns})
+            VALUES ('delete', old.id, {old_columns});
+            INSERT INTO ContactsSearch(rowid, {columns})
+            VALUES (new.id, {new_columns});
+        END;
+
+        INSERT INTO ContactsSearch(ContactsSearch) VALUES ('rebuild');
+        '''.format(columns=columns,
+                   new_columns=new_columns,
+                   old_columns=old_columns)
+
+
+def build_match_query(text):
+    """Build an FTS5 MATCH expression from free text typed by the user.
+
+    Every word becomes a quoted prefix term, so "jo sm" matches
+    "John Smith". Quoting keeps FTS5 operators in the input harmless.
+
+    Args:
+        text: Text typed in the search box.
+
+    Return:
+        The MATCH expression or None if the text has no searchable terms.
+    """
+
+    terms = TERM_PATTERN.findall(text)
+
+    if not terms:
+        return None
+
+    return " ".join('"{}"*'.format(term) for term in terms)
+
+
+def search_contacts(connection, match_query, limit, offset=0, tags=(),
+                    match_all=False):
+    """Get contacts matching a MATCH expression, best ranked first.
+
+    Args:
+        connection: Open sqlite3 connection to the agenda database.
+        match_query: Expression returned by build_match_query.
+        limit: Maximum number of rows to return.
+        offset: Number of ranked rows to skip.
+        tags: Ids of tags, only their contacts are returned if any.
+        match_all: True if contacts need all the tags, else any of them.
+
+    Return:
+        A list of tuples [(id, name, surname, sort_key, phone, image),..]
+    """
+
+    sql = '''SELECT Contacts.id, Contacts.name, Contacts.surname,
+                    Contacts.sort_key, Contacts.phone, Contacts.image
+             FROM ContactsSearch
+             JOIN Contacts ON Contacts.id = ContactsSearch.rowid
+             WHERE ContactsSearch MATCH ? {}
+             ORDER BY ContactsSearch.rank
+             LIMIT ? OFFSET ?'''
+    where, parameters = "", ()
+
+    if tags:
+        where, parameters = tag_filter_sql(tags, match_all, "Contacts.id")
+        where = "AND " + where
+
+    return connection.execute(sql.format(where),
+                              (match_query,) + parameters +
+                              (limit, offset)).fetchall()
+
+
+def contact_matches(connection, match_query, contact_id):
+    """Check if one contact matches a MATCH expression.
+
+    Return:
+        True if the contact is part of the search results.
+    """
+
+    sql = '''SELECT 1 FROM ContactsSearch
+             WHERE ContactsSearch MATCH ? AND rowid=?'''
+
+    return connection.execute(sql, (match_query, contact_id)).fetchone() is not None
@@ -0,0 +1,758 @@
+# server.py
+
+"""Local HTTP/JSON API over the contacts of the agenda.
+
+Other tools read and write the agenda through this server instead of
+opening contacts.db on their own. The event loop only parses requests and
+writes responses, every database and file access runs on a small thread
+pool, each thread with its own pooled connection.
+
+Routes:
+    GET    /contacts                 alphabetical page, ?letter=&limit=
+                                     &cursor=, or search results with ?q=
+    POST   /contacts                 create, returns 201 and the contact
+    GET    /contacts/<id>            one contact
+    PUT    /contacts/<id>            update, honours If-Match
+    DELETE /contacts/<id>            delete, honours If-Match
+    GET    /contacts/<id>/photo      picture bytes, ?size= for the smallest
+                                     stored rendition fitting that square
+    GET    /stats                    see ContactRepository.stats()
+    GET    /sync                     site id, and last change received
+                                     from ?site=
+    GET    /sync/changes             changes for ?site= after ?since=
+    POST   /sync/changes             apply changes of a peer, see
+                                     agenda.sync
+
+GET responses carry an ETag and answer If-None-Match with 304 Not
+Modified. Photo bytes and their ETag are kept in an LRU cache, so a
+revalidated photo costs a cached contact lookup and no file access.
+
+Usage:
+    python -m agenda serve --port 8080
+"""
+
+import asyncio
+import base64
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from urllib.parse import parse_qs, urlsplit
+
+from agenda.contact import DEFAULT_IMAGE, Contact, letter_key
+from agenda.lru_cache import LRUCache
+from agenda.photo_store import PHOTO_ROOT, rendition_path
+from agenda.search import build_match_query
+from agenda.sync import SYNC_COLUMNS
+
+logger = logging.getLogger(__name__)
+
+# Fields of a contact written by POST and PUT, and if they are required.
+CONTACT_FIELDS = (("name", True),
+                  ("surname", True),
+                  ("phone", True),
+                  ("email", False),
+                  ("address", False))
+
+# Largest id SQLite can store, longer ids match no contact.
+MAX_ID = 2 ** 63 - 1
+
+# Content types of the photo files served.
+PHOTO_TYPES = {".webp": "image/webp",
+               ".png": "image/png",
+               ".jpg": "image/jpeg",
+               ".jpeg": "image/jpeg",
+               ".gif": "image/gif"}
+
+
+class ApiError(Exception):
+    """Error answered to the client with an HTTP status and a message."""
+
+    def __init__(self, status, message=None):
+        super().__init__(message or status.phrase)
+
+        self.status = status
+
+
+class Request:
+    """HTTP request read from a client."""
+
+    __slots__ = ("method", "path", "query", "version", "headers", "body")
+
+    def __init__(self, method, target, version, headers, body):
+        url = urlsplit(target)
+
+        self.method = method
+        self.path = url.path
+        self.query = {name: values[-1]
+                      for name, values in parse_qs(url.query).items()}
+        self.version = version
+        self.headers = headers
+        self.body = body
+
+    def keep_alive(self):
+        """Check if the client wants the connection kept open."""
+
+        connection = self.headers.get("connection", "").lower()
+
+        if self.version == "HTTP/1.0":
+            return connection == "keep-alive"
+
+        return connection != "close"
+
+
+class Response:
+    """HTTP response written to a client."""
+
+    __slots__ = ("status", "body", "content_type", "headers")
+
+    def __init__(self, status, body=b"", content_type="application/json",
+                 headers=None):
+        self.status = status
+        self.body = body
+        self.content_type = content_type
+        self.headers = headers or {}
+
+
+def json_response(value, status=HTTPStatus.OK, headers=None):
+    """Create a JSON response with a strong ETag of its body."""
+
+    body = json.dumps(value, ensure_ascii=False,
+                      separators=(",", ":")).encode("utf-8")
+    headers = dict(headers or {})
+    headers.setdefault("ETag", body_etag(body))
+
+    return Response(status, body, headers=headers)
+
+
+def body_etag(body):
+    """Get the ETag of a response body."""
+
+    return '"{}"'.format(hashlib.blake2b(body, digest_size=12).hexdigest())
+
+
+def etag_matches(header, etag):
+    """Check an If-Match or If-None-Match header against an ETag."""
+
+    if header is None:
+        return False
+
+    tags = [tag.strip() for tag in header.split(",")]
+
+    # Weak comparison, as RFC 9110 asks for If-None-Match.
+    return "*" in tags or etag in tags or "W/" + etag in tags
+
+
+def contact_json(contact):
+    """Get the JSON representation of a contact."""
+
+    return {"id": contact.id,
+            "name": contact.name,
+            "surname": contact.surname,
+            "phone": contact.phone,
+            "email": contact.email,
+            "address": contact.address,
+            "photo": "/contacts/{}/photo".format(contact.id)}
+
+
+def row_json(row):
+    """Get the JSON representation of a contact list row."""
+
+    return {"id": row[0], "name": row[1], "surname": row[2]}
+
+
+def encode_cursor(key):
+    """Encode the (sort_key, id) of the last listed row for the client."""
+
+    return base64.urlsafe_b64encode(
+        json.dumps(key, ensure_ascii=False).encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor):
+    """Decode a cursor made by encode_cursor().
+
+    Raise:
+        ApiError if the cursor was not made by encode_cursor().
+    """
+
+    try:
+        sort_key, contact_id = json.loads(base64.urlsafe_b64decode(cursor))
+    except ValueError:
+        raise ApiError(HTTPStatus.BAD_REQUEST, "Invalid cursor") from None
+
+    if not isinstance(sort_key, str) or not isinstance(contact_id, int):
+        raise ApiError(HTTPStatus.BAD_REQUEST, "Invalid cursor")
+
+    return (sort_key, contact_id)
+
+
+def read_contact_body(request):
+    """Get the contact fields sent in a JSON request body.
+
+    Return:
+        A dict with every field of CONTACT_FIELDS.
+
+    Raise:
+        ApiError if the body is not a valid contact.
+    """
+
+    try:
+        data = json.loads(request.body.decode("utf-8"))
+    except ValueError:
+        raise ApiError(HTTPStatus.BAD_REQUEST, "Body is not JSON") from None
+
+    if not isinstance(data, dict):
+        raise ApiError(HTTPStatus.BAD_REQUEST, "Body is not a JSON object")
+
+    fields = {}
+
+    for name, required in CONTACT_FIELDS:
+        value = data.get(name, "")
+
+        if not isinstance(value, str):
+            raise ApiError(HTTPStatus.UNPROCESSABLE_ENTITY,
+                           "{} must be a string".format(name))
+
+        if required and not value.strip():
+            raise ApiError(HTTPStatus.UNPROCESSABLE_ENTITY,
+                           "{} is required".format(name))
+
+        fields[name] = value
+
+    return fields
+
+
+def read_delta(request):
+    """Get the changes of a peer sent in a JSON request body.
+
+    Return:
+        A delta, see agenda.sync.changes_since().
+
+    Raise:
+        ApiError if the body is not a valid delta.
+    """
+
+    try:
+        delta = json.loads(request.body.decode("utf-8"))
+    except ValueError:
+        raise ApiError(HTTPStatus.BAD_REQUEST, "Body is not JSON") from None
+
+    if (not isinstance(delta, dict) or
+            not isinstance(delta.get("site"), str) or
+            not isinstance(delta.get("cursor"), int) or
+            not isinstance(delta.get("changes"), list)):
+        raise ApiError(HTTPStatus.UNPROCESSABLE_ENTITY, "Invalid changes")
+
+    for change in delta["changes"]:
+        if (not isinstance(change, list) or
+                len(change) != 4 + len(SYNC_COLUMNS) or
+                not isinstance(change[0], str) or
+                not isinstance(change[1], int) or
+                not isinstance(change[2], str)):
+            raise ApiError(HTTPStatus.UNPROCESSABLE_ENTITY,
+                           "Invalid change")
+
+        if not isinstance(change[3], bool):
+            raise ApiError(HTTPStatus.BAD_REQUEST, "Invalid deleted flag")
+
+        if change[3]:
+            continue
+
+        fields = dict(zip(SYNC_COLUMNS, change[4:]))
+
+        # Synced contacts are shown like any other, see CONTACT_FIELDS.
+        if not all(isinstance(fields[name], str) and
+                   (fields[name] or not required)
+                   for name, required in CONTACT_FIELDS):
+            raise ApiError(HTTPStatus.BAD_REQUEST, "Invalid contact fields")
+
+    return delta
+
+
+class AgendaServer:
+    """asyncio HTTP server answering the agenda API.
+
+    Connections are kept alive between requests. Handlers run on the event
+    loop and hand every blocking call to the executor through run().
+    """
+
+    # Threads running database and file work.
+    MAX_WORKERS = 4
+
+    # Limits protecting the server from oversized requests.
+    MAX_HEADERS = 64
+    MAX_BODY = 64 * 1024
+
+    # Seconds an idle keep-alive connection is kept open.
+    KEEP_ALIVE_TIMEOUT = 15
+
+    # Rows of a contact list page, by default and at most.
+    PAGE_SIZE = 50
+    MAX_PAGE_SIZE = 500
+
+    # Number of photos whose bytes are kept in memory.
+    PHOTO_CACHE_SIZE = 256
+
+    def __init__(self, repository, host="127.0.0.1", port=8080,
+                 workers=MAX_WORKERS):
+        self.repository = repository
+        self.host = host
+        self.port = port
+        self.executor = ThreadPoolExecutor(max_workers=workers,
+                                           thread_name_prefix="agenda-api")
+        self.photos = LRUCache(self.PHOTO_CACHE_SIZE)
+        self.routes = (
+            ("GET", ("contacts",), self.list_contacts),
+            ("POST", ("contacts",), self.create_contact),
+            ("GET", ("contacts", int), self.get_contact),
+            ("PUT", ("contacts", int), self.update_contact),
+            ("DELETE", ("contacts", int), self.delete_contact),
+            ("GET", ("contacts", int, "photo"), self.get_photo),
+            ("GET", ("stats",), self.get_stats),
+            ("GET", ("sync",), self.get_sync),
+            ("GET", ("sync", "changes"), self.get_changes),
+            ("POST", ("sync", "changes"), self.post_changes),
+        )
+
+    def run(self, function, *args):
+        """Run a blocking call on the executor and wait for its result."""
+
+        return asyncio.get_running_loop().run_in_executor(self.executor,
+                                                          function,
+                                                          *args)
+
+    async def serve_forever(self):
+        """Listen for clients until the task is cancelled."""
+
+        server = await asyncio.start_server(self.handle_connection,
+                                            self.host,
+                                            self.port)
+
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.executor.shutdown(wait=True)
+
+    ####################################################################
+    # HTTP
+    ####################################################################
+    async def handle_connection(self, reader, writer):
+        """Answer the requests of one client connection in turn."""
+
+        try:
+            while True:
+                try:
+                    request = await asyncio.wait_for(
+                        self.read_request(reader), self.KEEP_ALIVE_TIMEOUT)
+                except ApiError as error:
+                    await self.write_response(
+                        writer, self.error_response(error), False)
+                    break
+
+                if request is None:
+                    break
+
+                keep_alive = request.keep_alive()
+                response = await self.dispatch(request)
+                await self.write_response(writer, response, keep_alive)
+
+                if not keep_alive:
+                    break
+
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError,
+                ConnectionError):
+            pass
+
+        finally:
+            writer.close()
+
+    async def read_request(self, reader):
+        """Read the next request of a connection.
+
+        Return:
+            A Request or None if the client closed the connection.
+
+        Raise:
+            ApiError if the request is malformed or too large.
+        """
+
+        try:
+            line = await reader.readline()
+
+            if not line:
+                return None
+
+            method, target, version = line.decode("latin-1").split()
+            headers = {}
+
+            while True:
+                line = await reader.readline()
+
+                if line in (b"\r\n", b"\n", b""):
+                    break
+
+                if len(headers) >= self.MAX_HEADERS:
+                    raise ApiError(
+                        HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE)
+
+                name, value = line.decode("latin-1").split(":", 1)
+                headers[name.strip().lower()] = value.strip()
+
+            length = int(headers.get("content-length", 0))
+
+        except (ValueError, asyncio.LimitOverrunError):
+            raise ApiError(HTTPStatus.BAD_REQUEST) from None
+
+        if length > self.MAX_BODY:
+            raise ApiError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE)
+
+        body = await reader.readexactly(length) if length > 0 else b""
+
+        return Request(method, target, version, headers, body)
+
+    async def write_response(self, writer, response, keep_alive):
+        """Write a response and wait until it is sent."""
+
+        status = response.status
+        lines = ["HTTP/1.1 {} {}".format(status.value, status.phrase),
+                 "Content-Length: {}".format(len(response.body)),
+                 "Connection: {}".format("keep-alive" if keep_alive
+                                         else "close")]
+
+        if response.body:
+            lines.append("Content-Type: {}".format(response.content_type))
+
+        for name, value in response.headers.items():
+            lines.append("{}: {}".format(name, value))
+
+        head = ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+        writer.write(head + response.body)
+        await writer.drain()
+
+    def error_response(self, error):
+        """Create the response of an ApiError."""
+
+        response = json_response({"error": str(error)}, error.status)
+        del response.headers["ETag"]
+
+        return response
+
+    async def dispatch(self, request):
+        """Find the handler of a request, run it and apply If-None-Match."""
+
+        try:
+            handler, args = self.route(request)
+            response = await handler(request, *args)
+
+        except ApiError as error:
+            return self.error_response(error)
+
+        except sqlite3.OperationalError as error:
+            # Mostly "database is locked" while the app writes, worth a
+            # retry.
+            return self.error_response(
+                ApiError(HTTPStatus.SERVICE_UNAVAILABLE, str(error)))
+
+        except Exception:
+            logger.exception("%s %s failed", request.method, request.path)
+
+            return self.error_response(
+                ApiError(HTTPStatus.INTERNAL_SERVER_ERROR))
+
+        etag = response.headers.get("ETag")
+
+        if (request.method == "GET" and response.status == HTTPStatus.OK and
+                etag_matches(request.headers.get("if-none-match"), etag)):
+            return Response(HTTPStatus.NOT_MODIFIED, headers={
+                name: value for name, value in response.headers.items()
+                if name in ("ETag", "Cache-Control")})
+
+        return response
+
+    def route(self, request):
+        """Match the path of a request against the routes.
+
+        Return:
+            A tuple (handler, args) with the path parameters in args.
+
+        Raise:
+            ApiError if no route matches.
+        """
+
+        parts = tuple(part for part in request.path.split("/") if part)
+        allowed = False
+
+        for method, pattern, handler in self.routes:
+            if len(pattern) != len(parts):
+                continue
+
+            args = []
+
+            for expected, part in zip(pattern, parts):
+                if expected is int:
+                    if not (part.isascii() and part.isdigit() and
+                            int(part) <= MAX_ID):
+                        break
+                    args.append(int(part))
+                elif expected != part:
+                    break
+            else:
+                if method == request.method:
+                    return handler, args
+                allowed = True
+
+        if allowed:
+            raise ApiError(HTTPStatus.METHOD_NOT_ALLOWED)
+
+        raise ApiError(HTTPStatus.NOT_FOUND)
+
+    ####################################################################
+    # Handlers
+    ####################################################################
+    def page_size(self, request):
+        """Get the limit parameter of a request, within MAX_PAGE_SIZE."""
+
+        try:
+            limit = int(request.query.get("limit", self.PAGE_SIZE))
+        except ValueError:
+            raise ApiError(HTTPStatus.BAD_REQUEST, "Invalid limit") from None
+
+        return max(1, min(limit, self.MAX_PAGE_SIZE))
+
+    async def list_contacts(self, request):
+        """Answer a page of the contact list or of search results.
+
+        The response has the rows and the cursor of the next page, null on
+        the last page.
+        """
+
+        limit = self.page_size(request)
+        text = request.query.get("q")
+
+        if text is not None:
+            match_query = build_match_query(text)
+
+            try:
+                offset = int(request.query.get("cursor", 0))
+            except ValueError:
+                raise ApiError(HTTPStatus.BAD_REQUEST,
+                               "Invalid cursor") from None
+
+            rows = []
+
+            if match_query:
+                rows = await self.run(self.repository.search_page,
+                                      match_query, limit, offset)
+
+            next_cursor = str(offset + len(rows)) if len(rows) == limit \
+                else None
+
+        else:
+            if "cursor" in request.query:
+                after = decode_cursor(request.query["cursor"])
+            else:
+                after = letter_key(request.query.get("letter"))
+
+            rows = await self.run(self.repository.list_page, after, limit)
+            next_cursor = encode_cursor([rows[-1][3], rows[-1][0]]) \
+                if len(rows) == limit else None
+
+        return json_response({"contacts": [row_json(row) for row in rows],
+                              "next": next_cursor})
+
+    async def find_contact(self, contact_id):
+        """Read a contact.
+
+        Raise:
+            ApiError if there is no such contact.
+        """
+
+        contact = await self.run(self.repository.get, contact_id)
+
+        if contact is None:
+            raise ApiError(HTTPStatus.NOT_FOUND,
+                           "Contact {} not found".format(contact_id))
+
+        return contact
+
+    def check_precondition(self, request, contact):
+        """Refuse a write if If-Match does not match the current contact.
+
+        Raise:
+            ApiError 412 Precondition Failed.
+        """
+
+        header = request.headers.get("if-match")
+
+        if header is None:
+            return
+
+        etag = json_response(contact_json(contact)).headers["ETag"]
+
+        if not etag_matches(header, etag):
+            raise ApiError(HTTPStatus.PRECONDITION_FAILED,
+                           "Contact changed since it was read")
+
+    async def get_contact(self, request, contact_id):
+        """Answer one contact."""
+
+        return json_response(contact_json(await self.find_contact(
+            contact_id)))
+
+    async def create_contact(self, request):
+        """Insert a contact with the default photo."""
+
+        fields = read_contact_body(request)
+        contact = Contact(None, image=DEFAULT_IMAGE, **fields)
+        contact_id = await self.run(self.repository.insert, contact)
+        contact = await self.find_contact(contact_id)
+
+        return json_response(
+            contact_json(contact), HTTPStatus.CREATED,
+            {"Location": "/contacts/{}".format(contact_id)})
+
+    async def update_contact(self, request, contact_id):
+        """Replace the fields of a contact, its photo is kept."""
+
+        fields = read_contact_body(request)
+        contact = await self.find_contact(contact_id)
+        self.check_precondition(request, contact)
+
+        await self.run(self.repository.update,
+                       Contact(contact_id, image=contact.image, **fields))
+
+        return json_response(contact_json(
+            await self.find_contact(contact_id)))
+
+    async def delete_contact(self, request, contact_id):
+        """Delete a contact, its photo is removed by the store GC."""
+
+        contact = await self.find_contact(contact_id)
+        self.check_precondition(request, contact)
+        await self.run(self.repository.delete, contact_id)
+
+        return Response(HTTPStatus.NO_CONTENT)
+
+    async def get_photo(self, request, contact_id):
+        """Answer the picture of a contact, revalidated on every use."""
+
+        contact = await self.find_contact(contact_id)
+        path = os.path.normpath(contact.image or DEFAULT_IMAGE)
+
+        # Only files of the store and the default icon are served, imported
+        # contacts may point anywhere until their picture is stored.
+        if path != os.path.normpath(DEFAULT_IMAGE) and \
+                not path.startswith(PHOTO_ROOT + os.sep):
+            path = os.path.normpath(DEFAULT_IMAGE)
+
+        candidates = [path]
+
+        if "size" in request.query:
+            try:
+                side = int(request.query["size"])
+            except ValueError:
+                raise ApiError(HTTPStatus.BAD_REQUEST,
+                               "Invalid size") from None
+
+            # Photos stored before renditions existed fall back to path.
+            candidates.insert(0, rendition_path(path, side))
+
+        for candidate in candidates:
+            photo = self.photos.get(candidate)
+
+            if photo is not None:
+                break
+
+            try:
+                photo = await self.run(self.read_photo, candidate)
+            except OSError:
+                continue
+
+            self.photos.put(candidate, photo)
+            break
+
+        else:
+            raise ApiError(HTTPStatus.NOT_FOUND, "Photo not found")
+
+        etag, content_type, body = photo
+
+        return Response(HTTPStatus.OK, body, content_type,
+                        {"ETag": etag, "Cache-Control": "no-cache"})
+
+    @staticmethod
+    def read_photo(path):
+        """Read a photo file.
+
+        Return:
+            A tuple (etag, content_type, body).
+        """
+
+        with open(path, "rb") as stream:
+            body = stream.read()
+
+        extension = os.path.splitext(path)[1]
+        content_type = PHOTO_TYPES.get(extension.lower(),
+                                       "application/octet-stream")
+
+        return body_etag(body), content_type, body
+
+    async def get_stats(self, request):
+        """Answer figures about the database."""
+
+        return json_response(await self.run(self.repository.stats))
+
+    def sync_peer(self, request):
+        """Get the site parameter of a sync request."""
+
+        site = request.query.get("site")
+
+        if not site:
+            raise ApiError(HTTPStatus.BAD_REQUEST, "Missing site")
+
+        return site
+
+    async def get_sync(self, request):
+        """Answer the site id and what was received from the caller."""
+
+        peer = self.sync_peer(request)
+
+        return json_response({
+            "site": await self.run(self.repository.site),
+            "received": await self.run(self.repository.received, peer)})
+
+    async def get_changes(self, request):
+        """Answer a batch of changes the caller has not received yet."""
+
+        peer = self.sync_peer(request)
+
+        try:
+            since = int(request.query.get("since", 0))
+        except ValueError:
+            raise ApiError(HTTPStatus.BAD_REQUEST, "Invalid since") from None
+
+        return json_response(
+            await self.run(self.repository.sync_changes, since, peer))
+
+    async def post_changes(self, request):
+        """Apply a batch of changes sent by a peer."""
+
+        delta = read_delta(request)
+
+        return json_response(
+            await self.run(self.repository.apply_changes, delta))
+
+
+def serve(repository, host="127.0.0.1", port=8080):
+    """Run the API server until interrupted."""
+
+    server = AgendaServer(repository, host, port)
+    print("Serving the agenda API on http://{}:{}/".format(host, port))
+
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        pass
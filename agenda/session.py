@@ -0,0 +1,103 @@
+# session.py
+
+"""Snapshot of the contact list kept between two runs of the app.
+
+On exit the app saves where the list starts, the row at the top of the
+view, the selected contact and the rows on screen. The next start shows
+those rows straight away, before the database is even opened, then
+replaces them with the rows read in the background.
+
+The snapshot is a small JSON file next to the database:
+
+    contacts.db -> contacts.session.json
+"""
+
+import json
+import os
+import tempfile
+
+from agenda.contact import letter_key
+
+
+def session_path(database):
+    """Get the snapshot file of a database file."""
+
+    return os.path.splitext(database)[0] + ".session.json"
+
+
+def as_key(value):
+    """Get a (sort_key, id) tuple from its JSON form, None if invalid."""
+
+    if (isinstance(value, list) and len(value) == 2 and
+            isinstance(value[0], str) and isinstance(value[1], int)):
+        return tuple(value)
+
+    return None
+
+
+class Session:
+    """Last state of the contact list, saved on exit.
+
+    Attributes:
+        start: (sort_key, id) the list starts after, see
+            ContactRepository.list_page().
+        top: (sort_key, id) of the row at the top of the view, None if
+            the list was showing search results.
+        selected: Id of the selected contact or None.
+        rows: Contact list rows on screen, top row first.
+    """
+
+    # Rows kept in the snapshot, enough to fill a tall window.
+    ROWS = 40
+
+    def __init__(self, path):
+        self.path = path
+        self.start = letter_key(None)
+        self.top = None
+        self.selected = None
+        self.rows = []
+
+    def load(self):
+        """Read the snapshot, a missing or damaged file leaves defaults.
+
+        Return:
+            True if a snapshot was read.
+        """
+
+        try:
+            with open(self.path, encoding="utf-8") as stream:
+                data = json.load(stream)
+        except (OSError, ValueError):
+            return False
+
+        if not isinstance(data, dict):
+            return False
+
+        self.start = as_key(data.get("start")) or letter_key(None)
+        self.top = as_key(data.get("top"))
+        selected = data.get("selected")
+        self.selected = selected if isinstance(selected, int) else None
+        self.rows = [tuple(row) for row in data.get("rows", [])
+                     if isinstance(row, list) and len(row) == 6][:self.ROWS]
+
+        return True
+
+    def save(self):
+        """Write the snapshot, replacing the previous one at once."""
+
+        data = {"start": self.start,
+                "top": self.top,
+                "selected": self.selected,
+                "rows": self.rows[:self.ROWS]}
+        directory = os.path.dirname(os.path.abspath(self.path))
+        handle, temporary = tempfile.mkstemp(suffix=".json", dir=directory)
+
+        try:
+            with os.fdopen(handle, "w", encoding="utf-8") as stream:
+                json.dump(data, stream, ensure_ascii=False)
+
+            os.replace(temporary, self.path)
+
+        except BaseException:
+            os.remove(temporary)
+            raise
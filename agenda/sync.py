@@ -0,0 +1,362 @@
+# sync.py
+
+"""Change journal and delta sync between agenda databases.
+
+Every database has a random site id. Every contact gets a uid shared by
+all its copies, and a version counter bumped on each edit. Triggers log
+every insert, update and delete of Contacts in the Changes table:
+
+    seq  uid       version  site      deleted
+    41   9f0c...   3        a51e...   0
+    42   77b2...   2        a51e...   1
+
+A database pulls from another one the changes logged after the last seq
+it received from that site, kept in SyncPeers. Only the latest change of
+each contact is sent, with the current fields of the contact, so sync
+cost follows the number of changed contacts and not the database size.
+
+Conflicts are resolved per contact by the highest (version, site): the
+contact edited most often wins, and on a tie the greatest site id. Both
+databases pick the same winner whatever the order of the syncs, so they
+converge. Photos stay local, a synced contact keeps its own photo and a
+contact created by sync gets the default one.
+
+A copied database file has the same site id as the original, give the
+copy its own with new_site() before editing it.
+
+Usage:
+    python -m agenda sync other.db
+    python -m agenda sync http://127.0.0.1:8080
+"""
+
+import json
+
+from agenda.contact import DEFAULT_IMAGE
+
+# Contacts fields copied between databases, photos are local files.
+SYNC_COLUMNS = ("name", "surname", "phone", "email", "address")
+
+# Changes read per batch, each batch is applied in its own transaction.
+SYNC_BATCH = 5000
+
+# Changes posted per request to a server, below its request body limit.
+POST_BATCH = 100
+
+SQL_SITE = "SELECT site FROM SyncSite"
+
+SQL_RECEIVED = "SELECT received FROM SyncPeers WHERE site=?"
+
+SQL_SET_RECEIVED = '''INSERT INTO SyncPeers (site, received) VALUES (?, ?)
+                      ON CONFLICT (site) DO UPDATE
+                      SET received = excluded.received'''
+
+SQL_LAST_SEQ = "SELECT COALESCE(MAX(seq), 0) FROM Changes"
+
+# Latest change of every contact changed after a seq, with the current
+# fields of the contact unless it was deleted. Changes last written by
+# the peer are skipped, the peer has them or a newer version.
+SQL_CHANGES = '''SELECT c.seq, c.uid,
+                        COALESCE(k.version, c.version),
+                        COALESCE(k.site, c.site),
+                        k.id IS NULL,
+                        {columns}
+                 FROM Changes c LEFT JOIN Contacts k ON k.uid = c.uid
+                 WHERE c.seq > ? AND c.seq <= ?
+                 AND c.seq = (SELECT MAX(seq) FROM Changes
+                              WHERE uid = c.uid)
+                 AND COALESCE(k.site, c.site) IS NOT ?
+                 ORDER BY c.seq LIMIT ?'''.format(
+    columns=", ".join("COALESCE(k.{}, '')".format(column)
+                      for column in SYNC_COLUMNS))
+
+SQL_LOCAL = "SELECT id, version, site FROM Contacts WHERE uid=?"
+
+SQL_TOMBSTONE = '''SELECT version, site FROM Changes WHERE uid=?
+                   ORDER BY seq DESC LIMIT 1'''
+
+SQL_ADD_TOMBSTONE = '''INSERT INTO Changes (uid, version, site, deleted)
+                       VALUES (?, ?, ?, 1)'''
+
+SQL_DELETE = "DELETE FROM Contacts WHERE id=?"
+
+SQL_UPDATE = "UPDATE Contacts SET {}, version=?, site=? WHERE id=?".format(
+    ", ".join(column + "=?" for column in SYNC_COLUMNS))
+
+SQL_INSERT = '''INSERT INTO Contacts (uid, version, site, image, {})
+                VALUES (?, ?, ?, ?, {})'''.format(
+    ", ".join(SYNC_COLUMNS), ", ".join("?" * len(SYNC_COLUMNS)))
+
+
+def journal_sql():
+    """Get the script adding the change journal.
+
+    Existing contacts get a uid and version 1, and are logged so the first
+    sync with another database sends all of them.
+
+    Return:
+        The SQL script, applied by the migrations module.
+    """
+
+    return '''
+        ALTER TABLE Contacts ADD COLUMN uid TEXT;
+        ALTER TABLE Contacts ADD COLUMN version INTEGER NOT NULL DEFAULT 0;
+        ALTER TABLE Contacts ADD COLUMN site TEXT;
+
+        CREATE TABLE IF NOT EXISTS SyncSite (site TEXT NOT NULL);
+        INSERT INTO SyncSite (site) VALUES (lower(hex(randomblob(16))));
+
+        CREATE TABLE IF NOT EXISTS SyncPeers
+            (site TEXT PRIMARY KEY,
+             received INTEGER NOT NULL DEFAULT 0) WITHOUT ROWID;
+
+        CREATE TABLE IF NOT EXISTS Changes
+            (seq INTEGER PRIMARY KEY AUTOINCREMENT,
+             uid TEXT NOT NULL,
+             version INTEGER NOT NULL,
+             site TEXT NOT NULL,
+             deleted INTEGER NOT NULL DEFAULT 0);
+
+        CREATE INDEX IF NOT EXISTS Changes_uid ON Changes (uid, seq);
+
+        UPDATE Contacts SET uid = lower(hex(randomblob(16))),
+                            version = 1,
+                            site = (SELECT site FROM SyncSite);
+
+        CREATE UNIQUE INDEX IF NOT EXISTS Contacts_uid ON Contacts (uid);
+
+        INSERT INTO Changes (uid, version, site)
+        SELECT uid, version, site FROM Contacts ORDER BY id;
+
+        -- Local inserts have no uid, synced ones bring theirs.
+        CREATE TRIGGER IF NOT EXISTS Contacts_journal_insert
+        AFTER INSERT ON Contacts BEGIN
+            UPDATE Contacts SET uid = lower(hex(randomblob(16))),
+                                version = 1,
+                                site = (SELECT site FROM SyncSite)
+            WHERE id = new.id AND new.uid IS NULL;
+            INSERT INTO Changes (uid, version, site)
+            SELECT uid, version, site FROM Contacts WHERE id = new.id;
+        END;
+
+        -- Local edits leave version and site alone, synced ones set them.
+        CREATE TRIGGER IF NOT EXISTS Contacts_journal_update
+        AFTER UPDATE OF name, surname, phone, email, address ON Contacts
+        BEGIN
+            UPDATE Contacts SET version = old.version + 1,
+                                site = (SELECT site FROM SyncSite)
+            WHERE id = new.id AND new.version IS old.version
+            AND new.site IS old.site;
+            INSERT INTO Changes (uid, version, site)
+            SELECT uid, version, site FROM Contacts WHERE id = new.id;
+        END;
+
+        -- Synced deletes log their tombstone before deleting.
+        CREATE TRIGGER IF NOT EXISTS Contacts_journal_delete
+        AFTER DELETE ON Contacts
+        WHEN (SELECT deleted FROM Changes WHERE uid = old.uid
+              ORDER BY seq DESC LIMIT 1) IS NOT 1 BEGIN
+            INSERT INTO Changes (uid, version, site, deleted)
+            VALUES (old.uid, old.version + 1,
+                    (SELECT site FROM SyncSite), 1);
+        END;
+        '''
+
+
+def local_site(connection):
+    """Get the site id of a database."""
+
+    return connection.execute(SQL_SITE).fetchone()[0]
+
+
+def new_site(connection):
+    """Give a copied database a site id of its own.
+
+    Return:
+        The new site id.
+    """
+
+    with connection:
+        connection.execute(
+            "UPDATE SyncSite SET site = lower(hex(randomblob(16)))")
+
+    return local_site(connection)
+
+
+def received(connection, site):
+    """Get the last seq of a peer's journal applied to a database."""
+
+    row = connection.execute(SQL_RECEIVED, (site,)).fetchone()
+
+    return row[0] if row else 0
+
+
+def changes_since(connection, since, peer, limit=SYNC_BATCH):
+    """Read a batch of changes a peer has not received yet.
+
+    Args:
+        connection: Open sqlite3 connection to the source database.
+        since: Last seq of this journal the peer received.
+        peer: Site id of the peer, its own changes are not sent back.
+        limit: Maximum number of changes.
+
+    Return:
+        A delta, dict with the source "site", the "cursor" the peer has
+        received once the delta is applied, "more" if another batch
+        follows and the "changes", lists [uid, version, site, deleted,
+        name, surname, phone, email, address].
+    """
+
+    last = connection.execute(SQL_LAST_SEQ).fetchone()[0]
+    rows = connection.execute(SQL_CHANGES,
+                              (since, last, peer, limit)).fetchall()
+    more = len(rows) == limit
+
+    return {"site": local_site(connection),
+            "cursor": rows[-1][0] if more else last,
+            "more": more,
+            "changes": [[uid, version, site, bool(deleted)] + list(fields)
+                        for _, uid, version, site, deleted, *fields
+                        in rows]}
+
+
+def apply_changes(connection, delta):
+    """Apply a delta read by changes_since() from a peer.
+
+    Every change is compared with the local copy of the contact, or its
+    tombstone, and only applied if its (version, site) is higher. The
+    changes and the new cursor of the peer are written in one transaction.
+
+    Return:
+        A dict with the number of changes "applied" and "kept" because the
+        local copy won.
+    """
+
+    applied = kept = 0
+
+    with connection:
+        connection.execute("BEGIN IMMEDIATE")
+
+        for uid, version, site, deleted, *fields in delta["changes"]:
+            local = connection.execute(SQL_LOCAL, (uid,)).fetchone()
+            clock = local[1:] if local else connection.execute(
+                SQL_TOMBSTONE, (uid,)).fetchone()
+
+            if clock is not None and (version, site) <= tuple(clock):
+                kept += clock != (version, site)
+                continue
+
+            if deleted:
+                connection.execute(SQL_ADD_TOMBSTONE, (uid, version, site))
+
+                if local:
+                    connection.execute(SQL_DELETE, (local[0],))
+
+            elif local:
+                connection.execute(SQL_UPDATE,
+                                   tuple(fields) + (version, site, local[0]))
+            else:
+                connection.execute(SQL_INSERT,
+                                   (uid, version, site, DEFAULT_IMAGE)
+                                   + tuple(fields))
+
+            applied += 1
+
+        connection.execute(SQL_SET_RECEIVED,
+                           (delta["site"], delta["cursor"]))
+
+    return {"applied": applied, "kept": kept}
+
+
+def sync_databases(local, remote):
+    """Exchange the changes of two databases in both directions.
+
+    Args:
+        local: ContactRepository of the first database.
+        remote: ContactRepository of the second database.
+
+    Return:
+        A dict with the number of changes "pulled" and "pushed", and the
+        number "kept" because the receiving side had a newer version.
+    """
+
+    pulled, kept_local = pull(local, remote.site(), remote.sync_changes)
+    pushed, kept_remote = pull(remote, local.site(), local.sync_changes)
+
+    return {"pulled": pulled, "pushed": pushed,
+            "kept": kept_local + kept_remote}
+
+
+def pull(repository, peer, read_changes):
+    """Apply batches of changes of a peer until it has no more.
+
+    Args:
+        repository: ContactRepository receiving the changes.
+        peer: Site id of the source database.
+        read_changes: Function (since, site) giving a delta of the source,
+            like ContactRepository.sync_changes.
+
+    Return:
+        A tuple (applied, kept), see apply_changes().
+    """
+
+    site = repository.site()
+    since = repository.received(peer)
+    applied = kept = 0
+
+    while True:
+        delta = read_changes(since, site)
+        result = repository.apply_changes(delta)
+        applied += result["applied"]
+        kept += result["kept"]
+        since = delta["cursor"]
+
+        if not delta["more"]:
+            return applied, kept
+
+
+def sync_url(repository, url, timeout=30):
+    """Exchange changes with a database served by the agenda API.
+
+    Args:
+        repository: ContactRepository of the local database.
+        url: Base URL of the server, like http://127.0.0.1:8080.
+        timeout: Seconds to wait for every request.
+
+    Return:
+        A dict like sync_databases().
+    """
+
+    # Only loaded when syncing with a server.
+    from urllib.request import Request, urlopen
+
+    url = url.rstrip("/")
+
+    def request(path, body=None):
+        data = None if body is None else json.dumps(body).encode("utf-8")
+        http_request = Request(url + path, data,
+                               {"Content-Type": "application/json"})
+
+        with urlopen(http_request, timeout=timeout) as response:
+            return json.loads(response.read().decode("utf-8"))
+
+    def read_changes(since, site):
+        return request("/sync/changes?since={}&site={}".format(since, site))
+
+    peer = request("/sync?site={}".format(repository.site()))
+    pulled, kept_local = pull(repository, peer["site"], read_changes)
+
+    pushed = kept_remote = 0
+    since = peer["received"]
+
+    while True:
+        delta = repository.sync_changes(since, peer["site"], POST_BATCH)
+        result = request("/sync/changes", delta)
+        pushed += result["applied"]
+        kept_remote += result["kept"]
+        since = delta["cursor"]
+
+        if not delta["more"]:
+            break
+
+    return {"pulled": pulled, "pushed": pushed,
+            "kept": kept_local + kept_remote}
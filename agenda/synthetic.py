@@ -0,0 +1,178 @@
+# synthetic.py
+
+"""Seeded synthetic contacts and photos for benchmarks and demos.
+
+The same seed always gives the same contacts and pictures, so timings of
+two versions of the app are measured on identical data.
+
+Usage:
+    python -m agenda --database bench.db generate 100000 --photos 200
+"""
+
+import os
+import random
+
+from agenda.contact import DEFAULT_IMAGE, Contact
+
+# Sizes of the generated agendas used by the benchmarks.
+SIZES = (10_000, 100_000, 1_000_000)
+
+# Size of the generated pictures, close to a phone camera photo.
+PICTURE_SIZE = (1600, 1200)
+
+NAMES = ("Ana", "Andrés", "Béatrice", "Carlos", "Chloé", "Daniel", "Elena",
+         "Étienne", "Fatima", "François", "Hugo", "Inés", "Jennifer", "João",
+         "Karin", "Liz", "Lucía", "Marc", "María", "Mohamed", "Noah", "Olga",
+         "Paul", "Renée", "Sofía", "Søren", "Tomás", "Xavi", "Yuki", "Zoë")
+
+SURNAMES = ("Álvarez", "Bauer", "Cly", "da Silva", "Dubois", "Ferrer",
+            "García", "Hellmans", "Ibáñez", "Jhonson", "Kowalski", "López",
+            "Martín", "Müller", "Navarro", "O'Brien", "Ortega", "Pérez",
+            "Quintana", "Rossi", "Sánchez", "Schmidt", "Smith", "Tanaka",
+            "Úbeda", "van Dijk", "Wagner", "Xu", "Yilmaz", "Zapata")
+
+STREETS = ("Calle Mayor", "Rue de la Paix", "Main Street", "Hauptstraße",
+           "Via Roma", "Avenida Central", "Station Road", "Kirkegade")
+
+DOMAINS = ("mail.com", "example.org", "agenda.test", "post.example")
+
+
+def generate_contacts(count, seed=0, images=(), duplicates=0.0):
+    """Generate contacts.
+
+    Args:
+        count: Number of contacts.
+        seed: Seed of the random generator.
+        images: Pictures given to one contact in ten, the others get the
+            default image.
+        duplicates: Share of contacts copying a recent one, with the phone
+            and email written differently.
+
+    Yields:
+        Contact instances without id.
+    """
+
+    generator = random.Random(seed)
+    recent = []
+
+    for number in range(count):
+        # Drawn only when asked, so the other contacts do not change.
+        if duplicates and recent and generator.random() < duplicates:
+            original = generator.choice(recent)
+            yield Contact(None,
+                          original.name,
+                          original.surname,
+                          "00" + original.phone.replace(" ", "")[1:],
+                          original.email.upper(),
+                          original.image,
+                          original.address)
+            continue
+
+        name = generator.choice(NAMES)
+        surname = generator.choice(SURNAMES)
+
+        # A second surname makes most (surname, name) pairs distinct.
+        if generator.random() < 0.7:
+            surname = "{} {}".format(surname, generator.choice(SURNAMES))
+
+        image = DEFAULT_IMAGE
+
+        if images and generator.random() < 0.1:
+            image = generator.choice(images)
+
+        phone = "+{} {:03} {:06}".format(generator.randint(1, 99),
+                                         generator.randint(0, 999),
+                                         generator.randint(0, 999999))
+        contact = Contact(None,
+                          name,
+                          surname,
+                          phone,
+                          "{}.{}{}@{}".format(name.lower(),
+                                              surname.split()[0].lower(),
+                                              number,
+                                              generator.choice(DOMAINS)),
+                          image,
+                          "{} {}, {}".format(generator.choice(STREETS),
+                                             generator.randint(1, 200),
+                                             generator.randint(10000, 99999)))
+
+        # Kept for the duplicates of the next contacts.
+        if duplicates:
+            recent.append(contact)
+
+            if len(recent) > 1000:
+                del recent[0]
+
+        yield contact
+
+
+def generate_pictures(directory, count, seed=0, size=PICTURE_SIZE):
+    """Write distinct JPEG pictures, existing ones are kept.
+
+    Args:
+        directory: Directory the pictures are written to.
+        count: Number of pictures.
+        seed: Seed of the random generator.
+        size: Tuple (width, height) of the pictures.
+
+    Return:
+        The list of picture paths.
+    """
+
+    from PIL import Image, ImageDraw
+
+    generator = random.Random(seed)
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+
+    for number in range(count):
+        colors = [tuple(generator.randrange(256) for _ in range(3))
+                  for _ in range(4)]
+        path = os.path.join(directory,
+                            "picture-{}-{}.jpg".format(seed, number))
+        paths.append(path)
+
+        if os.path.exists(path):
+            continue
+
+        image = Image.new("RGB", size, colors[0])
+        draw = ImageDraw.Draw(image)
+
+        for color in colors[1:]:
+            left = generator.randrange(size[0] // 2)
+            top = generator.randrange(size[1] // 2)
+            draw.ellipse((left, top,
+                          left + generator.randrange(100, size[0] // 2),
+                          top + generator.randrange(100, size[1] // 2)),
+                         fill=color)
+
+        image.save(path, "JPEG", quality=90)
+
+    return paths
+
+
+def populate(repository, count, seed=0, pictures=(), store=None,
+             duplicates=0.0):
+    """Fill a database with generated contacts.
+
+    Args:
+        repository: ContactRepository of the database.
+        count: Number of contacts.
+        seed: Seed of the random generator.
+        pictures: Paths of pictures given to one contact in ten, see
+            generate_pictures().
+        store: PhotoStore the pictures are added to first, None to
+            reference the pictures as they are.
+        duplicates: Share of duplicated contacts, see generate_contacts().
+
+    Return:
+        The number of inserted contacts.
+    """
+
+    images = list(pictures)
+
+    if store is not None:
+        images = [store.put(picture) for picture in images]
+
+    return repository.bulk_insert(
+        generate_contacts(count, seed, images, duplicates))
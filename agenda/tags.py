@@ -0,0 +1,211 @@
+# tags.py
+
+"""Tags grouping contacts, and the paged list of the contacts of tags.
+
+A contact can have any number of tags, kept in ContactTags with a copy of
+the contact's sort key:
+
+    tag_id  sort_key         contact_id
+    3       "smith\x1fjohn"  42
+
+The index on (tag_id, sort_key, contact_id) holds every contact of a tag
+in list order, so a page of a tag is read like a page of the whole list,
+see ContactRepository.list_page(), without sorting. Triggers keep the sort
+key copies and the number of contacts of every tag, Tags.contacts, up to
+date, so the tag list never counts rows.
+
+Pages of several tags:
+
+* any of the tags: the next page of every tag is read from the index and
+  the pages are merged;
+* all the tags: the tag with the fewest contacts is paged, and contacts
+  missing one of the other tags skipped.
+
+Tags are local to a database, they are not synced.
+"""
+
+# Longest tag name.
+MAX_NAME = 40
+
+SQL_TAGS = "SELECT id, name, contacts FROM Tags ORDER BY name, id"
+
+SQL_ADD_TAG = "INSERT INTO Tags (name) VALUES (?)"
+
+SQL_DELETE_TAG = "DELETE FROM Tags WHERE id=?"
+
+SQL_TAG_CONTACT = '''INSERT OR IGNORE INTO ContactTags
+                         (tag_id, sort_key, contact_id)
+                     SELECT ?, sort_key, id FROM Contacts WHERE id=?'''
+
+SQL_UNTAG_CONTACT = "DELETE FROM ContactTags WHERE tag_id=? AND contact_id=?"
+
+SQL_CONTACT_TAGS = '''SELECT t.name FROM ContactTags c
+                      JOIN Tags t ON t.id = c.tag_id
+                      WHERE c.contact_id=? ORDER BY t.name'''
+
+# Copies the tags of merged contacts to the contact they are merged into.
+SQL_MOVE_TAGS = '''INSERT OR IGNORE INTO ContactTags
+                       (tag_id, sort_key, contact_id)
+                   SELECT tag_id,
+                          (SELECT sort_key FROM Contacts WHERE id=?), ?
+                   FROM ContactTags WHERE contact_id=?'''
+
+SQL_COUNTS = "SELECT id, contacts FROM Tags WHERE id IN ({})"
+
+# Contacts of one tag after a key in list order, or before it backwards.
+SQL_TAG_KEYS = '''SELECT sort_key, contact_id FROM ContactTags m
+                  WHERE tag_id=? AND (sort_key, contact_id) {operator} (?, ?)
+                  {where}
+                  ORDER BY sort_key {order}, contact_id {order} LIMIT ?'''
+
+# Contacts having a tag, see tag_filter_sql().
+SQL_HAS_TAG = '''EXISTS (SELECT 1 FROM ContactTags
+                         WHERE tag_id=? AND contact_id={})'''
+
+SQL_TAG_PAGE = '''SELECT c.id, c.name, c.surname, c.sort_key, c.phone,
+                         c.image
+                  FROM ({keys}) k JOIN Contacts c ON c.id = k.contact_id
+                  ORDER BY k.sort_key, k.contact_id'''
+
+
+def tags_sql():
+    """Get the script creating the tag tables and their triggers.
+
+    Return:
+        The SQL script, applied by the migrations module.
+    """
+
+    return '''
+        CREATE TABLE IF NOT EXISTS Tags
+            (id INTEGER PRIMARY KEY,
+             name TEXT NOT NULL UNIQUE COLLATE NOCASE,
+             contacts INTEGER NOT NULL DEFAULT 0);
+
+        CREATE TABLE IF NOT EXISTS ContactTags
+            (tag_id INTEGER NOT NULL,
+             contact_id INTEGER NOT NULL,
+             sort_key TEXT,
+             PRIMARY KEY (tag_id, contact_id)) WITHOUT ROWID;
+
+        -- Pages of a tag in list order, and tags of a contact.
+        CREATE INDEX IF NOT EXISTS ContactTags_page
+            ON ContactTags (tag_id, sort_key, contact_id);
+        CREATE INDEX IF NOT EXISTS ContactTags_contact
+            ON ContactTags (contact_id, tag_id);
+
+        CREATE TRIGGER IF NOT EXISTS ContactTags_count_insert
+        AFTER INSERT ON ContactTags BEGIN
+            UPDATE Tags SET contacts = contacts + 1 WHERE id = new.tag_id;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS ContactTags_count_delete
+        AFTER DELETE ON ContactTags BEGIN
+            UPDATE Tags SET contacts = contacts - 1 WHERE id = old.tag_id;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS Tags_delete
+        AFTER DELETE ON Tags BEGIN
+            DELETE FROM ContactTags WHERE tag_id = old.id;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS Contacts_tags_delete
+        AFTER DELETE ON Contacts BEGIN
+            DELETE FROM ContactTags WHERE contact_id = old.id;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS Contacts_tags_sort
+        AFTER UPDATE OF sort_key ON Contacts BEGIN
+            UPDATE ContactTags SET sort_key = new.sort_key
+            WHERE contact_id = new.id;
+        END;
+        '''
+
+
+def check_name(name):
+    """Get a tag name without surrounding blanks.
+
+    Raise:
+        ValueError if the name is empty or longer than MAX_NAME.
+    """
+
+    name = " ".join(name.split())
+
+    if not name:
+        raise ValueError("A tag needs a name")
+
+    if len(name) > MAX_NAME:
+        raise ValueError("Tag names have at most {} characters".format(
+            MAX_NAME))
+
+    return name
+
+
+def tag_filter_sql(tags, match_all, column):
+    """Get the condition of contacts having some tags.
+
+    Args:
+        tags: Ids of the tags.
+        match_all: True if contacts need all the tags, else any of them.
+        column: Column holding the contact id, like "Contacts.id".
+
+    Return:
+        A tuple (sql, parameters).
+    """
+
+    condition = SQL_HAS_TAG.format(column)
+    operator = " AND " if match_all else " OR "
+
+    return "(" + operator.join([condition] * len(tags)) + ")", tuple(tags)
+
+
+def tag_page(connection, tags, match_all, key, limit, backward=False):
+    """Get a page of the contacts of some tags, in list order.
+
+    Args:
+        connection: Open sqlite3 connection to the agenda database.
+        tags: Ids of the tags, at least one.
+        match_all: True if contacts need all the tags, else any of them.
+        key: Tuple (sort_key, id) of the last contact of the previous
+            page, or of the first contact of the next page if backward.
+        limit: Maximum number of contacts.
+        backward: True to read the contacts right before key.
+
+    Return:
+        A list of tuples [(id, name, surname, sort_key, phone, image),..]
+    """
+
+    tags = list(dict.fromkeys(tags))
+    operator, order = ("<", "DESC") if backward else (">", "ASC")
+
+    if match_all:
+        # Page the smallest tag, probe the others.
+        counts = dict(connection.execute(
+            SQL_COUNTS.format(", ".join("?" * len(tags))), tags))
+        tags.sort(key=lambda tag: counts.get(tag, 0))
+        where, parameters = "", ()
+
+        if len(tags) > 1:
+            where, parameters = tag_filter_sql(tags[1:], True,
+                                               "m.contact_id")
+            where = "AND " + where
+
+        keys = SQL_TAG_KEYS.format(operator=operator, order=order,
+                                   where=where)
+        parameters = (tags[0],) + tuple(key) + parameters + (limit,)
+
+    else:
+        # Every tag gives its next page at most, the first ones of their
+        # union are the next page of any of the tags.
+        keys = " UNION ".join(
+            ["SELECT * FROM ({})".format(SQL_TAG_KEYS.format(
+                operator=operator, order=order, where=""))] * len(tags))
+        keys += " ORDER BY 1 {0}, 2 {0} LIMIT ?".format(order)
+        parameters = ()
+
+        for tag in tags:
+            parameters += (tag,) + tuple(key) + (limit,)
+
+        parameters += (limit,)
+
+    return connection.execute(SQL_TAG_PAGE.format(keys=keys),
+                              parameters).fetchall()
@@ -0,0 +1,289 @@
+# benchmark.py
+
+"""Benchmarks of the agenda hot paths on generated agendas.
+
+Every case is timed on databases of growing size filled by
+agenda.synthetic with a fixed seed, so two versions of the app are
+measured on the same data. The UI runs offscreen, no display is needed.
+
+For every case the report gives the best and median time of one run and
+the peak of Python memory allocated while it runs (tracemalloc, memory
+allocated by Qt and SQLite is not traced).
+
+Usage:
+    python benchmark.py --rows 10000 100000 --json results.json
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# Set before Qt is loaded, the benchmarks never show a window.
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from PyQt5.QtGui import QImage
+from PyQt5.QtWidgets import QApplication
+
+from agenda.contact import Contact
+from agenda.photo_store import PhotoStore
+from agenda.repository import ContactRepository
+from agenda.synthetic import SIZES, generate_pictures, populate
+from contact_delegate import ContactDelegate
+from contact_events import contact_events
+from main_window import MainWindow
+
+# Distinct pictures shared by the generated contacts.
+PICTURES = 50
+
+
+class Bench:
+    """Main window and data the cases of one database size run on."""
+
+    def __init__(self, app, directory, rows, seed):
+        self.app = app
+        self.rows = rows
+        self.pictures = generate_pictures(os.path.join(directory,
+                                                       "pictures"),
+                                          PICTURES,
+                                          seed)
+        self.store = PhotoStore(os.path.join(directory, "images"))
+        self.directory = directory
+
+        path = os.path.join(directory, "agenda-{}-{}.db".format(rows, seed))
+        exists = os.path.exists(path)
+        self.repository = ContactRepository(path)
+
+        if not exists:
+            start = time.perf_counter()
+            populate(self.repository, rows, seed, self.pictures, self.store)
+            print("Generated {} contacts in {:.1f} s".format(
+                rows, time.perf_counter() - start))
+
+        self.window = MainWindow(self.repository, self.store)
+        self.model = self.window.contact_model
+        self.ids = [row[0] for row in self.repository.list_page(
+            limit=min(rows, 5000))]
+        self.turn = 0
+
+    def next_id(self):
+        """Get a contact id, a different one on every call."""
+
+        self.turn += 1
+
+        return self.ids[(self.turn * 7919) % len(self.ids)]
+
+    def process_events(self):
+        """Let queued signals and repaints run."""
+
+        self.app.processEvents()
+
+
+########################################################################
+# Cases
+########################################################################
+def update_contact_list(bench, _):
+    """Reload the contact list and read its first page."""
+
+    bench.window.update_contact_list()
+    bench.model.fetchMore()
+
+
+def scroll_contact_list(bench, _):
+    """Read the first ten pages of the list, as scrolling does."""
+
+    bench.model.refresh()
+
+    for _ in range(10):
+        bench.model.fetchMore()
+
+
+def search_contacts(bench, _):
+    """Search a name prefix and read the first page of results."""
+
+    bench.model.set_search("mar")
+    bench.model.fetchMore()
+    bench.model.set_search("")
+
+
+def get_contact(bench, _):
+    """Read a contact that is not in the repository cache."""
+
+    bench.repository.cache.clear()
+    bench.repository.get(bench.next_id())
+
+
+def get_contact_cached(bench, contact_id):
+    """Read a contact from the repository cache."""
+
+    bench.repository.get(contact_id)
+
+
+def display_first_contact(bench, _):
+    """Show the first contact in the details panel."""
+
+    bench.window.display_first_contact()
+
+
+def select_contact(bench, _):
+    """Select a row of the list and show its contact."""
+
+    bench.window.contact_list.setCurrentIndex(
+        bench.model.index(bench.turn % bench.model.rowCount()))
+    bench.turn += 1
+    bench.process_events()
+
+
+def store_photo(bench, store):
+    """Resize a camera picture into an empty photo store."""
+
+    store.put(bench.pictures[0])
+
+
+def decode_avatar(bench, path):
+    """Decode the photo of a list row, as the contact delegate does."""
+
+    QImage(path)
+
+
+def delete_and_refresh(bench, contact_id):
+    """Delete a contact and refresh the window as on_delete does."""
+
+    bench.repository.delete(contact_id)
+    contact_events.contactDeleted.emit(contact_id)
+    bench.window.display_first_contact()
+    bench.process_events()
+
+
+def setup_cached(bench):
+    contact_id = bench.next_id()
+    bench.repository.get(contact_id)
+
+    return contact_id
+
+
+def setup_list(bench):
+    bench.model.refresh()
+    bench.model.fetchMore()
+
+
+def setup_store(bench):
+    return PhotoStore(tempfile.mkdtemp(dir=bench.directory))
+
+
+def setup_avatar(bench):
+    return bench.window.pixmap_cache.resolve(
+        bench.store.put(bench.pictures[0]), ContactDelegate.THUMBNAIL_SIZE)
+
+
+def setup_delete(bench):
+    return bench.repository.insert(
+        Contact(None, "Bench", "Delete", "0", "", "icons/person.png", ""))
+
+
+# Name, function and setup of every case, setup runs untimed before every
+# run and its result is passed to the function.
+CASES = (
+    ("update_contact_list", update_contact_list, None),
+    ("scroll_contact_list", scroll_contact_list, None),
+    ("search_contacts", search_contacts, None),
+    ("get_contact", get_contact, None),
+    ("get_contact_cached", get_contact_cached, setup_cached),
+    ("display_first_contact", display_first_contact, None),
+    ("select_contact", select_contact, setup_list),
+    ("store_photo", store_photo, setup_store),
+    ("decode_avatar", decode_avatar, setup_avatar),
+    ("delete_and_refresh", delete_and_refresh, setup_delete),
+)
+
+
+def measure(bench, function, setup, repeat):
+    """Time a case and trace its memory.
+
+    Return:
+        A dict with the best and median time in milliseconds and the peak
+        of traced memory in KiB.
+    """
+
+    times = []
+
+    for _ in range(repeat):
+        argument = setup(bench) if setup else None
+        start = time.perf_counter()
+        function(bench, argument)
+        times.append((time.perf_counter() - start) * 1000)
+
+    # Tracing slows Python code down, memory is measured on its own run.
+    argument = setup(bench) if setup else None
+    tracemalloc.start()
+    function(bench, argument)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {"best_ms": round(min(times), 3),
+            "median_ms": round(statistics.median(times), 3),
+            "peak_kib": round(peak / 1024, 1)}
+
+
+def main(argv=None):
+    """Run the cases on every database size and print a report."""
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows",
+                        type=int,
+                        nargs="+",
+                        default=SIZES[:2],
+                        help="database sizes, default %(default)s")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--cases",
+                        nargs="+",
+                        choices=[name for name, _, _ in CASES],
+                        help="only run these cases")
+    parser.add_argument("--directory",
+                        default=os.path.join(tempfile.gettempdir(),
+                                             "agenda-benchmark"),
+                        help="where generated databases are kept")
+    parser.add_argument("--json", help="also write the results to a file")
+    arguments = parser.parse_args(argv)
+
+    # The window loads its icons from paths relative to the app.
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    os.makedirs(arguments.directory, exist_ok=True)
+
+    app = QApplication(sys.argv[:1])
+    results = []
+
+    print("{:>9}  {:<22} {:>10} {:>10} {:>10}".format(
+        "rows", "case", "best ms", "median ms", "peak KiB"))
+
+    for rows in arguments.rows:
+        bench = Bench(app, arguments.directory, rows, arguments.seed)
+
+        for name, function, setup in CASES:
+            if arguments.cases and name not in arguments.cases:
+                continue
+
+            result = measure(bench, function, setup, arguments.repeat)
+            result.update(rows=rows, case=name)
+            results.append(result)
+
+            print("{rows:>9}  {case:<22} {best_ms:>10} {median_ms:>10} "
+                  "{peak_kib:>10}".format(**result))
+
+        bench.window.close()
+        bench.repository.pool.close()
+
+    if arguments.json:
+        with open(arguments.json, "w") as stream:
+            json.dump(results, stream, indent=2)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
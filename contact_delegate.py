@@ -0,0 +1,98 @@
+# contact_delegate.py
+
+"""Painting of the rows of the contact list."""
+
+from PyQt5.QtCore import QRect, QSize, Qt
+from PyQt5.QtGui import QFont, QPalette
+from PyQt5.QtWidgets import QApplication, QStyle, QStyledItemDelegate
+
+from contact_list_model import ContactListModel
+
+
+class ContactDelegate(QStyledItemDelegate):
+    """Paints a contact row: thumbnail, then name and surname over phone.
+
+    Values are read from the model roles when a row is painted, so only
+    visible rows are ever formatted. Thumbnails come from the pixmap cache
+    and are decoded in the background the first time, the default image
+    is painted meanwhile.
+    """
+
+    # Height of every row, the list uses uniform item sizes.
+    ROW_HEIGHT = 44
+
+    # Side of the thumbnail square, the smallest stored rendition fits it
+    # without scaling on standard displays.
+    THUMBNAIL_SIZE = 32
+
+    # Space around the thumbnail and the text.
+    MARGIN = 4
+
+    def __init__(self, pixmap_cache, default_image, parent=None):
+        super().__init__(parent)
+
+        self.pixmap_cache = pixmap_cache
+        self.default_image = default_image
+
+    def sizeHint(self, option, index):
+        """Give every row the same height."""
+
+        return QSize(option.rect.width(), self.ROW_HEIGHT)
+
+    def paint(self, painter, option, index):
+        """Paint the background, thumbnail, name and phone of a row."""
+
+        widget = option.widget
+        style = widget.style() if widget else QApplication.style()
+        style.drawPrimitive(QStyle.PE_PanelItemViewItem, option, painter,
+                            widget)
+
+        rect = option.rect
+        side = self.THUMBNAIL_SIZE
+        ratio = painter.device().devicePixelRatioF()
+        thumbnail = self.pixmap_cache.thumbnail(
+            index.data(ContactListModel.IMAGE_ROLE), side, ratio)
+
+        if thumbnail is None:
+            thumbnail = self.pixmap_cache.thumbnail(self.default_image, side,
+                                                    ratio)
+
+        painter.save()
+
+        if thumbnail is not None:
+            # Centered in the square, photos may not be square.
+            width = round(thumbnail.width() / ratio)
+            height = round(thumbnail.height() / ratio)
+            painter.drawPixmap(
+                rect.left() + self.MARGIN + (side - width) // 2,
+                rect.top() + (rect.height() - height) // 2,
+                thumbnail)
+
+        if option.state & QStyle.State_Selected:
+            painter.setPen(option.palette.color(QPalette.HighlightedText))
+        else:
+            painter.setPen(option.palette.color(QPalette.Text))
+
+        left = rect.left() + side + 2 * self.MARGIN
+        width = rect.right() - left - self.MARGIN
+        half = rect.height() // 2
+
+        font = QFont(option.font)
+        font.setBold(True)
+        painter.setFont(font)
+        name = " ".join((index.data(ContactListModel.NAME_ROLE),
+                         index.data(ContactListModel.SURNAME_ROLE)))
+        painter.drawText(
+            QRect(left, rect.top(), width, half),
+            Qt.AlignLeft | Qt.AlignBottom,
+            painter.fontMetrics().elidedText(name, Qt.ElideRight, width))
+
+        painter.setFont(option.font)
+        painter.drawText(
+            QRect(left, rect.top() + half, width, rect.height() - half),
+            Qt.AlignLeft | Qt.AlignTop,
+            painter.fontMetrics().elidedText(
+                index.data(ContactListModel.PHONE_ROLE), Qt.ElideRight,
+                width))
+
+        painter.restore()
@@ -0,0 +1,25 @@
+# contact_events.py
+
+"""Row level change notifications for the agenda app."""
+
+from PyQt5.QtCore import QObject, pyqtSignal
+
+
+class ContactEvents(QObject):
+    """Signals emitted after a contact is committed to the database.
+
+    Every signal carries the id of the affected contact so listeners can
+    patch a single row instead of reloading the whole table.
+    """
+
+    contactInserted = pyqtSignal(int)
+    contactUpdated = pyqtSignal(int)
+    contactDeleted = pyqtSignal(int)
+
+    # Batch operations notify once with every affected id.
+    contactsUpdated = pyqtSignal(list)
+    contactsDeleted = pyqtSignal(list)
+
+
+# Shared instance, forms emit on it and views listen to it.
+contact_events = ContactEvents()
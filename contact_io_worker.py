@@ -0,0 +1,98 @@
+# contact_io_worker.py
+
+"""Background import and export of contact files.
+
+Files are processed on the global QThreadPool, the results come back to
+the GUI thread through the signals of io_signals.
+"""
+
+import sqlite3
+
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal
+
+from agenda.contact_io import export_contacts, import_contacts
+
+
+class IOSignals(QObject):
+    """Signals emitted when a background import or export is done."""
+
+    # Path and number of contacts of a finished import.
+    importFinished = pyqtSignal(str, int)
+
+    # Path and number of contacts of a finished export.
+    exportFinished = pyqtSignal(str, int)
+
+    # Path and error message of a failed import or export.
+    ioFailed = pyqtSignal(str, str)
+
+
+# Shared instance, it lives in the GUI thread.
+io_signals = IOSignals()
+
+
+class ImportTask(QRunnable):
+    """Runnable importing a CSV or vCard file."""
+
+    def __init__(self, repository, path):
+        super().__init__()
+
+        self.repository = repository
+        self.path = path
+
+    def run(self):
+        """Import the file and report the result."""
+
+        try:
+            count = import_contacts(self.repository, self.path)
+
+        except (OSError, ValueError, sqlite3.Error) as error:
+            io_signals.ioFailed.emit(self.path, str(error))
+
+            return
+
+        finally:
+            self.repository.pool.release()
+
+        io_signals.importFinished.emit(self.path, count)
+
+
+class ExportTask(QRunnable):
+    """Runnable exporting contacts to a CSV or vCard file."""
+
+    def __init__(self, repository, path, contact_ids=None):
+        super().__init__()
+
+        self.repository = repository
+        self.path = path
+        self.contact_ids = contact_ids
+
+    def run(self):
+        """Export the contacts and report the result."""
+
+        try:
+            count = export_contacts(self.repository,
+                                    self.path,
+                                    contact_ids=self.contact_ids)
+
+        except (OSError, ValueError, sqlite3.Error) as error:
+            io_signals.ioFailed.emit(self.path, str(error))
+
+            return
+
+        finally:
+            self.repository.pool.release()
+
+        io_signals.exportFinished.emit(self.path, count)
+
+
+def start_import(repository, path):
+    """Import a file in the background, see ImportTask."""
+
+    QThreadPool.globalInstance().start(ImportTask(repository, path))
+
+
+def start_export(repository, path, contact_ids=None):
+    """Export contacts in the background, see ExportTask."""
+
+    QThreadPool.globalInstance().start(
+        ExportTask(repository, path, contact_ids))
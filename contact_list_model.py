@@ -0,0 +1,463 @@
+# contact_list_model.py
+
+"""Paged list model feeding the contact list view of the agenda app."""
+
+from bisect import bisect_left
+
+from PyQt5.QtCore import QAbstractListModel, QModelIndex, Qt
+
+from agenda.contact import letter_key
+from agenda.instrumentation import instrumentation
+from agenda.search import build_match_query
+
+
+class ContactListModel(QAbstractListModel):
+    """List model that loads contacts from the database in windows.
+
+    Contacts are listed in alphabetical order, surname first. Only
+    ``id, name, surname, sort_key, phone, image`` are read, BATCH_SIZE rows
+    at a time, when the view asks for more rows while scrolling
+    (canFetchMore / fetchMore). The list can start at any initial, see
+    set_letter(), the rows above are then read backwards when the view
+    reaches the top (canFetchPrevious / fetchPrevious).
+
+    Rows keep the values as read, the contact id is the Qt.UserRole data
+    and the other columns have their own roles. Nothing is formatted
+    until the view asks for it, see ContactDelegate.
+
+    When a search is set the model lists the matching contacts instead, best
+    ranked first. Both can be narrowed to the contacts of some tags, see
+    set_tags().
+
+    At startup the model has no repository yet: rows are given by
+    reset_rows() and append_rows(), and nothing is fetched until attach().
+    """
+
+    # Number of rows read from the database on every fetch.
+    BATCH_SIZE = 256
+
+    # Key sorted before every contact.
+    FIRST_KEY = ("", 0)
+
+    # Roles of the row data besides Qt.DisplayRole.
+    ID_ROLE = Qt.UserRole
+    NAME_ROLE = Qt.UserRole + 1
+    SURNAME_ROLE = Qt.UserRole + 2
+    PHONE_ROLE = Qt.UserRole + 3
+    IMAGE_ROLE = Qt.UserRole + 4
+
+    # Position in a row of the value of each role.
+    ROLE_COLUMNS = {ID_ROLE: 0,
+                    NAME_ROLE: 1,
+                    SURNAME_ROLE: 2,
+                    PHONE_ROLE: 4,
+                    IMAGE_ROLE: 5}
+
+    def __init__(self, repository, parent=None):
+        super().__init__(parent)
+
+        self.repository = repository
+        self._rows = []
+        self._keys = []
+        self._key_of = {}
+        self._exhausted = False
+        self._match_query = None
+        self._start = self.FIRST_KEY
+        self._tags = ()
+        self._match_all = False
+
+    def rowCount(self, parent=QModelIndex()):
+        """Return the number of rows loaded so far."""
+
+        if parent.isValid():
+            return 0
+
+        return len(self._rows)
+
+    def data(self, index, role=Qt.DisplayRole):
+        """Return one value of a row, see ROLE_COLUMNS."""
+
+        if not index.isValid():
+            return None
+
+        contact = self._rows[index.row()]
+        column = self.ROLE_COLUMNS.get(role)
+
+        if column is not None:
+            return contact[column]
+
+        # Used by keyboard search and accessibility, rows are painted by
+        # ContactDelegate.
+        if role == Qt.DisplayRole:
+            return "{} {}".format(contact[1], contact[2])
+
+        return None
+
+    def canFetchMore(self, parent=QModelIndex()):
+        """Return True while there are rows left in the database."""
+
+        if parent.isValid() or self.repository is None:
+            return False
+
+        return not self._exhausted
+
+    @instrumentation.timed("ui.fetch_more")
+    def fetchMore(self, parent=QModelIndex()):
+        """Read the next window of contacts and append it to the model."""
+
+        if parent.isValid():
+            return
+
+        if self._match_query:
+            batch = self.repository.search_page(self._match_query,
+                                                self.BATCH_SIZE,
+                                                len(self._rows),
+                                                self._tags,
+                                                self._match_all)
+
+        elif self._tags:
+            after = self._keys[-1] if self._keys else self._start
+            batch = self.repository.tag_page(self._tags, self._match_all,
+                                             after, self.BATCH_SIZE)
+
+        else:
+            after = self._keys[-1] if self._keys else self._start
+            batch = self.repository.list_page(after, self.BATCH_SIZE)
+
+        if len(batch) < self.BATCH_SIZE:
+            self._exhausted = True
+
+        self.append_rows(batch)
+
+    def canFetchPrevious(self):
+        """Return True while the list starts after the first contact."""
+
+        if self.repository is None or self._match_query:
+            return False
+
+        return self._start != self.FIRST_KEY
+
+    @instrumentation.timed("ui.fetch_previous")
+    def fetchPrevious(self):
+        """Read the window of contacts before the loaded ones.
+
+        Return:
+            The number of rows inserted at the top.
+        """
+
+        # Ids are integers, nothing sorts between (key, id) and
+        # (key, id + 1), so the start itself is included.
+        before = (self._keys[0] if self._keys
+                  else (self._start[0], self._start[1] + 1))
+
+        if self._tags:
+            batch = self.repository.tag_page_before(
+                self._tags, self._match_all, before, self.BATCH_SIZE)
+        else:
+            batch = self.repository.page_before(before, self.BATCH_SIZE)
+
+        if len(batch) < self.BATCH_SIZE:
+            self._start = self.FIRST_KEY
+        else:
+            self._start = (batch[0][3], batch[0][0] - 1)
+
+        self.prepend_rows(batch)
+
+        return len(batch)
+
+    def prepend_rows(self, rows):
+        """Insert rows read from the database before the loaded ones.
+
+        Args:
+            rows: List of tuples (id, name, surname, sort_key, phone,
+                image) in list order.
+        """
+
+        if not rows:
+            return
+
+        self.beginInsertRows(QModelIndex(), 0, len(rows) - 1)
+        keys = [(contact[3], contact[0]) for contact in rows]
+        self._rows[:0] = rows
+        self._keys[:0] = keys
+
+        for contact, key in zip(rows, keys):
+            self._key_of[contact[0]] = key
+
+        self.endInsertRows()
+
+    def append_rows(self, rows):
+        """Append rows read from the database after the loaded ones.
+
+        Args:
+            rows: List of tuples (id, name, surname, sort_key, phone,
+                image) in list order.
+        """
+
+        if not rows:
+            return
+
+        first = len(self._rows)
+        self.beginInsertRows(QModelIndex(), first, first + len(rows) - 1)
+
+        for contact in rows:
+            key = (contact[3], contact[0])
+            self._rows.append(contact)
+            self._keys.append(key)
+            self._key_of[contact[0]] = key
+
+        self.endInsertRows()
+
+    def reset_rows(self, start):
+        """Drop every row and start the list after a key, without reading.
+
+        Args:
+            start: Tuple (sort_key, id) the list starts after.
+        """
+
+        self._start = start
+        self._match_query = None
+        self.refresh()
+
+    def attach(self, repository, exhausted):
+        """Let the model read from a repository once it is open.
+
+        Args:
+            repository: ContactRepository the rows come from.
+            exhausted: True if the loaded rows reach the end of the list.
+        """
+
+        self.repository = repository
+        self._exhausted = exhausted
+
+    def rows_from(self, first, count):
+        """Get loaded rows, see append_rows().
+
+        Return:
+            A list of at most count rows starting at row first.
+        """
+
+        return self._rows[first:first + count]
+
+    def contact_id(self, index):
+        """Return the contact id stored in the given row.
+
+        Return:
+            The contact id or None if the index is not valid.
+        """
+
+        if not index.isValid():
+            return None
+
+        return index.data(self.ID_ROLE)
+
+    def refresh(self):
+        """Drop loaded rows so the view fetches them again from the start."""
+
+        self.beginResetModel()
+        self._rows = []
+        self._keys = []
+        self._key_of = {}
+        self._exhausted = False
+        self.endResetModel()
+
+    def set_search(self, text):
+        """Filter the list to contacts matching the search text.
+
+        Args:
+            text: Text typed by the user, an empty text lists all contacts.
+        """
+
+        match_query = build_match_query(text)
+
+        if match_query == self._match_query:
+            return
+
+        self._match_query = match_query
+        self.refresh()
+
+    def set_tags(self, tags, match_all):
+        """Only list the contacts of some tags.
+
+        Args:
+            tags: Ids of the tags, none lists every contact.
+            match_all: True if contacts need all the tags, else any of them.
+        """
+
+        tags = tuple(tags)
+
+        if (tags, match_all) == (self._tags, self._match_all):
+            return
+
+        self._tags = tags
+        self._match_all = match_all
+        self.refresh()
+
+    def set_letter(self, letter):
+        """Start the list at the first contact of an initial.
+
+        The page of the initial is read with a single seek, and the page
+        before it so the view can scroll up from there, see
+        fetchPrevious().
+
+        Args:
+            letter: Letter "A" to "Z", None or "#" start at the top.
+
+        Return:
+            The row of the first contact of the initial, or of the next
+            one, None if there is none.
+        """
+
+        self._start = letter_key(letter)
+        self.refresh()
+
+        if self.canFetchMore():
+            self.fetchMore()
+
+        row = self.fetchPrevious() if self.canFetchPrevious() else 0
+
+        return row if row < len(self._rows) else None
+
+    def find_row(self, contact_id):
+        """Find the row holding a contact id.
+
+        Return:
+            The row number or None if the contact is not loaded.
+        """
+
+        key = self._key_of.get(contact_id)
+
+        if key is None:
+            return None
+
+        if self._match_query:
+            return self._keys.index(key)
+
+        return bisect_left(self._keys, key)
+
+    def insert_row(self, contact):
+        """Insert a row read from the database if it is in the loaded range.
+
+        Return:
+            True if the row was inserted.
+        """
+
+        key = (contact[3], contact[0])
+
+        if self._match_query:
+            row = len(self._rows)
+
+        else:
+            # Rows outside the loaded range are read by a later fetchMore.
+            if key < self._start:
+                return False
+
+            if not self._exhausted and (not self._keys or
+                                        key > self._keys[-1]):
+                return False
+
+            row = bisect_left(self._keys, key)
+
+        self.beginInsertRows(QModelIndex(), row, row)
+        self._rows.insert(row, contact)
+        self._keys.insert(row, key)
+        self._key_of[contact[0]] = key
+        self.endInsertRows()
+
+        return True
+
+    def insert_contact(self, contact_id):
+        """Add a newly inserted contact to the loaded rows.
+
+        The contact is placed at its alphabetical position, or left for a
+        later fetchMore if that part of the list is not loaded yet. Search
+        results get the contact at the end if it matches and all the
+        results are loaded.
+        """
+
+        # New contacts have no tags yet.
+        if self._tags or self.find_row(contact_id) is not None:
+            return
+
+        if self._match_query and (not self._exhausted or
+                                  not self.repository.matches(
+                                      self._match_query, contact_id)):
+            return
+
+        contact = self.repository.get_list_row(contact_id)
+
+        if contact is not None:
+            self.insert_row(contact)
+
+    def update_contact(self, contact_id):
+        """Reload one contact and repaint its row, moving it if needed."""
+
+        row = self.find_row(contact_id)
+
+        if row is None:
+            return
+
+        contact = self.repository.get_list_row(contact_id)
+
+        if contact is None:
+            self.remove_contact(contact_id)
+            return
+
+        if self._match_query or contact[3] == self._rows[row][3]:
+            self._rows[row] = contact
+            index = self.index(row)
+            self.dataChanged.emit(index, index)
+            return
+
+        # The name changed its place in the list.
+        self.remove_contact(contact_id)
+        self.insert_row(contact)
+
+    def remove_contact(self, contact_id):
+        """Remove a deleted contact from the loaded rows."""
+
+        row = self.find_row(contact_id)
+
+        if row is None:
+            return
+
+        self.beginRemoveRows(QModelIndex(), row, row)
+        del self._rows[row]
+        del self._keys[row]
+        del self._key_of[contact_id]
+        self.endRemoveRows()
+
+    def remove_contacts(self, contact_ids):
+        """Remove many deleted contacts from the loaded rows.
+
+        Rows are removed by runs of consecutive rows, from the bottom up so
+        the row numbers still to remove stay valid.
+        """
+
+        rows = sorted((row for row in map(self.find_row, contact_ids)
+                       if row is not None), reverse=True)
+        position = 0
+
+        while position < len(rows):
+            last = first = rows[position]
+            position += 1
+
+            while position < len(rows) and rows[position] == first - 1:
+                first = rows[position]
+                position += 1
+
+            self.beginRemoveRows(QModelIndex(), first, last)
+
+            for contact in self._rows[first:last + 1]:
+                del self._key_of[contact[0]]
+
+            del self._rows[first:last + 1]
+            del self._keys[first:last + 1]
+            self.endRemoveRows()
+
+    def update_contacts(self, contact_ids):
+        """Reload many contacts, see update_contact()."""
+
+        for contact_id in contact_ids:
+            self.update_contact(contact_id)
+
@@ -0,0 +1,142 @@
+# diagnostics_dialog.py
+
+"""Hidden diagnostics window of the agenda app, opened with Ctrl+Shift+D."""
+
+from PyQt5.QtCore import QTimer
+from PyQt5.QtWidgets import (QCheckBox, QDialog, QFileDialog, QHBoxLayout,
+                             QHeaderView, QLabel, QPlainTextEdit, QPushButton,
+                             QTableWidget, QTableWidgetItem, QVBoxLayout)
+
+from agenda.instrumentation import instrumentation
+
+# Columns of the operations table and the statistics keys they show.
+COLUMNS = (("Operation", "name"),
+           ("Count", "count"),
+           ("Total ms", "total_ms"),
+           ("Mean ms", "mean_ms"),
+           ("p50 ms", "p50_ms"),
+           ("p95 ms", "p95_ms"),
+           ("p99 ms", "p99_ms"),
+           ("Max ms", "max_ms"))
+
+
+class DiagnosticsDialog(QDialog):
+    """Shows latency percentiles and slow queries while they are recorded."""
+
+    # Milliseconds between two refreshes of the figures.
+    REFRESH_INTERVAL = 1000
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Diagnostics")
+        self.setGeometry(400, 120, 800, 600)
+        self.create_widgets()
+        self.create_layouts()
+        self.connect_signals()
+        self.refresh()
+
+    def create_widgets(self):
+        """Create the widgets of the dialog."""
+
+        self.enabled_check = QCheckBox("Record timings")
+        self.enabled_check.setChecked(instrumentation.enabled)
+
+        self.operations_table = QTableWidget(0, len(COLUMNS))
+        self.operations_table.setHorizontalHeaderLabels(
+            [title for title, _ in COLUMNS])
+        self.operations_table.horizontalHeader().setSectionResizeMode(
+            0, QHeaderView.Stretch)
+        self.operations_table.setEditTriggers(QTableWidget.NoEditTriggers)
+
+        self.slow_queries_text = QPlainTextEdit()
+        self.slow_queries_text.setReadOnly(True)
+
+        self.button_reset = QPushButton("Reset")
+        self.button_save = QPushButton("Save JSON")
+        self.button_close = QPushButton("Close")
+
+        self.refresh_timer = QTimer(self)
+        self.refresh_timer.setInterval(self.REFRESH_INTERVAL)
+
+    def create_layouts(self):
+        """Lay the widgets out."""
+
+        button_layout = QHBoxLayout()
+        button_layout.addWidget(self.enabled_check)
+        button_layout.addStretch()
+        button_layout.addWidget(self.button_reset)
+        button_layout.addWidget(self.button_save)
+        button_layout.addWidget(self.button_close)
+
+        layout = QVBoxLayout()
+        layout.addLayout(button_layout)
+        layout.addWidget(self.operations_table, 60)
+        layout.addWidget(QLabel("Slow queries"))
+        layout.addWidget(self.slow_queries_text, 40)
+        self.setLayout(layout)
+
+    def connect_signals(self):
+        """Connect widget signals."""
+
+        self.enabled_check.toggled.connect(self.on_enabled_toggled)
+        self.button_reset.clicked.connect(self.on_reset)
+        self.button_save.clicked.connect(self.on_save)
+        self.button_close.clicked.connect(self.close)
+        self.refresh_timer.timeout.connect(self.refresh)
+
+    def showEvent(self, event):
+        """Refresh the figures while the dialog is visible."""
+
+        self.refresh()
+        self.refresh_timer.start()
+        super().showEvent(event)
+
+    def hideEvent(self, event):
+        """Stop refreshing once the dialog is hidden."""
+
+        self.refresh_timer.stop()
+        super().hideEvent(event)
+
+    def on_enabled_toggled(self, checked):
+        """Turn recording on or off."""
+
+        if checked:
+            instrumentation.enable()
+        else:
+            instrumentation.disable()
+
+    def on_reset(self):
+        """Forget everything recorded so far."""
+
+        instrumentation.reset()
+        self.refresh()
+
+    def on_save(self):
+        """Write the recorded figures to a JSON file."""
+
+        path, ok = QFileDialog.getSaveFileName(
+            self, "Save Diagnostics", "agenda-diagnostics.json",
+            "JSON Files (*.json)")
+
+        if ok and path:
+            instrumentation.dump(path)
+
+    def refresh(self):
+        """Show the latest figures."""
+
+        operations = instrumentation.statistics()
+        self.operations_table.setRowCount(len(operations))
+
+        for row, operation in enumerate(operations):
+            for column, (_, key) in enumerate(COLUMNS):
+                self.operations_table.setItem(
+                    row, column, QTableWidgetItem(str(operation[key])))
+
+        lines = []
+
+        for query in reversed(instrumentation.slow_queries()):
+            lines.append("{} ms  {}".format(query["milliseconds"],
+                                            query["sql"]))
+            lines.extend("    " + step for step in query["plan"])
+
+        self.slow_queries_text.setPlainText("\n".join(lines))
@@ -0,0 +1,232 @@
+# duplicates_dialog.py
+
+"""Window listing likely duplicate contacts and merging them."""
+
+import sqlite3
+
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, Qt, pyqtSignal
+from PyQt5.QtWidgets import (QAbstractItemView, QDialog, QHBoxLayout,
+                             QHeaderView, QLabel, QListWidget, QMessageBox,
+                             QPushButton, QTableWidget, QTableWidgetItem,
+                             QVBoxLayout)
+
+from contact_events import contact_events
+
+# Columns of the contacts table and the Contact fields they show.
+COLUMNS = (("Name", "name"),
+           ("Surname", "surname"),
+           ("Phone", "phone"),
+           ("Email", "email"),
+           ("Address", "address"))
+
+
+class DuplicateSignals(QObject):
+    """Signals emitted when a background duplicate scan is done."""
+
+    # Groups of contact ids, see ContactRepository.duplicate_groups().
+    groupsFound = pyqtSignal(list)
+
+    # Error message of a scan that could not finish.
+    scanFailed = pyqtSignal(str)
+
+
+# Shared instance, it lives in the GUI thread.
+duplicate_signals = DuplicateSignals()
+
+
+class ScanTask(QRunnable):
+    """Runnable looking for duplicate contacts."""
+
+    def __init__(self, repository):
+        super().__init__()
+
+        self.repository = repository
+
+    def run(self):
+        """Scan the contacts and report the groups found."""
+
+        try:
+            groups = self.repository.duplicate_groups()
+
+        except sqlite3.Error as error:
+            duplicate_signals.scanFailed.emit(str(error))
+
+            return
+
+        finally:
+            self.repository.pool.release()
+
+        duplicate_signals.groupsFound.emit(groups)
+
+
+class DuplicatesDialog(QDialog):
+    """Lists groups of likely duplicates, one of them is kept on merge.
+
+    The scan runs in the background. Contacts of a group are only read
+    when the group is selected.
+    """
+
+    def __init__(self, repository, parent=None):
+        super().__init__(parent)
+
+        self.repository = repository
+        self.groups = []
+
+        self.setWindowTitle("Duplicate Contacts")
+        self.setGeometry(400, 150, 800, 500)
+        self.create_widgets()
+        self.create_layouts()
+        self.connect_signals()
+
+    def create_widgets(self):
+        """Create the widgets of the dialog."""
+
+        self.status_label = QLabel()
+        self.group_list = QListWidget()
+
+        self.contact_table = QTableWidget(0, len(COLUMNS))
+        self.contact_table.setHorizontalHeaderLabels(
+            [title for title, _ in COLUMNS])
+        self.contact_table.horizontalHeader().setSectionResizeMode(
+            QHeaderView.Stretch)
+        self.contact_table.setEditTriggers(QTableWidget.NoEditTriggers)
+        self.contact_table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.contact_table.setSelectionMode(
+            QAbstractItemView.SingleSelection)
+
+        self.button_scan = QPushButton("Scan")
+        self.button_merge = QPushButton("Merge into Selected")
+        self.button_skip = QPushButton("Not Duplicates")
+
+    def create_layouts(self):
+        """Lay the widgets out."""
+
+        button_layout = QHBoxLayout()
+        button_layout.addWidget(self.status_label)
+        button_layout.addStretch()
+        button_layout.addWidget(self.button_scan)
+        button_layout.addWidget(self.button_skip)
+        button_layout.addWidget(self.button_merge)
+
+        list_layout = QHBoxLayout()
+        list_layout.addWidget(self.group_list, 30)
+        list_layout.addWidget(self.contact_table, 70)
+
+        layout = QVBoxLayout()
+        layout.addLayout(list_layout)
+        layout.addLayout(button_layout)
+        self.setLayout(layout)
+
+    def connect_signals(self):
+        """Connect widget signals."""
+
+        self.button_scan.clicked.connect(self.scan)
+        self.button_merge.clicked.connect(self.on_merge)
+        self.button_skip.clicked.connect(self.on_skip)
+        self.group_list.currentRowChanged.connect(self.show_group)
+        duplicate_signals.groupsFound.connect(self.on_groups_found)
+        duplicate_signals.scanFailed.connect(self.on_scan_failed)
+
+    def scan(self):
+        """Look for duplicates in the background."""
+
+        self.button_scan.setEnabled(False)
+        self.status_label.setText("Scanning...")
+        QThreadPool.globalInstance().start(ScanTask(self.repository))
+
+    def on_groups_found(self, groups):
+        """List the groups found by a scan.
+
+        Args:
+            groups: Lists of contact ids.
+        """
+
+        self.button_scan.setEnabled(True)
+        self.groups = groups
+        self.group_list.clear()
+        self.group_list.addItems(
+            ["{} contacts".format(len(group)) for group in groups])
+        self.status_label.setText("{} groups found".format(len(groups)))
+
+        if groups:
+            self.group_list.setCurrentRow(0)
+        else:
+            self.contact_table.setRowCount(0)
+
+    def on_scan_failed(self, error):
+        """Show why a scan failed and let it be started again.
+
+        Args:
+            error: Error message.
+        """
+
+        self.button_scan.setEnabled(True)
+        self.status_label.setText("Scan failed: {}".format(error))
+
+    def show_group(self, row):
+        """Show the contacts of a group, the first one selected."""
+
+        contacts = []
+
+        if 0 <= row < len(self.groups):
+            contacts = [contact for contact
+                        in map(self.repository.get, self.groups[row])
+                        if contact is not None]
+
+        self.contact_table.setRowCount(len(contacts))
+
+        for position, contact in enumerate(contacts):
+            for column, (_, field) in enumerate(COLUMNS):
+                item = QTableWidgetItem(getattr(contact, field))
+
+                if column == 0:
+                    item.setData(Qt.UserRole, contact.id)
+
+                self.contact_table.setItem(position, column, item)
+
+        if contacts:
+            self.contact_table.selectRow(0)
+
+    def remove_current_group(self):
+        """Drop the selected group from the list."""
+
+        row = self.group_list.currentRow()
+
+        if row < 0:
+            return
+
+        del self.groups[row]
+        self.group_list.takeItem(row)
+        self.status_label.setText(
+            "{} groups left".format(len(self.groups)))
+
+    def on_skip(self):
+        """Leave the contacts of the selected group as they are."""
+
+        self.remove_current_group()
+
+    def on_merge(self):
+        """Merge the contacts of the group into the selected one."""
+
+        row = self.contact_table.currentRow()
+
+        if row < 0:
+
+            QMessageBox.warning(self, "Warning",
+                                "Select the contact to keep!")
+
+            return
+
+        keep_id = self.contact_table.item(row, 0).data(
+            Qt.UserRole)
+        merged_ids = [
+            self.contact_table.item(position, 0).data(
+                Qt.UserRole)
+            for position in range(self.contact_table.rowCount())
+            if position != row]
+
+        self.repository.merge(keep_id, merged_ids)
+        contact_events.contactsDeleted.emit(merged_ids)
+        contact_events.contactUpdated.emit(keep_id)
+
+        self.remove_current_group()
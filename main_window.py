@@ -4,30 +4,31 @@
 
 """Main module to create the agenda app."""
 
-import os
+import string
 import sys
-import sqlite3
-import random
+import time
 
 from PyQt5.QtWidgets import *
-from PyQt5.QtCore import Qt, pyqtSignal
-from PyQt5.QtGui import QPixmap
-
-from PIL import Image
-
-# Create a db connection and cursor if it does not exist.
-connection = sqlite3.connect("contacts.db")
-cursor = connection.cursor()
-cursor.execute('''CREATE TABLE IF NOT EXISTS Contacts
-    (id INTEGER PRIMARY KEY AUTOINCREMENT, 
-     name TEXT, 
-     surname TEXT, 
-     phone TEXT, 
-     email TEXT, 
-     image TEXT, 
-     address TEXT )''')
-connection.commit()
-# connection.close()
+from PyQt5.QtCore import QPoint, Qt, QTimer
+from PyQt5.QtGui import QKeySequence, QPixmap
+
+from agenda.contact import Contact
+from agenda.instrumentation import instrumentation
+from agenda.photo_store import PhotoStore
+from agenda.repository import DATABASE
+from agenda.session import Session, session_path
+from contact_delegate import ContactDelegate
+from contact_events import contact_events
+from contact_io_worker import io_signals, start_export, start_import
+from contact_list_model import ContactListModel
+from diagnostics_dialog import DiagnosticsDialog
+from duplicates_dialog import DuplicatesDialog
+from maintenance_worker import (check_database, compact_database,
+                                maintenance_signals)
+from photo_worker import (collect_photos, load_preview, photo_signals,
+                          store_imported, store_photo)
+from pixmap_cache import PixmapCache
+from startup_worker import open_database, startup_signals
 
 # Create a global variable for selected contact.
 CONTACT_ID = None
@@ -36,18 +37,53 @@ CONTACT_ID = None
 class MainWindow(QWidget):
     """Represents the main window for agenda app."""
 
-    def __init__(self):
+    # Milliseconds without typing before the search runs.
+    SEARCH_DELAY = 200
+
+    # Rows around the selection whose photos are decoded in advance.
+    PREFETCH_ROWS = 2
+
+    # Milliseconds after the last change before unused photos are removed.
+    PHOTO_GC_DELAY = 5000
+
+    # Milliseconds after startup before the first database check, then
+    # between two checks. Checks also make the backups.
+    CHECK_DELAY = 60 * 1000
+    CHECK_INTERVAL = 60 * 60 * 1000
+
+    # Milliseconds after the last delete before free pages are reclaimed.
+    VACUUM_DELAY = 30 * 1000
+
+    def __init__(self, repository, photo_store, session=None):
+        """Create the window.
+
+        Args:
+            repository: ContactRepository, or None to show the session
+                snapshot until open_database() reports the database open.
+            photo_store: PhotoStore of the contact photos.
+            session: Session restored at startup and saved on close.
+        """
+
         super().__init__()
+        self.repository = repository
+        self.photo_store = photo_store
+        self.session = session
         self.setWindowTitle("My Agenda")
-        self.setGeometry(450, 150, 750, 600)
+        self.setGeometry(350, 150, 950, 600)
         self.create_layouts()
         self.create_widgets()
         self.add_widgets()
         self.apply_styles()
         self.connect_signals()
 
+        if repository is None:
+            self.show_snapshot()
+            return
+
         self.update_contact_list()
+        self.update_tags()
         self.display_first_contact()
+        self.start_maintenance()
 
     def add_widgets(self):
         """Add widgets to layouts."""
@@ -58,10 +94,27 @@ class MainWindow(QWidget):
         self.button_layout.addWidget(self.button_new)
         self.button_layout.addWidget(self.button_update)
         self.button_layout.addWidget(self.button_delete)
+        self.button_layout.addWidget(self.button_import)
+        self.button_layout.addWidget(self.button_export)
+        self.button_layout.addWidget(self.button_edit_field)
+        self.button_layout.addWidget(self.button_duplicates)
         self.button_layout.addLayout(self.button_layout)
+        self.search_layout.addWidget(self.search_input)
         self.contact_list_layout.addWidget(self.contact_list)
+        self.contact_list_layout.addLayout(self.letter_layout)
+
+        for button in self.letter_buttons.values():
+            self.letter_layout.addWidget(button)
         self.button_layout.addLayout(self.contact_list_layout)
 
+        self.tag_layout.addWidget(self.tag_list)
+        self.tag_layout.addWidget(self.tag_mode)
+        self.tag_layout.addLayout(self.tag_button_layout)
+        self.tag_button_layout.addWidget(self.button_new_tag, 0, 0)
+        self.tag_button_layout.addWidget(self.button_delete_tag, 0, 1)
+        self.tag_button_layout.addWidget(self.button_tag, 1, 0)
+        self.tag_button_layout.addWidget(self.button_untag, 1, 1)
+
         ########################################################################
         # Add widgets to right side
         ########################################################################
@@ -71,6 +124,7 @@ class MainWindow(QWidget):
         self.display_information_layout.addRow("Phone: ", self.display_phone)
         self.display_information_layout.addRow("Email: ", self.display_email)
         self.display_information_layout.addRow("Address: ", self.display_address)
+        self.display_information_layout.addRow("Tags: ", self.display_tags)
 
     def apply_styles(self):
         """Apply styles to widgets."""
@@ -93,11 +147,23 @@ class MainWindow(QWidget):
         group_box_list.setLayout(self.left_layout)
 
         self.button_layout = QHBoxLayout()
+        self.search_layout = QHBoxLayout()
         self.contact_list_layout = QHBoxLayout()
+        self.letter_layout = QVBoxLayout()
+        self.letter_layout.setSpacing(0)
 
         self.left_layout.addLayout(self.button_layout)
+        self.left_layout.addLayout(self.search_layout)
         self.left_layout.addLayout(self.contact_list_layout)
 
+        ########################################################################
+        # Layout of the tag filter sidebar
+        ########################################################################
+        group_box_tags = QGroupBox("Tags")
+        self.tag_layout = QVBoxLayout()
+        self.tag_button_layout = QGridLayout()
+        group_box_tags.setLayout(self.tag_layout)
+
         ########################################################################
         #Layout right side
         # Here also create widgets to help with design.
@@ -116,8 +182,9 @@ class MainWindow(QWidget):
         # Add left, right layout to main layout and
         # set layout for mainWindow.
         ########################################################################
-        self.main_layout.addWidget(group_box_list, 50)
-        self.main_layout.addWidget(self.group_box_information, 50)
+        self.main_layout.addWidget(group_box_tags, 20)
+        self.main_layout.addWidget(group_box_list, 45)
+        self.main_layout.addWidget(self.group_box_information, 35)
         self.setLayout(self.main_layout)
 
     def create_widgets(self):
@@ -125,152 +192,901 @@ class MainWindow(QWidget):
         ########################################################################
         # Widget for the left side, contact list
         ########################################################################
-        self.contact_list = QListWidget()
+        self.contact_model = ContactListModel(self.repository)
+        self.contact_list = QListView()
+        self.contact_list.setUniformItemSizes(True)
+        self.contact_list.setSelectionMode(QAbstractItemView.ExtendedSelection)
+        self.contact_list.setModel(self.contact_model)
         self.button_new = QPushButton("New")
         self.button_update = QPushButton("Update")
         self.button_delete = QPushButton("Delete")
+        self.button_import = QPushButton("Import")
+        self.button_export = QPushButton("Export")
+        self.button_edit_field = QPushButton("Edit Field")
+        self.button_duplicates = QPushButton("Duplicates")
+
+        self.search_input = QLineEdit()
+        self.search_input.setPlaceholderText("Search contacts")
+        self.search_input.setClearButtonEnabled(True)
+
+        # Alphabetical jump index, "#" goes back to the top of the list.
+        self.letter_buttons = {}
+
+        for letter in "#" + string.ascii_uppercase:
+            button = QToolButton()
+            button.setText(letter)
+            button.setAutoRaise(True)
+            self.letter_buttons[letter] = button
+
+        # Filter sidebar, checked tags narrow the list.
+        self.tag_list = QListWidget()
+        self.tag_mode = QComboBox()
+        self.tag_mode.addItems(["Any checked tag", "All checked tags"])
+        self.button_new_tag = QPushButton("New Tag")
+        self.button_delete_tag = QPushButton("Delete Tag")
+        self.button_tag = QPushButton("Tag")
+        self.button_untag = QPushButton("Untag")
+
+        # Wait for a pause in typing before running the search.
+        self.search_timer = QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(self.SEARCH_DELAY)
 
         ########################################################################
         # Widget for the right side, Display contact information
         ########################################################################
+        self.pixmap_cache = PixmapCache()
+        self.pixmap_cache.pin(ContactForm.NEW_CONTACT_IMAGE)
+
+        # Rows are painted from the model roles, thumbnails included.
+        self.contact_list.setItemDelegate(
+            ContactDelegate(self.pixmap_cache,
+                            ContactForm.NEW_CONTACT_IMAGE,
+                            self.contact_list))
+
         self.display_image = QLabel()
         self.display_name = QLabel()
         self.display_surname = QLabel()
         self.display_phone = QLabel()
         self.display_email = QLabel()
         self.display_address = QLabel()
+        self.display_tags = QLabel()
+        self.display_tags.setWordWrap(True)
+
+        # Remove unused photos once changes settle down.
+        self.photo_gc_timer = QTimer(self)
+        self.photo_gc_timer.setSingleShot(True)
+        self.photo_gc_timer.setInterval(self.PHOTO_GC_DELAY)
+
+        # Check and back up the database in the background.
+        self.check_timer = QTimer(self)
+        self.check_timer.setInterval(self.CHECK_DELAY)
+
+        # Reclaim space freed by deletes once they settle down.
+        self.vacuum_timer = QTimer(self)
+        self.vacuum_timer.setSingleShot(True)
+        self.vacuum_timer.setInterval(self.VACUUM_DELAY)
+
+        # Missing pictures already reported, reported once per session.
+        self.reported_images = set()
+
+        # Hidden diagnostics window, see diagnostics_dialog.
+        self.diagnostics_shortcut = QShortcut(QKeySequence("Ctrl+Shift+D"),
+                                              self)
+        self.diagnostics_dialog = None
+        self.duplicates_dialog = None
 
     def connect_signals(self):
         """Connect widget signals."""
 
         self.button_new.clicked.connect(self.new_contact)
-        self.contact_list.itemClicked.connect(self.on_item_clicked)
+        self.diagnostics_shortcut.activated.connect(self.show_diagnostics)
+        self.contact_list.selectionModel().currentChanged.connect(
+            self.on_item_clicked)
+        self.contact_list.verticalScrollBar().valueChanged.connect(
+            self.on_list_scrolled)
         self.button_delete.clicked.connect(self.on_delete)
+        self.button_import.clicked.connect(self.on_import)
+        self.button_export.clicked.connect(self.on_export)
         self.button_update.clicked.connect(self.on_update)
+        self.button_edit_field.clicked.connect(self.on_edit_field)
+        self.button_duplicates.clicked.connect(self.show_duplicates)
+        self.search_input.textChanged.connect(self.search_timer.start)
+        self.search_timer.timeout.connect(self.on_search)
+        self.tag_list.itemChanged.connect(self.on_tags_checked)
+        self.tag_mode.currentIndexChanged.connect(self.on_tags_checked)
+        self.button_new_tag.clicked.connect(self.on_new_tag)
+        self.button_delete_tag.clicked.connect(self.on_delete_tag)
+        self.button_tag.clicked.connect(lambda: self.on_tag_contacts(True))
+        self.button_untag.clicked.connect(lambda: self.on_tag_contacts(False))
+
+        for letter, button in self.letter_buttons.items():
+            button.clicked.connect(
+                lambda checked, letter=letter: self.on_letter_clicked(letter))
 
-    def display_first_contact(self):
-        """Display first record in database in group_box_information widget."""
+        ########################################################################
+        # Keep the list in sync with row level database changes.
+        ########################################################################
+        contact_events.contactInserted.connect(self.contact_model.insert_contact)
+        contact_events.contactUpdated.connect(self.on_contact_updated)
+        contact_events.contactDeleted.connect(self.contact_model.remove_contact)
+        contact_events.contactsUpdated.connect(self.on_contacts_updated)
+        contact_events.contactsDeleted.connect(
+            self.contact_model.remove_contacts)
+
+        contact_events.contactInserted.connect(self.update_letters)
+        contact_events.contactUpdated.connect(self.update_letters)
+        contact_events.contactDeleted.connect(self.update_letters)
+        contact_events.contactsUpdated.connect(self.update_letters)
+        contact_events.contactsDeleted.connect(self.update_letters)
+
+        # Deleted contacts leave their tags.
+        contact_events.contactDeleted.connect(self.update_tags)
+        contact_events.contactsDeleted.connect(self.update_tags)
+
+        photo_signals.photoStored.connect(self.on_photo_stored)
+        photo_signals.photoFailed.connect(self.on_photo_failed)
+        photo_signals.imageLoaded.connect(self.contact_list.viewport().update)
+        photo_signals.importedPhotosStored.connect(self.on_item_clicked)
+        photo_signals.photoWorkFailed.connect(self.on_photo_work_failed)
+
+        startup_signals.repositoryOpened.connect(self.on_repository_opened)
+        startup_signals.listStarted.connect(self.contact_model.reset_rows)
+        startup_signals.rowsLoaded.connect(self.contact_model.append_rows)
+        startup_signals.listLoaded.connect(self.on_list_loaded)
+        startup_signals.startupFailed.connect(self.on_startup_failed)
+
+        io_signals.importFinished.connect(self.on_import_finished)
+        io_signals.exportFinished.connect(self.on_export_finished)
+        io_signals.ioFailed.connect(self.on_io_failed)
+
+        contact_events.contactUpdated.connect(self.photo_gc_timer.start)
+        contact_events.contactDeleted.connect(self.photo_gc_timer.start)
+        contact_events.contactsDeleted.connect(self.photo_gc_timer.start)
+        self.photo_gc_timer.timeout.connect(self.on_collect_photos)
+
+        contact_events.contactDeleted.connect(self.vacuum_timer.start)
+        contact_events.contactsDeleted.connect(self.vacuum_timer.start)
+        self.vacuum_timer.timeout.connect(self.on_compact)
+        self.check_timer.timeout.connect(self.on_check)
+        maintenance_signals.checkFinished.connect(self.on_check_finished)
+        maintenance_signals.maintenanceFailed.connect(
+            self.on_maintenance_failed)
+
+    ############################################################################
+    # Startup
+    ############################################################################
+    def set_loading(self, loading):
+        """Disable the controls needing the database while it opens."""
+
+        for widget in (self.button_new, self.button_update,
+                       self.button_delete, self.button_import,
+                       self.button_export, self.button_edit_field,
+                       self.button_duplicates, self.search_input,
+                       self.tag_list, self.tag_mode, self.button_new_tag,
+                       self.button_delete_tag, self.button_tag,
+                       self.button_untag):
+            widget.setEnabled(not loading)
+
+        for button in self.letter_buttons.values():
+            button.setEnabled(not loading)
+
+    def show_snapshot(self):
+        """Show the rows of the last session while the database opens."""
+
+        self.set_loading(True)
+        self.contact_model.reset_rows(self.session.start)
+        self.contact_model.append_rows(self.session.rows)
+        row = self.contact_model.find_row(self.session.selected)
+
+        if row is not None:
+            self.contact_list.setCurrentIndex(self.contact_model.index(row))
+
+    def on_repository_opened(self, repository):
+        """Keep the repository opened in background, rows follow."""
+
+        self.repository = repository
+
+    def on_list_loaded(self, exhausted):
+        """Enable the window once the first rows are read.
 
-        sql = "SELECT * FROM Contacts ORDER BY ROWid ASC LIMIT 1"
-        contact = cursor.execute(sql).fetchone()
+        Args:
+            exhausted: True if the whole list was read.
+        """
 
-        if contact is None:
+        self.contact_model.attach(self.repository, exhausted)
+        self.set_loading(False)
+        self.update_letters()
+        self.update_tags()
+        self.restore_session()
+        self.start_maintenance()
 
-            self.display_name.setText("")
-            self.display_surname.setText("")
-            self.display_phone.setText("")
-            self.display_email.setText("")
-            self.display_image.setPixmap(QPixmap("icons/person.png"))
-            self.display_address.setText("")
+    def on_startup_failed(self, error):
+        """Tell the database could not be opened and close the window."""
+
+        QMessageBox.critical(self,
+                             "Error",
+                             "The agenda could not be opened: {}".format(
+                                 error))
+        self.close()
+
+    def restore_session(self):
+        """Scroll to the top row and select the contact of the session.
+
+        The page above the top row is read first, so the list can be
+        scrolled up from there.
+        """
+
+        if self.contact_model.canFetchPrevious():
+            self.contact_model.fetchPrevious()
+
+        top = self.session.top if self.session else None
+        row = self.contact_model.find_row(top[1]) if top else None
+
+        if row is not None:
+            self.contact_list.scrollTo(self.contact_model.index(row),
+                                       QAbstractItemView.PositionAtTop)
 
+        selected = self.session.selected if self.session else None
+        row = self.contact_model.find_row(selected)
+
+        if row is None:
+            self.display_first_contact()
             return
 
-        self.display_name.setText(contact[1])
-        self.display_surname.setText(contact[2])
-        self.display_phone.setText(contact[3])
-        self.display_email.setText(contact[4])
-        self.display_image.setPixmap(QPixmap(contact[5]))
-        self.display_address.setText(contact[6])
+        self.contact_list.setCurrentIndex(self.contact_model.index(row))
 
-    @staticmethod
-    def get_contact(in_id):
-        """Get contact info based on selected id.
+    def save_session(self):
+        """Save the position of the list and the selection for next start.
 
-        Return:
-            Return a tuple with contact information.
+        Search results are not restored. The list starts again at the
+        top row, or at the top of the list, see StartupTask.
         """
 
-        sql_query = "SELECT * FROM Contacts WHERE id=?"
-        return cursor.execute(sql_query, (in_id,)).fetchone()
+        top = self.contact_list.indexAt(QPoint(1, 1))
+        rows = []
+
+        if top.isValid() and not self.search_input.text():
+            rows = self.contact_model.rows_from(top.row(), Session.ROWS)
+
+        self.session.top = (rows[0][3], rows[0][0]) if rows else None
+        # Just before the top row, ids are integers.
+        self.session.start = ((rows[0][3], rows[0][0] - 1) if rows
+                              else ContactListModel.FIRST_KEY)
+        self.session.selected = self.selected_contact_id()
+        self.session.rows = rows
+
+        try:
+            self.session.save()
+        except OSError:
+            # Only costs the next start its snapshot.
+            pass
+
+    def closeEvent(self, event):
+        """Save the session unless the database never opened."""
+
+        if self.session is not None and \
+                self.contact_model.repository is not None:
+            self.save_session()
+
+        super().closeEvent(event)
+
+    def show_diagnostics(self):
+        """Open the diagnostics window."""
+
+        if self.diagnostics_dialog is None:
+            self.diagnostics_dialog = DiagnosticsDialog(self)
+
+        self.diagnostics_dialog.show()
+        self.diagnostics_dialog.raise_()
+
+    def show_duplicates(self):
+        """Open the duplicates window and scan the contacts."""
+
+        if self.duplicates_dialog is None:
+            self.duplicates_dialog = DuplicatesDialog(self.repository, self)
+
+        self.duplicates_dialog.show()
+        self.duplicates_dialog.raise_()
+        self.duplicates_dialog.scan()
+
+    def display_first_contact(self):
+        """Display the first contact of contact_list in the information box."""
+
+        model = self.contact_model
+
+        if not model.rowCount() and model.canFetchMore():
+            model.fetchMore()
 
-    @staticmethod
-    def get_all_contacts():
-        """Get contacts from database.
+        contact_id = model.contact_id(model.index(0))
+        contact = (self.repository.get(contact_id)
+                   if contact_id is not None else None)
 
-        Returns:
-            A list of tuples with id, name and surname [(id, name, surname),..]
-            """
+        if contact is None:
+
+            self.display_name.setText("")
+            self.display_surname.setText("")
+            self.display_phone.setText("")
+            self.display_email.setText("")
+            self.display_image.setPixmap(
+                self.pixmap_cache.get(ContactForm.NEW_CONTACT_IMAGE))
+            self.display_address.setText("")
+            self.display_tags.setText("")
 
-        sql = "SELECT id, name, surname FROM Contacts"
+            return
 
-        return cursor.execute(sql).fetchall()
+        self.update_widgets(contact)
 
     def on_delete(self):
-        """Deletes the selected record from database."""
+        """Deletes the selected records from database in one transaction."""
 
-        try:
-            selected_contact = self.contact_list.currentItem().text()
+        ids = self.selected_contact_ids()
 
-        except AttributeError:
+        if not ids:
 
             QMessageBox.warning(self, "Warning", "You must select a contact!")
 
             return
 
+        if len(ids) == 1:
+            question = "Are you sure?"
+        else:
+            question = "Delete {} contacts?".format(len(ids))
+
         msg_box = QMessageBox.question(self,
                                        "Warning",
-                                       "Are you sure?",
+                                       question,
                                        QMessageBox.Yes | QMessageBox.No,
                                        QMessageBox.No)
 
         if msg_box == QMessageBox.Yes:
 
-            id = selected_contact.split("-")[0]
-            contact = self.get_contact(id)
+            # Photos are removed by the photo store garbage collector.
+            count = self.repository.delete_many(ids)
+            contact_events.contactsDeleted.emit(ids)
 
-            if contact[5] != "icons/person.png" and not contact[5]:
-                os.remove(contact[5])
+            if count == 1:
+                QMessageBox.information(self, "Information",
+                                        "Contact deleted!")
+            else:
+                QMessageBox.information(self, "Information",
+                                        "{} contacts deleted!".format(count))
 
-            sql_query = "DELETE FROM Contacts WHERE id=?"
-            cursor.execute(sql_query, (id,))
-            connection.commit()
+            self.display_first_contact()
 
-            QMessageBox.information(self, "Information", "Contact deleted!")
+    def on_edit_field(self):
+        """Give one field the same value on every selected contact."""
 
-            self.update_contact_list()
+        ids = self.selected_contact_ids()
 
-            self.display_first_contact()
+        if not ids:
+
+            QMessageBox.warning(self, "Warning", "You must select a contact!")
+
+            return
+
+        field, ok = QInputDialog.getItem(
+            self, "Edit Field", "Field to change:",
+            [column.capitalize()
+             for column in self.repository.EDITABLE_COLUMNS], 0, False)
+
+        if not ok:
+
+            return
+
+        value, ok = QInputDialog.getText(
+            self, "Edit Field",
+            "New {} of {} contacts:".format(field.lower(), len(ids)))
+
+        if not ok:
+
+            return
+
+        try:
+            count = self.repository.set_field(ids, field.lower(), value)
+
+        except ValueError as error:
+
+            QMessageBox.warning(self, "Warning", str(error))
+
+            return
+
+        contact_events.contactsUpdated.emit(ids)
+
+        QMessageBox.information(self, "Information",
+                                "{} contacts updated".format(count))
+
+    def on_import(self):
+        """Import contacts from a CSV or vCard file in background."""
+
+        path, ok = QFileDialog.getOpenFileName(
+            self, "Import Contacts", "", "Contact Files (*.csv *.vcf)")
+
+        if not ok:
+
+            return
+
+        self.button_import.setEnabled(False)
+        start_import(self.repository, path)
+
+    def on_import_finished(self, path, count):
+        """Show imported contacts and store their pictures in background.
+
+        Args:
+            path: Path of the imported file.
+            count: Number of imported contacts.
+        """
+
+        self.button_import.setEnabled(True)
+        self.update_contact_list()
+
+        store_imported(self.photo_store, self.repository)
+
+        QMessageBox.information(self,
+                                "Information",
+                                "{} contacts imported".format(count))
+
+    def on_export(self):
+        """Export contacts to a CSV or vCard file in background.
+
+        Every contact is exported, or only the selected ones when more than
+        one is selected.
+        """
+
+        ids = self.selected_contact_ids()
+
+        if len(ids) > 1:
+            title = "Export {} Selected Contacts".format(len(ids))
+        else:
+            title = "Export Contacts"
+            ids = None
+
+        path, ok = QFileDialog.getSaveFileName(
+            self, title, "contacts.vcf",
+            "vCard Files (*.vcf);;CSV Files (*.csv)")
+
+        if not ok:
+
+            return
+
+        self.button_export.setEnabled(False)
+        start_export(self.repository, path, ids)
+
+    def on_export_finished(self, path, count):
+        """Execute when an export is done.
+
+        Args:
+            path: Path of the exported file.
+            count: Number of exported contacts.
+        """
+
+        self.button_export.setEnabled(True)
+
+        QMessageBox.information(self,
+                                "Information",
+                                "{} contacts exported".format(count))
+
+    def on_io_failed(self, path, error):
+        """Warn when an import or export failed.
+
+        Args:
+            path: Path of the imported or exported file.
+            error: Error message.
+        """
+
+        self.button_import.setEnabled(True)
+        self.button_export.setEnabled(True)
+
+        QMessageBox.warning(self,
+                            "Warning",
+                            "{} could not be processed: {}".format(path,
+                                                                   error))
 
     def on_item_clicked(self):
         """Updates contact information display widget."""
 
-        selected_contact = self.contact_list.currentItem().text()
-        id = selected_contact.split("-")[0]
-        contact = self.get_contact(id)
+        # Rows of the session snapshot can be selected before the database
+        # is open.
+        if self.contact_model.repository is None:
+            return
+
+        contact = self.repository.get(self.selected_contact_id())
+
+        if contact is None:
+            return
 
         self.update_widgets(contact)
+        self.prefetch_neighbours()
 
-    def update_display_contact(self):
-        """Updates display contact information widget at update."""
+    def prefetch_neighbours(self):
+        """Decode in background the photos of rows next to the selection.
 
-        contact = self.get_contact(CONTACT_ID)
+        Paths come from the loaded rows of the list, only the decoding is
+        left to the thread pool.
+        """
 
-        self.update_widgets(contact)
+        row = self.contact_list.currentIndex().row()
+        paths = []
+
+        for neighbour in range(row - self.PREFETCH_ROWS,
+                               row + self.PREFETCH_ROWS + 1):
+            index = self.contact_model.index(neighbour)
+            image = index.data(ContactListModel.IMAGE_ROLE)
+
+            if neighbour == row or not image:
+                continue
+
+            paths.append(self.pixmap_cache.resolve(
+                image, ContactForm.SIZE, self.devicePixelRatioF()))
+
+        self.pixmap_cache.prefetch(paths)
+
+    def on_list_scrolled(self, value):
+        """Read the rows above the list once it is scrolled to its top.
+
+        The rows shown stay in place, the new ones are above them.
+        """
+
+        if (value > self.contact_list.verticalScrollBar().minimum()
+                or not self.contact_model.canFetchPrevious()):
+            return
+
+        count = self.contact_model.fetchPrevious()
+
+        if count:
+            self.contact_list.scrollTo(self.contact_model.index(count),
+                                       QAbstractItemView.PositionAtTop)
+
+    def on_search(self):
+        """Filter contact_list with the text of the search box."""
+
+        with instrumentation.span("ui.search"):
+            self.contact_model.set_search(self.search_input.text())
+
+    def on_letter_clicked(self, letter):
+        """Show contact_list from the first contact of an initial.
+
+        Args:
+            letter: Letter of the clicked button.
+        """
+
+        if self.search_input.text():
+            self.search_input.clear()
+            self.search_timer.stop()
+            self.contact_model.set_search("")
 
-    def update_widgets(self, inContactTuple):
+        with instrumentation.span("ui.letter_jump"):
+            row = self.contact_model.set_letter(letter)
+
+        if row is not None:
+            self.contact_list.scrollTo(self.contact_model.index(row),
+                                       QAbstractItemView.PositionAtTop)
+
+    def update_letters(self):
+        """Enable the jump buttons of initials having contacts."""
+
+        with instrumentation.span("ui.update_letters"):
+            letters = set(self.repository.letters())
+
+            for letter, button in self.letter_buttons.items():
+                button.setEnabled(letter == "#" or letter in letters)
+
+    def update_tags(self):
+        """Show every tag with its number of contacts, keeping the checks."""
+
+        checked = set(self.checked_tags())
+
+        # Filling the list is not a change of the checked tags.
+        self.tag_list.blockSignals(True)
+        self.tag_list.clear()
+
+        for tag_id, name, count in self.repository.tags():
+            item = QListWidgetItem("{} ({})".format(name, count))
+            item.setData(Qt.UserRole, tag_id)
+            item.setFlags(item.flags() | Qt.ItemIsUserCheckable)
+            item.setCheckState(Qt.Checked if tag_id in checked
+                               else Qt.Unchecked)
+            self.tag_list.addItem(item)
+
+        self.tag_list.blockSignals(False)
+
+    def checked_tags(self):
+        """Get the ids of the checked tags."""
+
+        return [item.data(Qt.UserRole)
+                for item in map(self.tag_list.item,
+                                range(self.tag_list.count()))
+                if item.checkState() == Qt.Checked]
+
+    def on_tags_checked(self):
+        """Narrow contact_list to the contacts of the checked tags."""
+
+        with instrumentation.span("ui.filter_tags"):
+            self.contact_model.set_tags(self.checked_tags(),
+                                        self.tag_mode.currentIndex() == 1)
+
+    def on_new_tag(self):
+        """Create a tag."""
+
+        name, ok = QInputDialog.getText(self, "New Tag", "Name of the tag:")
+
+        if not ok:
+
+            return
+
+        try:
+            self.repository.add_tag(name)
+
+        except ValueError as error:
+
+            QMessageBox.warning(self, "Warning", str(error))
+
+            return
+
+        self.update_tags()
+
+    def on_delete_tag(self):
+        """Delete the current tag, its contacts are kept."""
+
+        item = self.tag_list.currentItem()
+
+        if item is None:
+
+            QMessageBox.warning(self, "Warning", "You must select a tag!")
+
+            return
+
+        answer = QMessageBox.question(
+            self, "Warning",
+            "Delete tag {}? Its contacts are kept.".format(item.text()),
+            QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
+
+        if answer != QMessageBox.Yes:
+
+            return
+
+        self.repository.delete_tag(item.data(Qt.UserRole))
+        self.update_tags()
+        self.on_tags_checked()
+        self.on_item_clicked()
+
+    def on_tag_contacts(self, add):
+        """Add a tag to the selected contacts, or remove it.
+
+        Args:
+            add: True to add the tag, False to remove it.
+        """
+
+        ids = self.selected_contact_ids()
+        tags = self.repository.tags()
+
+        if not ids:
+
+            QMessageBox.warning(self, "Warning", "You must select a contact!")
+
+            return
+
+        if not tags:
+
+            QMessageBox.warning(self, "Warning", "Create a tag first!")
+
+            return
+
+        current = self.tag_list.currentRow()
+        name, ok = QInputDialog.getItem(
+            self, "Tag" if add else "Untag",
+            "Tag to {} {} contacts:".format("add to" if add else "remove from",
+                                            len(ids)),
+            [name for _, name, _ in tags], max(current, 0), False)
+
+        if not ok:
+
+            return
+
+        tag_id = next(tag_id for tag_id, tag_name, _ in tags
+                      if tag_name == name)
+
+        if add:
+            self.repository.tag_contacts(tag_id, ids)
+        else:
+            self.repository.untag_contacts(tag_id, ids)
+
+        self.update_tags()
+        self.on_item_clicked()
+
+        # The contacts of the checked tags changed.
+        if tag_id in self.checked_tags():
+            self.contact_model.refresh()
+
+    def selected_contact_id(self):
+        """Get the id of the contact selected in contact_list.
+
+        Return:
+            The contact id or None if there is no selection.
+        """
+
+        return self.contact_model.contact_id(self.contact_list.currentIndex())
+
+    def selected_contact_ids(self):
+        """Get the ids of every contact selected in contact_list.
+
+        Return:
+            A list of ids in list order, empty if there is no selection.
+        """
+
+        rows = sorted(index.row() for index
+                      in self.contact_list.selectionModel().selectedIndexes())
+
+        return [self.contact_model.contact_id(self.contact_model.index(row))
+                for row in rows]
+
+    def on_contacts_updated(self, ids):
+        """Patch the rows of a batch update and refresh the displayed one.
+
+        Args:
+            ids: Ids of the updated contacts.
+        """
+
+        self.contact_model.update_contacts(ids)
+
+        contact_id = self.selected_contact_id()
+
+        if contact_id is not None and contact_id in set(ids):
+            self.update_widgets(self.repository.get(contact_id))
+
+    def on_contact_updated(self, in_id):
+        """Patch the updated contact row and refresh it if displayed.
+
+        Args:
+            in_id: Id of the updated contact.
+        """
+
+        self.contact_model.update_contact(in_id)
+
+        if in_id == self.selected_contact_id():
+            self.update_widgets(self.repository.get(in_id))
+
+    def update_widgets(self, contact):
         """Update widgets to display information.
 
         Args:
-            inContactTuple: Tuple with contact information based on passed id.
+            contact: Contact to display.
         """
 
-        self.display_image.setPixmap(QPixmap(inContactTuple[5]))
-        self.display_name.setText(inContactTuple[1])
-        self.display_surname.setText(inContactTuple[2])
-        self.display_phone.setText(inContactTuple[3])
-        self.display_email.setText(inContactTuple[4])
-        self.display_address.setText(inContactTuple[6])
+        with instrumentation.span("ui.update_widgets"):
+            self.display_image.setPixmap(
+                self.pixmap_cache.get(contact.image, ContactForm.SIZE,
+                                      self.devicePixelRatioF()))
+            self.display_name.setText(contact.name)
+            self.display_surname.setText(contact.surname)
+            self.display_phone.setText(contact.phone)
+            self.display_email.setText(contact.email)
+            self.display_address.setText(contact.address)
+            self.display_tags.setText(", ".join(
+                self.repository.contact_tags(contact.id)))
 
-    def on_closed_form_window(self):
-        """Execute when form window is closed."""
+    def on_collect_photos(self):
+        """Remove photos no contact references anymore."""
 
-        self.update_display_contact()
-        self.update_contact_list()
+        collect_photos(self.photo_store, self.repository)
+
+    ############################################################################
+    # Maintenance
+    ############################################################################
+    def start_maintenance(self):
+        """Schedule the photo collection, checks and compaction."""
+
+        self.photo_gc_timer.start()
+        self.check_timer.start()
+        self.vacuum_timer.start()
+
+    def on_check(self):
+        """Check and back up the database, then every CHECK_INTERVAL."""
+
+        self.check_timer.setInterval(self.CHECK_INTERVAL)
+        check_database(self.repository)
+
+    def on_compact(self):
+        """Reclaim the pages freed by deletes."""
+
+        compact_database(self.repository)
+
+    def on_check_finished(self, problems, missing, backup):
+        """Warn about a damaged database or missing pictures.
+
+        Args:
+            problems: Problems found by the quick check.
+            missing: Tuples (path, number of contacts) of missing pictures.
+            backup: Path of the backup made after the check, "" if none.
+        """
+
+        if problems:
+            QMessageBox.critical(self,
+                                 "Error",
+                                 "The agenda database is damaged: {}\n"
+                                 "Backups are kept in the backups "
+                                 "folder.".format("\n".join(problems[:5])))
+
+            # Not checked again until restarted, the message would repeat.
+            self.check_timer.stop()
+
+            return
+
+        missing = [(path, count) for path, count in missing
+                   if path not in self.reported_images]
+
+        if not missing:
+            return
+
+        paths = [path for path, _ in missing]
+        self.reported_images.update(paths)
+        answer = QMessageBox.question(
+            self,
+            "Missing pictures",
+            "{} contacts have a picture that no longer exists, first {}.\n"
+            "Show the default picture for them?".format(
+                sum(count for _, count in missing), paths[0]),
+            QMessageBox.Yes | QMessageBox.No)
+
+        if answer != QMessageBox.Yes:
+            return
+
+        self.repository.reset_images(paths)
+        self.contact_model.update_contacts(
+            [row[0] for row in self.contact_model.rows_from(
+                0, self.contact_model.rowCount()) if row[5] in paths])
+        self.on_item_clicked()
+
+    def on_maintenance_failed(self, error):
+        """Warn when a check or backup could not run.
+
+        Args:
+            error: Error message.
+        """
+
+        QMessageBox.warning(self,
+                            "Warning",
+                            "The agenda could not be checked or backed up: "
+                            "{}".format(error))
+
+    def on_photo_stored(self, contact_id, path):
+        """Refresh a contact once its photo is saved in background.
+
+        Args:
+            contact_id: Id of the contact.
+            path: Store path of the photo.
+        """
+
+        contact_events.contactUpdated.emit(contact_id)
+
+    def on_photo_failed(self, path, error):
+        """Warn when a photo could not be saved.
+
+        Args:
+            path: Path of the picture that was not saved.
+            error: Error message.
+        """
+
+        QMessageBox.warning(self,
+                            "Warning",
+                            "Picture {} could not be saved: {}".format(path,
+                                                                       error))
+
+    def on_photo_work_failed(self, error):
+        """Warn when background photo work could not finish.
+
+        Args:
+            error: Error message.
+        """
+
+        QMessageBox.warning(self,
+                            "Warning",
+                            "Photos could not be processed: {}".format(error))
 
     def on_update(self):
         """Updates contact on database."""
 
-        if not self.contact_list.currentItem():
+        if self.selected_contact_id() is None:
 
             QMessageBox.warning(self, "Warning", "You must select a contact!")
 
@@ -280,52 +1096,48 @@ class MainWindow(QWidget):
         # Create the elements/info for the update window.
         ########################################################################
         global CONTACT_ID
-        selected_contact = self.contact_list.currentItem().text()
-        CONTACT_ID = selected_contact.split("-")[0]
+        CONTACT_ID = self.selected_contact_id()
 
-        self.update_contact_win = ContactForm(status="Update")
+        self.update_contact_win = ContactForm(self.repository,
+                                              self.photo_store,
+                                              status="Update")
         self.update_contact_win.setWindowModality(Qt.ApplicationModal)
         self.update_contact_win.setWindowTitle("Update Contact")
 
         ########################################################################
         # Populate update window with selected contact.
         ########################################################################
-        contact = self.get_contact(CONTACT_ID)
+        contact = self.repository.get(CONTACT_ID)
 
         # Update contact information widget
-        self.update_contact_win.NEW_CONTACT_IMAGE = contact[5]
-        self.update_contact_win.image_add.setPixmap(QPixmap(contact[5]))
-        self.update_contact_win.name_input.setText(contact[1])
-        self.update_contact_win.surname_input.setText(contact[2])
-        self.update_contact_win.phone_input.setText(contact[3])
-        self.update_contact_win.email_input.setText(contact[4])
-        self.update_contact_win.address_input.setText(contact[6])
-
-        # Once created the instance we can connect the custom signal.
-        self.update_contact_win.newContactClose.connect(self.on_closed_form_window)
+        self.update_contact_win.NEW_CONTACT_IMAGE = contact.image
+        self.update_contact_win.image_add.setPixmap(
+            self.pixmap_cache.get(contact.image, ContactForm.SIZE,
+                                  self.devicePixelRatioF()))
+        self.update_contact_win.name_input.setText(contact.name)
+        self.update_contact_win.surname_input.setText(contact.surname)
+        self.update_contact_win.phone_input.setText(contact.phone)
+        self.update_contact_win.email_input.setText(contact.email)
+        self.update_contact_win.address_input.setText(contact.address)
 
         self.update_contact_win.show()
 
     def update_contact_list(self):
-        """Updates contact_list widget with contact data."""
+        """Updates contact_list widget with contact data.
 
-        self.contact_list.clear()
+        The model reloads lazily, only the rows the view needs are read.
+        """
 
-        for contact in self.get_all_contacts():
-            compound_string = "{}-{} {}".format(str(contact[0]),
-                                                contact[1],
-                                                contact[2])
-            self.contact_list.addItem(compound_string)
+        with instrumentation.span("ui.update_contact_list"):
+            self.contact_model.refresh()
+            self.update_letters()
 
     def new_contact(self):
         """Launch NewContact window."""
-        self.new_contact_win = ContactForm()
+        self.new_contact_win = ContactForm(self.repository, self.photo_store)
         self.new_contact_win.setWindowModality(Qt.ApplicationModal)
         self.new_contact_win.setWindowTitle("Add New Contact")
 
-        # Once created the instance we can connect the custom signal.
-        self.new_contact_win.newContactClose.connect(self.update_contact_list)
-
         self.new_contact_win.show()
 
 
@@ -336,15 +1148,15 @@ class ContactForm(QWidget):
     # if there is no image selected.
     NEW_CONTACT_IMAGE = "icons/person.png"
 
-    # Image size for resize.
-    SIZE = (128, 128)
-
-    # Define a signal to connect on MainWindow.
-    newContactClose = pyqtSignal()
+    # Side of the square photos are shown in, the photo store keeps a
+    # rendition of this size.
+    SIZE = 128
 
-    def __init__(self, status="New"):
+    def __init__(self, repository, photo_store, status="New"):
         super().__init__()
 
+        self.repository = repository
+        self.photo_store = photo_store
         self.STATUS = status
 
         self.setWindowTitle("Algo")
@@ -355,12 +1167,6 @@ class ContactForm(QWidget):
         self.add_widgets()
         self.connect_signals()
 
-    def closeEvent(self, QCloseEvent):
-        """Override closeEvent method to be able to update my MainWindow."""
-
-        self.newContactClose.emit()
-        super(ContactForm, self).closeEvent(QCloseEvent)
-
     def add_widgets(self):
         """Add widgets to layouts"""
 
@@ -450,36 +1256,36 @@ class ContactForm(QWidget):
         self.buttonBox.accepted.connect(self.on_button_clicked)
         self.buttonBox.rejected.connect(self.close)
         self.load_image_button.clicked.connect(self.upload_image)
+        photo_signals.previewLoaded.connect(self.on_preview_loaded)
 
-    @staticmethod
-    def get_contact(in_id):
-        """Get contact info based on selected id.
+    def confirm_not_duplicate(self):
+        """Ask before adding a contact whose phone or email already exist.
 
         Return:
-            Return a tuple with contact information.
+            True if there is no similar contact or the user adds it anyway.
         """
 
-        sql_query = "SELECT * FROM Contacts WHERE id=?"
-        return cursor.execute(sql_query, (in_id,)).fetchone()
+        similar = self.repository.similar(self.phone_input.text(),
+                                          self.email_input.text())
 
-    def on_add(self):
-        """Execute when Add button has been pressed."""
+        if not similar:
+            return True
 
-        ########################################################################
-        # Creates and Save image in project directory.
-        ########################################################################
-        if self.NEW_CONTACT_IMAGE != "icons/person.png":
-            self.image_name = os.path.basename(self.NEW_CONTACT_IMAGE)
-            self.image = Image.open(self.NEW_CONTACT_IMAGE)
-            self.image_resized = self.image.resize(self.SIZE)
+        lines = ["{} {} ({}, {})".format(name, surname, phone, email)
+                 for _, name, surname, phone, email in similar]
 
-            new_image_name = "images/{}_{}".format(random.randint(1, 5000),
-                                                   self.image_name)
-            self.image_resized.save(new_image_name)
+        msg_box = QMessageBox.question(
+            self,
+            "Possible duplicate",
+            "These contacts have the same phone or email:\n\n{}\n\n"
+            "Add the contact anyway?".format("\n".join(lines)),
+            QMessageBox.Yes | QMessageBox.No,
+            QMessageBox.No)
 
-        else:
+        return msg_box == QMessageBox.Yes
 
-            new_image_name = self.NEW_CONTACT_IMAGE
+    def on_add(self):
+        """Execute when Add button has been pressed."""
 
         ########################################################################
         # Insert data in database.
@@ -487,20 +1293,28 @@ class ContactForm(QWidget):
         if (self.name_input.text() and self.surname_input.text() and
             self.phone_input.text()):
 
-            sql = '''INSERT INTO Contacts (name,
-                                           surname,
-                                           phone,
-                                           email,
-                                           image,
-                                           address)
-                                           VALUES(?, ?, ?, ?, ?, ?)'''
-            cursor.execute(sql, (self.name_input.text(),
-                                 self.surname_input.text(),
-                                 self.phone_input.text(),
-                                 self.email_input.text(),
-                                 new_image_name,
-                                 self.address_input.toPlainText()))
-            connection.commit()
+            if not self.confirm_not_duplicate():
+
+                return
+
+            contact_id = self.repository.insert(
+                Contact(None,
+                        self.name_input.text(),
+                        self.surname_input.text(),
+                        self.phone_input.text(),
+                        self.email_input.text(),
+                        "icons/person.png",
+                        self.address_input.toPlainText()))
+            contact_events.contactInserted.emit(contact_id)
+
+            ####################################################################
+            # Save image in the photo store, in background.
+            ####################################################################
+            if self.NEW_CONTACT_IMAGE != "icons/person.png":
+                store_photo(self.photo_store,
+                            self.repository,
+                            contact_id,
+                            self.NEW_CONTACT_IMAGE)
 
             ####################################################################
             # Confirm insertion and close window.
@@ -533,24 +1347,16 @@ class ContactForm(QWidget):
 
         global CONTACT_ID
 
-        contact = self.get_contact(CONTACT_ID)
+        contact = self.repository.get(CONTACT_ID)
 
-        if self.NEW_CONTACT_IMAGE == contact[5]:
+        # A new picture keeps the current one until it is stored.
+        if self.NEW_CONTACT_IMAGE in (contact.image, "icons/person.png"):
 
-            new_image_name = contact[5]
+            new_image_name = self.NEW_CONTACT_IMAGE
 
         else:
 
-            ####################################################################
-            # Creates and Save image in project directory.
-            ####################################################################
-            self.image_name = os.path.basename(self.NEW_CONTACT_IMAGE)
-            self.image = Image.open(self.NEW_CONTACT_IMAGE)
-            self.image_resized = self.image.resize(self.SIZE)
-
-            new_image_name = "images/{}_{}".format(random.randint(1, 5000),
-                                                   self.image_name)
-            self.image_resized.save(new_image_name)
+            new_image_name = contact.image
 
         ########################################################################
         # Insert data in database.
@@ -558,23 +1364,24 @@ class ContactForm(QWidget):
         if (self.name_input.text() and self.surname_input.text() and
             self.phone_input.text()):
 
-            sql_query = '''UPDATE Contacts set name=?,
-                                               surname=?,
-                                               phone=?,
-                                               email=?,
-                                               image=?,
-                                               address=?
-                                               WHERE id=?'''
-
-            cursor.execute(sql_query, (self.name_input.text(),
-                                       self.surname_input.text(),
-                                       self.phone_input.text(),
-                                       self.email_input.text(),
-                                       new_image_name,
-                                       self.address_input.toPlainText(),
-                                       CONTACT_ID))
+            self.repository.update(
+                Contact(CONTACT_ID,
+                        self.name_input.text(),
+                        self.surname_input.text(),
+                        self.phone_input.text(),
+                        self.email_input.text(),
+                        new_image_name,
+                        self.address_input.toPlainText()))
+            contact_events.contactUpdated.emit(CONTACT_ID)
 
-            connection.commit()
+            ####################################################################
+            # Save image in the photo store, in background.
+            ####################################################################
+            if new_image_name != self.NEW_CONTACT_IMAGE:
+                store_photo(self.photo_store,
+                            self.repository,
+                            CONTACT_ID,
+                            self.NEW_CONTACT_IMAGE)
 
             ####################################################################
             # Confirm Update and close window.
@@ -605,18 +1412,39 @@ class ContactForm(QWidget):
 
             return
 
-        # Display selected / uploaded image in widget.
-        pixmap = QPixmap(self.NEW_CONTACT_IMAGE)
-        resized_pixmap = pixmap.scaledToHeight(128)
-        self.image_add.setPixmap(resized_pixmap)
+        # Display selected / uploaded image in widget once decoded.
+        load_preview(self.NEW_CONTACT_IMAGE, self.SIZE)
+
+    def on_preview_loaded(self, path, image):
+        """Display a decoded preview if it is still the selected image.
+
+        Args:
+            path: Path of the decoded picture.
+            image: QImage scaled to fit the preview.
+        """
+
+        if path == self.NEW_CONTACT_IMAGE and not image.isNull():
+            self.image_add.setPixmap(QPixmap.fromImage(image))
 
 
 def main():
-    """Creates an instance of MainWindow and shows UI."""
+    """Creates an instance of MainWindow and shows UI.
+
+    The window is shown with the snapshot of the last session first, the
+    database is opened, and created if it does not exist, in background.
+    """
 
+    start = time.perf_counter()
     app = QApplication(sys.argv)
-    win = MainWindow()
+
+    session = Session(session_path(DATABASE))
+    session.load()
+
+    win = MainWindow(None, PhotoStore(), session)
     win.show()
+    QTimer.singleShot(0, lambda: instrumentation.record(
+        "startup.first_paint", time.perf_counter() - start))
+    open_database(DATABASE, session)
     sys.exit(app.exec_())
 
 
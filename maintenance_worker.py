@@ -0,0 +1,111 @@
+# maintenance_worker.py
+
+"""Background checks, backups and compaction of the agenda database.
+
+The work of agenda.maintenance runs on the global QThreadPool while the
+app keeps using the database. Results come back to the GUI thread through
+the signals of maintenance_signals.
+"""
+
+import os
+import sqlite3
+import time
+
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal
+
+from agenda.maintenance import list_backups
+
+
+class MaintenanceSignals(QObject):
+    """Signals emitted when background maintenance is done."""
+
+    # Problems found by the quick check, missing pictures as tuples
+    # (path, number of contacts) and the path of the new backup, "" if
+    # none was made.
+    checkFinished = pyqtSignal(list, list, str)
+
+    # Error message of a check or backup that could not run.
+    maintenanceFailed = pyqtSignal(str)
+
+
+# Shared instance, it lives in the GUI thread.
+maintenance_signals = MaintenanceSignals()
+
+
+class CheckTask(QRunnable):
+    """Runnable checking the database, then backing it up if it is sound.
+
+    A backup is only made when the last one is older than BACKUP_INTERVAL,
+    and never of a database failing its check, so damage does not rotate
+    the good backups out.
+    """
+
+    # Seconds between two backups.
+    BACKUP_INTERVAL = 24 * 60 * 60
+
+    def __init__(self, repository):
+        super().__init__()
+
+        self.repository = repository
+
+    def backup_due(self):
+        """Tell if the last backup is older than BACKUP_INTERVAL."""
+
+        backups = list_backups(self.repository.pool.path)
+
+        return not backups or (time.time() - os.path.getmtime(backups[-1])
+                               > self.BACKUP_INTERVAL)
+
+    def run(self):
+        """Check the database and pictures, back up and report."""
+
+        try:
+            problems = self.repository.quick_check()
+            missing = self.repository.missing_images()
+            backup = ""
+
+            if not problems and self.backup_due():
+                backup = self.repository.backup()
+
+        except (OSError, ValueError, sqlite3.Error) as error:
+            maintenance_signals.maintenanceFailed.emit(str(error))
+
+            return
+
+        finally:
+            self.repository.pool.release()
+
+        maintenance_signals.checkFinished.emit(problems, missing, backup)
+
+
+class VacuumTask(QRunnable):
+    """Runnable giving the free pages of the database back to the disk."""
+
+    def __init__(self, repository):
+        super().__init__()
+
+        self.repository = repository
+
+    def run(self):
+        """Reclaim the free pages by small steps."""
+
+        try:
+            self.repository.reclaim_space()
+
+        except sqlite3.Error as error:
+            maintenance_signals.maintenanceFailed.emit(str(error))
+
+        finally:
+            self.repository.pool.release()
+
+
+def check_database(repository):
+    """Check and back up the database in background, see CheckTask."""
+
+    QThreadPool.globalInstance().start(CheckTask(repository))
+
+
+def compact_database(repository):
+    """Reclaim free pages in background, see VacuumTask."""
+
+    QThreadPool.globalInstance().start(VacuumTask(repository))
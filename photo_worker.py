@@ -0,0 +1,212 @@
+# photo_worker.py
+
+"""Background decoding and resizing of contact photos.
+
+Photos are read and written on the global QThreadPool so picking a large
+camera picture never blocks the UI. Results come back to the GUI thread
+through the signals of photo_signals.
+"""
+
+import logging
+import sqlite3
+
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, Qt, pyqtSignal
+from PyQt5.QtGui import QImage, QImageReader
+
+from agenda.contact_io import store_imported_photos
+from agenda.instrumentation import instrumentation
+from agenda.photo_store import PICTURE_ERRORS
+
+logger = logging.getLogger(__name__)
+
+
+@instrumentation.timed("photo.preview")
+def read_preview(path, side):
+    """Decode a picture scaled down to fit a square, keeping its aspect.
+
+    Return:
+        A QImage, null if the picture can not be read.
+    """
+
+    reader = QImageReader(path)
+    reader.setAutoTransform(True)
+    size = reader.size()
+
+    # Let the image plugin decode straight to the small size when it can.
+    if size.isValid() and (size.width() > side or size.height() > side):
+        reader.setScaledSize(size.scaled(side, side, Qt.KeepAspectRatio))
+
+    return reader.read()
+
+
+class PhotoSignals(QObject):
+    """Signals emitted when background photo work is done."""
+
+    # Contact id and store path of a photo saved for that contact.
+    photoStored = pyqtSignal(int, str)
+
+    # Source path and error message of a photo that could not be saved.
+    photoFailed = pyqtSignal(str, str)
+
+    # Source path and decoded image of a preview.
+    previewLoaded = pyqtSignal(str, QImage)
+
+    # Path and full size decoded image of a picture.
+    imageLoaded = pyqtSignal(str, QImage)
+
+    # Number of stored and failed pictures of imported contacts.
+    importedPhotosStored = pyqtSignal(int, int)
+
+    # Error message of imported pictures or a photo collection that
+    # could not finish.
+    photoWorkFailed = pyqtSignal(str)
+
+
+# Shared instance, it lives in the GUI thread.
+photo_signals = PhotoSignals()
+
+
+class StorePhotoTask(QRunnable):
+    """Runnable adding a picture to the photo store and to a contact."""
+
+    def __init__(self, store, repository, contact_id, source):
+        super().__init__()
+
+        self.store = store
+        self.repository = repository
+        self.contact_id = contact_id
+        self.source = source
+
+    def run(self):
+        """Store the photo, link it to the contact and report the result."""
+
+        try:
+            path = self.store.put(self.source)
+            self.repository.set_image(self.contact_id, path)
+
+        # An error escaping run() would abort the app.
+        except PICTURE_ERRORS + (sqlite3.Error,) as error:
+            photo_signals.photoFailed.emit(self.source, str(error))
+
+            return
+
+        finally:
+            self.repository.pool.release()
+
+        photo_signals.photoStored.emit(self.contact_id, path)
+
+
+class ImportedPhotosTask(QRunnable):
+    """Runnable adding the pictures of imported contacts to the store."""
+
+    def __init__(self, store, repository):
+        super().__init__()
+
+        self.store = store
+        self.repository = repository
+
+    def run(self):
+        """Store the pending pictures and report the result."""
+
+        try:
+            stored, failed = store_imported_photos(self.repository,
+                                                   self.store)
+
+        except (OSError, sqlite3.Error) as error:
+            logger.exception("Pictures of imported contacts not stored")
+            photo_signals.photoWorkFailed.emit(str(error))
+
+            return
+
+        finally:
+            self.repository.pool.release()
+
+        photo_signals.importedPhotosStored.emit(stored, failed)
+
+
+class GarbageTask(QRunnable):
+    """Runnable removing photos no contact references anymore."""
+
+    def __init__(self, store, repository):
+        super().__init__()
+
+        self.store = store
+        self.repository = repository
+
+    def run(self):
+        """Collect the unreferenced photos of the store."""
+
+        try:
+            self.store.collect_garbage(self.repository.connection())
+
+        except (OSError, sqlite3.Error) as error:
+            logger.exception("Unused photos not collected")
+            photo_signals.photoWorkFailed.emit(str(error))
+
+        finally:
+            self.repository.pool.release()
+
+
+class PreviewTask(QRunnable):
+    """Runnable decoding a picture for display in a form."""
+
+    def __init__(self, path, side):
+        super().__init__()
+
+        self.path = path
+        self.side = side
+
+    def run(self):
+        """Decode the picture and report it."""
+
+        photo_signals.previewLoaded.emit(self.path,
+                                         read_preview(self.path, self.side))
+
+
+class ImageTask(QRunnable):
+    """Runnable decoding a picture at full size ahead of its display."""
+
+    def __init__(self, path):
+        super().__init__()
+
+        self.path = path
+
+    def run(self):
+        """Decode the picture and report it."""
+
+        with instrumentation.span("photo.decode"):
+            image = QImage(self.path)
+
+        photo_signals.imageLoaded.emit(self.path, image)
+
+
+def store_photo(store, repository, contact_id, source):
+    """Store the photo of a contact in the background, see StorePhotoTask."""
+
+    QThreadPool.globalInstance().start(
+        StorePhotoTask(store, repository, contact_id, source))
+
+
+def store_imported(store, repository):
+    """Store pictures of imported contacts, see ImportedPhotosTask."""
+
+    QThreadPool.globalInstance().start(
+        ImportedPhotosTask(store, repository))
+
+
+def collect_photos(store, repository):
+    """Remove unreferenced photos in the background, see GarbageTask."""
+
+    QThreadPool.globalInstance().start(GarbageTask(store, repository))
+
+
+def load_preview(path, side):
+    """Decode a preview in the background, see read_preview."""
+
+    QThreadPool.globalInstance().start(PreviewTask(path, side))
+
+
+def load_image(path):
+    """Decode a picture in the background, see ImageTask."""
+
+    QThreadPool.globalInstance().start(ImageTask(path))
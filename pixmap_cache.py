@@ -0,0 +1,239 @@
+# pixmap_cache.py
+
+"""Cache of decoded contact photos for the agenda app."""
+
+import math
+import os
+
+from PyQt5.QtCore import Qt
+from PyQt5.QtGui import QPixmap
+
+from agenda.instrumentation import instrumentation
+from agenda.lru_cache import LRUCache
+from agenda.photo_store import rendition_path
+from contact_events import contact_events
+from photo_worker import load_image, photo_signals
+
+# Marks a path whose file was not looked at yet.
+UNKNOWN = object()
+
+
+class PixmapCache:
+    """Keeps recently displayed photos decoded in memory.
+
+    Entries are keyed by path and modification time, so a photo rewritten
+    on disk is decoded again. Pinned photos, like the default contact
+    icon, are never evicted. Photos can be decoded ahead of their display
+    with prefetch(), and thumbnail() gives small copies for the contact
+    list. Both get() and thumbnail() read the smallest stored rendition
+    that fills the requested size in device pixels, see
+    agenda.photo_store.rendition_path().
+
+    The modification time of every file is remembered, so painting the
+    list does not touch the disk. It is read again after a contact or
+    photo changes, see forget_files().
+    """
+
+    # Number of photos kept besides the pinned ones.
+    CACHE_SIZE = 128
+
+    # Number of scaled down photos kept for the contact list.
+    THUMBNAIL_CACHE_SIZE = 512
+
+    # Number of files whose modification time is remembered.
+    FILE_CACHE_SIZE = 4096
+
+    def __init__(self, max_size=CACHE_SIZE):
+        self._cache = LRUCache(max_size)
+        self._thumbnails = LRUCache(self.THUMBNAIL_CACHE_SIZE)
+        self._pinned = {}
+        self._pending = set()
+        self._files = LRUCache(self.FILE_CACHE_SIZE)
+
+        photo_signals.imageLoaded.connect(self.on_image_loaded)
+        photo_signals.photoStored.connect(self.forget_files)
+        contact_events.contactUpdated.connect(self.forget_files)
+        contact_events.contactsUpdated.connect(self.forget_files)
+
+    @staticmethod
+    def file_key(path):
+        """Read the cache key of a photo from the disk.
+
+        Return:
+            A tuple (path, mtime) or None if the file does not exist.
+        """
+
+        try:
+            return path, os.stat(path).st_mtime_ns
+        except (OSError, TypeError, ValueError):
+            return None
+
+    def key(self, path):
+        """Get the cache key of a photo, see file_key().
+
+        The file is only looked at the first time, or again after
+        forget_files().
+        """
+
+        key = self._files.get(path, UNKNOWN)
+
+        if key is UNKNOWN:
+            key = self.file_key(path)
+            self._files.put(path, key)
+
+        return key
+
+    def forget_files(self, *_):
+        """Look at the files again, photos may have been written or changed.
+
+        Connected to the signals of changed contacts and stored photos,
+        their arguments are not needed.
+        """
+
+        self._files.clear()
+
+    def resolve(self, path, side, ratio=1.0):
+        """Get the file to decode to fill a square of a given side.
+
+        Args:
+            path: Path of the photo, as stored in Contacts.
+            side: Side of the square in logical pixels, None for the
+                largest rendition.
+            ratio: Device pixel ratio of the widget.
+
+        Return:
+            The path of the rendition, or path if it has none.
+        """
+
+        if side is None or path in self._pinned:
+            return path
+
+        rendition = rendition_path(path, math.ceil(side * ratio))
+
+        if rendition != path and self.key(rendition) is None:
+            return path
+
+        return rendition
+
+    def pin(self, path):
+        """Decode a photo and keep it for the lifetime of the cache."""
+
+        self._pinned[path] = QPixmap(path)
+
+    def get(self, path, side=None, ratio=1.0):
+        """Get the decoded photo of a path, decoding it if needed.
+
+        Args:
+            path: Path of the photo.
+            side: Side of the square the photo is shown in, None for the
+                largest rendition.
+            ratio: Device pixel ratio of the widget.
+
+        Return:
+            A QPixmap, null if the photo can not be read.
+        """
+
+        if path in self._pinned:
+            return self._pinned[path]
+
+        path = self.resolve(path, side, ratio)
+        key = self.key(path)
+
+        if key is None:
+            return QPixmap()
+
+        pixmap = self._cache.get(key)
+
+        if pixmap is None:
+            with instrumentation.span("pixmap.decode"):
+                pixmap = QPixmap(path)
+
+            self._cache.put(key, pixmap)
+
+        if ratio != 1.0:
+            pixmap = QPixmap(pixmap)
+            pixmap.setDevicePixelRatio(ratio)
+
+        return pixmap
+
+    def thumbnail(self, path, size, ratio=1.0):
+        """Get a photo scaled down to fit a square, without blocking.
+
+        Photos that are not decoded yet are decoded in the background, see
+        prefetch(), and photo_signals.imageLoaded tells when to ask again.
+
+        Args:
+            path: Path of the photo.
+            size: Side of the square in logical pixels.
+            ratio: Device pixel ratio of the widget.
+
+        Return:
+            A QPixmap or None if the photo is not decoded yet.
+        """
+
+        path = self.resolve(path, size, ratio)
+        pixels = math.ceil(size * ratio)
+        key = ((path, pixels) if path in self._pinned
+               else (self.key(path), pixels))
+        thumbnail = self._thumbnails.get(key)
+
+        if thumbnail is not None:
+            return thumbnail
+
+        pixmap = self._pinned.get(path)
+
+        if pixmap is None and key[0] is not None:
+            pixmap = self._cache.get(key[0])
+
+        if pixmap is None:
+            self.prefetch((path,))
+
+            return None
+
+        # A rendition of the right size is used as it is.
+        if pixmap.width() > pixels or pixmap.height() > pixels:
+            thumbnail = pixmap.scaled(pixels, pixels, Qt.KeepAspectRatio,
+                                      Qt.SmoothTransformation)
+        else:
+            thumbnail = QPixmap(pixmap)
+
+        thumbnail.setDevicePixelRatio(ratio)
+        self._thumbnails.put(key, thumbnail)
+
+        return thumbnail
+
+    def prefetch(self, paths):
+        """Decode photos in the background if they are not cached yet.
+
+        Args:
+            paths: Iterable of photo paths.
+        """
+
+        for path in paths:
+            if path in self._pinned or path in self._pending:
+                continue
+
+            key = self.key(path)
+
+            if key is None or key in self._cache:
+                continue
+
+            self._pending.add(path)
+            load_image(path)
+
+    def on_image_loaded(self, path, image):
+        """Store a photo decoded by prefetch().
+
+        Args:
+            path: Path of the photo.
+            image: Decoded QImage, null if the photo can not be read.
+        """
+
+        if path not in self._pending:
+            return
+
+        self._pending.discard(path)
+        key = self.key(path)
+
+        if key is not None and not image.isNull():
+            self._cache.put(key, QPixmap.fromImage(image))
@@ -0,0 +1,96 @@
+# startup_worker.py
+
+"""Background opening of the agenda database at startup.
+
+The main window is shown before the database is opened. StartupTask
+opens it on the global QThreadPool, migrations included, and streams the
+first pages of the contact list back to the GUI thread through the
+signals of startup_signals.
+"""
+
+import sqlite3
+
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal
+
+from agenda.instrumentation import instrumentation
+from agenda.repository import ContactRepository
+from contact_list_model import ContactListModel
+
+
+class StartupSignals(QObject):
+    """Signals emitted while the database is opened in background."""
+
+    # Open ContactRepository, the list pages follow.
+    repositoryOpened = pyqtSignal(object)
+
+    # (sort_key, id) the list starts after, sent before the first page.
+    listStarted = pyqtSignal(tuple)
+
+    # Page of contact list rows, see ContactRepository.list_page().
+    rowsLoaded = pyqtSignal(list)
+
+    # Sent after the last page, True if the whole list was read.
+    listLoaded = pyqtSignal(bool)
+
+    # Error message if the database could not be opened or read.
+    startupFailed = pyqtSignal(str)
+
+
+# Shared instance, it lives in the GUI thread.
+startup_signals = StartupSignals()
+
+
+class StartupTask(QRunnable):
+    """Runnable opening the database and reading the list of a session.
+
+    The list starts at the saved top row with a single seek, like the
+    jump index, the rows above are read backwards by the model.
+    """
+
+    def __init__(self, database, session):
+        super().__init__()
+
+        self.database = database
+        self.session = session
+
+    def run(self):
+        """Open the database and stream the first pages of the list."""
+
+        repository = None
+
+        try:
+            with instrumentation.span("startup.open_database"):
+                repository = ContactRepository(self.database)
+
+            startup_signals.repositoryOpened.emit(repository)
+            self.load_list(repository)
+
+        except (OSError, sqlite3.Error) as error:
+            startup_signals.startupFailed.emit(str(error))
+
+        finally:
+            if repository is not None:
+                repository.pool.release()
+
+    def load_list(self, repository):
+        """Read the first page of the list, from the saved top row."""
+
+        start = self.session.start
+        top = self.session.top
+
+        if top is not None and top > start:
+            # Just before the top row, ids are integers. The rows above
+            # are read backwards once the list is shown.
+            start = (top[0], top[1] - 1)
+
+        startup_signals.listStarted.emit(start)
+        page = repository.list_page(start, ContactListModel.BATCH_SIZE)
+        startup_signals.rowsLoaded.emit(page)
+        startup_signals.listLoaded.emit(
+            len(page) < ContactListModel.BATCH_SIZE)
+
+
+def open_database(database, session):
+    """Open the database in the background, see StartupTask."""
+
+    QThreadPool.globalInstance().start(StartupTask(database, session))